@@ -0,0 +1,367 @@
+"""FAISS index factory for the vector store: flat, IVF-Flat, IVF-PQ, HNSW and
+scalar-quantized (SQ8, fp16).
+
+All kinds use inner product on L2-normalized vectors (cosine). ANN kinds that
+need training start out as a flat index and are trained from the stored
+vectors once ``ANN_MIN_VECTORS`` exist, so nothing has to be re-embedded.
+The vector store wraps every kind in ``IndexIDMap2`` so labels are stable
+chunk ids rather than row positions. Quantized kinds can re-score their top
+candidates exactly from the float32 side file kept by ``app/exact.py``.
+
+    python -m app.ann bench [--index-dir DIR] [-k 10]   # recall@k / latency vs flat
+    python -m app.ann migrate --index-dir DIR --type sq8
+"""
+import os, math, time, argparse, logging
+from typing import Dict, List, Optional
+import numpy as np
+import faiss
+from . import exact, snapshots
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf", "ivfpq", "hnsw", "sq8", "fp16")
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat").lower()
+ANN_MIN_VECTORS = int(os.getenv("ANN_MIN_VECTORS", "10000"))
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))  # 0 = about 4 * sqrt(n)
+PQ_M = int(os.getenv("PQ_M", "0"))  # 0 = one sub-quantizer per 8 dims
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+NPROBE = int(os.getenv("NPROBE", "16"))
+EF_SEARCH = int(os.getenv("EF_SEARCH", "64"))
+# lossy kinds fetch top_k * RESCORE_FACTOR candidates and re-rank them with the
+# float32 vectors; 0 disables re-scoring and the side file
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", "4"))
+
+def auto_nlist(n: int) -> int:
+    # at least 39 training points per centroid, as FAISS recommends
+    return max(1, min(int(4 * math.sqrt(max(n, 1))), n // 39 or 1))
+
+def _pq_m(dim: int, m: int) -> int:
+    # PQ sub-quantizers must divide the dimension
+    m = min(m or max(1, dim // 8), dim)
+    while dim % m:
+        m -= 1
+    return m
+
+def factory_string(kind: str, dim: int, n: int = 0) -> str:
+    """``faiss.index_factory`` description for ``kind``."""
+    nlist = IVF_NLIST or auto_nlist(n)
+    if kind == "flat":
+        return "Flat"
+    if kind == "ivf":
+        return f"IVF{nlist},Flat"
+    if kind == "ivfpq":
+        # fewer bits per code on small corpora so each codebook stays trainable
+        nbits = max(4, min(8, int(math.log2(max(n, 1) / 39)))) if n else 8
+        return f"IVF{nlist},PQ{_pq_m(dim, PQ_M)}x{nbits}"
+    if kind == "hnsw":
+        return f"HNSW{HNSW_M},Flat"
+    if kind == "sq8":
+        return "SQ8"
+    if kind == "fp16":
+        return "SQfp16"
+    raise ValueError(f"Unknown index type {kind!r}; expected one of {', '.join(INDEX_TYPES)}")
+
+def unwrap(index):
+    """The ANN index inside an ``IndexIDMap2`` wrapper (or ``index`` itself)."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+def with_ids(index, ids: Optional[np.ndarray] = None):
+    """Wrap ``index`` in ``IndexIDMap2``; existing rows get ``ids`` (default 0..n-1).
+
+    FAISS only wraps empty indexes, so the id map of a populated one is
+    filled in directly. Used for snapshots written before chunk ids existed.
+    """
+    if isinstance(faiss.downcast_index(index), faiss.IndexIDMap2):
+        return index
+    if index.ntotal == 0:
+        return faiss.IndexIDMap2(index)
+    ids = np.arange(index.ntotal, dtype="int64") if ids is None else np.ascontiguousarray(ids, dtype="int64")
+    wrapped = faiss.IndexIDMap2(faiss.IndexFlatIP(index.d))
+    wrapped.index = index
+    wrapped.own_fields = False
+    wrapped.referenced_objects = [index]
+    faiss.copy_array_to_vector(ids, wrapped.id_map)
+    wrapped.ntotal = index.ntotal
+    wrapped.construct_rev_map()
+    return wrapped
+
+def index_ids(index) -> np.ndarray:
+    """Chunk ids of an ``IndexIDMap2`` in storage order."""
+    return faiss.vector_to_array(faiss.downcast_index(index).id_map)
+
+def index_kind(index) -> str:
+    index = unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "flat"
+
+def needs_training(kind: str) -> bool:
+    # SQ8 learns a per-dimension range, so it waits for a representative sample
+    return kind in ("ivf", "ivfpq", "sq8")
+
+def is_lossy(kind: str) -> bool:
+    """True for kinds that store compressed vectors (scores are approximate)."""
+    return kind in ("ivfpq", "sq8", "fp16")
+
+def index_is_lossy(index) -> bool:
+    """True when ``index`` holds compressed codes (including a serving layout)."""
+    inner = unwrap(index)
+    return isinstance(inner, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer, faiss.IndexIVFPQ))
+
+def in_place(kind: str) -> bool:
+    """Kinds whose rows are contiguous codes, so removal compacts them in place."""
+    return kind in ("flat", "sq8", "fp16")
+
+def should_build(index, kind: str) -> bool:
+    """True when ``index`` is flat, ``kind`` is an ANN kind and enough vectors exist."""
+    if index is None or kind == "flat" or index_kind(index) != "flat":
+        return False
+    return index.ntotal >= (ANN_MIN_VECTORS if needs_training(kind) else 1)
+
+def new_index(kind: str, dim: int, n: int = 0) -> "faiss.Index":
+    """Empty (untrained) ``kind`` index sized for ``n`` vectors."""
+    index = faiss.index_factory(dim, factory_string(kind, dim, n), faiss.METRIC_INNER_PRODUCT)
+    if kind == "hnsw":
+        faiss.downcast_index(index).hnsw.efSearch = EF_SEARCH
+    return index
+
+def empty_index(kind: str, dim: int) -> "faiss.Index":
+    """Id-mapped index to start a new store with; kinds that need training start flat."""
+    if kind in ("hnsw", "fp16"):
+        return faiss.IndexIDMap2(new_index(kind, dim))
+    factory_string(kind, dim)  # validate
+    return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+def serving_index(index) -> Optional["faiss.Index"]:
+    """Copy of ``index`` in a layout FAISS can memory-map, or None (HNSW).
+
+    FAISS maps only IVF inverted lists (``IO_FLAG_MMAP``), so flat and
+    scalar-quantized indexes are re-laid out as a single-list IVF with the
+    same codes and the chunk ids stored in the list: searching it scans every
+    code exactly like the original. IVF kinds are returned as they are.
+    """
+    kind = index_kind(index)
+    if kind in ("ivf", "ivfpq"):
+        return index
+    if not in_place(kind):
+        return None
+    inner = unwrap(index)
+    quantizer = faiss.IndexFlatIP(index.d)
+    quantizer.add(np.zeros((1, index.d), dtype="float32"))
+    if kind == "flat":
+        out = faiss.IndexIVFFlat(quantizer, index.d, 1, faiss.METRIC_INNER_PRODUCT)
+    else:
+        out = faiss.IndexIVFScalarQuantizer(quantizer, index.d, 1, inner.sq.qtype, faiss.METRIC_INNER_PRODUCT, False)
+        out.sq = inner.sq
+    out.own_fields = True
+    quantizer.this.disown()
+    out.is_trained = True
+    ids = np.ascontiguousarray(index_ids(index), dtype="int64")
+    if len(ids):
+        codes = faiss.vector_to_array(inner.codes)
+        out.invlists.add_entries(0, len(ids), faiss.swig_ptr(ids), faiss.swig_ptr(codes))
+        out.ntotal = len(ids)
+    return out
+
+def read_serving(path: str) -> "faiss.Index":
+    """Open an index read-only, memory-mapping whatever FAISS can map."""
+    return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+def max_id(index) -> int:
+    """Largest chunk id in an id-mapped or IVF index (-1 when empty)."""
+    if not index.ntotal:
+        return -1
+    if isinstance(faiss.downcast_index(index), (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return int(index_ids(index).max())
+    invlists = faiss.extract_index_ivf(index).invlists
+    best = -1
+    for l in range(invlists.nlist):
+        n = invlists.list_size(l)
+        if n:
+            best = max(best, int(faiss.rev_swig_ptr(invlists.get_ids(l), n).max()))
+    return best
+
+def reconstruct_all(index, start: int = 0) -> np.ndarray:
+    """Stored vectors from storage row ``start`` on (exact for flat/HNSW, approximate for PQ)."""
+    index = unwrap(index)
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(start, index.ntotal - start)
+
+def reconstruct(index, chunk_id: int) -> np.ndarray:
+    """Stored vector of one chunk id of an id-mapped index."""
+    inner = unwrap(index)
+    if isinstance(inner, faiss.IndexIVF) and inner.direct_map.no():
+        inner.make_direct_map()
+    return index.reconstruct(int(chunk_id))
+
+def build_index(kind: str, vectors: np.ndarray, ids: Optional[np.ndarray] = None) -> "faiss.Index":
+    """New ``kind`` index trained on and filled with ``vectors``, id-mapped when ``ids`` is given."""
+    index = new_index(kind, vectors.shape[1], len(vectors))
+    if not index.is_trained:
+        index.train(vectors)
+    if ids is None:
+        index.add(vectors)
+        return index
+    index = faiss.IndexIDMap2(index)
+    index.add_with_ids(vectors, np.ascontiguousarray(ids, dtype="int64"))
+    return index
+
+def remove_ids(index, ids) -> "faiss.Index":
+    """``index`` without ``ids``.
+
+    Only flat and scalar-quantized indexes are compacted in place: ``IndexIDMap2`` assumes the inner
+    index renumbers its rows on removal, which IVF does not, and HNSW cannot
+    remove at all. Those kinds are refilled with their remaining vectors; IVF
+    keeps its trained quantizer, so nothing is retrained.
+    """
+    ids = np.asarray(sorted(ids), dtype="int64")
+    kind = index_kind(index)
+    if in_place(kind):
+        index.remove_ids(faiss.IDSelectorBatch(ids))
+        return index
+    all_ids = index_ids(index)
+    keep = ~np.isin(all_ids, ids)
+    vectors = reconstruct_all(index)[keep]
+    if kind == "hnsw":
+        return build_index("hnsw", vectors, all_ids[keep]) if len(vectors) else empty_index("hnsw", index.d)
+    inner = faiss.clone_index(unwrap(index))
+    inner.reset()
+    out = faiss.IndexIDMap2(inner)
+    if len(vectors):
+        out.add_with_ids(vectors, all_ids[keep])
+    return out
+
+def search_params(index, sel=None, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """SearchParameters matching the index kind, with the role selector attached."""
+    kind = index_kind(index)
+    if kind in ("ivf", "ivfpq"):
+        return faiss.SearchParametersIVF(sel=sel, nprobe=nprobe or NPROBE)
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=ef_search or EF_SEARCH)
+    return faiss.SearchParameters(sel=sel)
+
+def rescore(query: np.ndarray, ids: np.ndarray, vectors: np.ndarray, k: int):
+    """Candidate ``ids`` re-ranked by exact inner product of ``query`` with their
+    float32 ``vectors``; returns the top ``k`` as ``(scores, ids)``."""
+    scores = vectors @ query
+    order = np.argsort(-scores, kind="stable")[:k]
+    return scores[order], ids[order]
+
+def index_bytes(index) -> int:
+    """Serialized size of ``index``, about what it keeps resident."""
+    return int(faiss.serialize_index(index).nbytes)
+
+def benchmark(vectors: np.ndarray, queries: np.ndarray, k: int = 10,
+              kinds: List[str] = ("ivf", "ivfpq", "hnsw", "sq8", "fp16"),
+              nprobes: List[int] = (4, 16, 64), efs: List[int] = (32, 64, 128),
+              rescore_factor: int = RESCORE_FACTOR) -> List[Dict]:
+    """Recall@k, mean query latency and index size of each ANN setting against
+    exact flat search. Lossy kinds get a second row re-scored from ``vectors``."""
+    flat = build_index("flat", vectors)
+    t0 = time.perf_counter()
+    _, truth = flat.search(queries, k)
+    rows = [{"index": "flat", "param": "-", "recall": 1.0,
+             "ms": 1000 * (time.perf_counter() - t0) / len(queries), "mb": index_bytes(flat) / 2**20}]
+    for kind in kinds:
+        index = build_index(kind, vectors)
+        mb = index_bytes(index) / 2**20
+        if kind == "hnsw":
+            settings = [(f"efSearch={p}", search_params(index, ef_search=p)) for p in efs]
+        elif kind in ("ivf", "ivfpq"):
+            settings = [(f"nprobe={p}", search_params(index, nprobe=p)) for p in nprobes]
+        else:
+            settings = [("-", None)]
+        factors = (1, rescore_factor) if is_lossy(kind) and rescore_factor > 1 else (1,)
+        for param, params in settings:
+            for factor in factors:
+                t0 = time.perf_counter()
+                _, found = index.search(queries, k * factor, params=params)
+                if factor > 1:
+                    found = [rescore(q, f[f >= 0], vectors[f[f >= 0]], k)[1]
+                             for q, f in zip(queries, found)]
+                ms = 1000 * (time.perf_counter() - t0) / len(queries)
+                recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+                rows.append({"index": kind, "param": param if factor == 1 else f"rescore x{factor}",
+                             "recall": float(recall), "ms": ms, "mb": mb})
+    return rows
+
+def _stored_vectors(index_dir: str):
+    """Chunk ids and vectors of ``index_dir``, exact from ``vectors.npy`` when the
+    index is lossy and the side file covers it."""
+    index = with_ids(faiss.read_index(os.path.join(index_dir, "index.faiss")))
+    ids = index_ids(index)
+    if not is_lossy(index_kind(index)):
+        return ids, reconstruct_all(index)
+    side = exact.ExactVectors(os.path.join(index_dir, exact.FILENAME))
+    vectors = side.get(ids) if len(side) else None
+    if vectors is None:
+        logger.warning(f"{index_dir} has no float32 copy of its {index_kind(index)} vectors; they are approximate")
+        vectors = reconstruct_all(index)
+    return ids, vectors
+
+def _main():
+    ap = argparse.ArgumentParser(prog="python -m app.ann")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("bench", help="recall@k, latency and size against flat")
+    b.add_argument("--index-dir", help="benchmark the vectors of an existing index.faiss")
+    b.add_argument("-n", type=int, default=50000, help="synthetic corpus size without --index-dir")
+    b.add_argument("--dim", type=int, default=384)
+    b.add_argument("--queries", type=int, default=200)
+    b.add_argument("-k", type=int, default=10)
+    m = sub.add_parser("migrate", help="publish a snapshot generation with index.faiss rebuilt as another "
+                                         "index type (and its vectors.npy)")
+    m.add_argument("--index-dir", required=True)
+    m.add_argument("--type", required=True, choices=INDEX_TYPES)
+    args = ap.parse_args()
+
+    gen = snapshots.current(args.index_dir) if args.index_dir else None
+    src = snapshots.path(args.index_dir, gen) if gen is not None else args.index_dir
+    if args.cmd == "bench":
+        rng = np.random.default_rng(0)
+        if args.index_dir:
+            vectors = _stored_vectors(src)[1]
+        else:
+            vectors = rng.standard_normal((args.n, args.dim)).astype("float32")
+        faiss.normalize_L2(vectors)
+        queries = vectors[rng.choice(len(vectors), args.queries)] + rng.normal(0, 0.05, (args.queries, vectors.shape[1])).astype("float32")
+        faiss.normalize_L2(queries)
+        print(f"{len(vectors)} vectors, dim {vectors.shape[1]}, recall@{args.k}")
+        for r in benchmark(vectors, queries, args.k):
+            print(f"{r['index']:6s} {r['param']:13s} recall={r['recall']:.3f} {r['ms']:.3f} ms/query "
+                  f"{r['mb']:8.1f} MB")
+    else:
+        ids, vectors = _stored_vectors(src)
+        new = build_index(args.type, vectors, ids)
+        # a directory from before generations is rewritten in place
+        out = snapshots.stage(args.index_dir) if gen is not None else args.index_dir
+        side = os.path.join(out, exact.FILENAME)
+        if is_lossy(args.type) and RESCORE_FACTOR:
+            exact.write_vectors(side, vectors.shape[1], len(ids), [(ids, vectors)])
+        elif os.path.exists(side):
+            os.remove(side)
+        path = os.path.join(out, "index.faiss")
+        faiss.write_index(new, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        if gen is not None:
+            # chunk ids are kept, so the metadata and BM25 postings carry over
+            for name in ("meta.bin", "meta.jsonl", "bm25.bin"):
+                if os.path.exists(os.path.join(src, name)):
+                    snapshots.link_or_copy(os.path.join(src, name), os.path.join(out, name))
+            info = {k: v for k, v in snapshots.manifest(args.index_dir, gen).items()
+                    if k not in ("generation", "created", "files")}
+            if snapshots.publish(args.index_dir, out, info, expect=gen) is None:
+                raise SystemExit("another snapshot was published meanwhile; run migrate again")
+        print(f"ok: {new.ntotal} vectors -> {args.type} ({index_bytes(new) / 2**20:.1f} MB)")
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,97 @@
+import os
+import queue
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Sequence
+
+logger = logging.getLogger(__name__)
+
+BATCHING = os.getenv("BATCHING", "1") not in ("0", "false", "False")
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "64"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "3"))
+
+class MicroBatcher:
+    """Coalesce concurrent calls of a batched function into one forward pass.
+
+    ``submit(items)`` blocks the calling thread until ``fn`` has run on a batch
+    containing its items and returns the caller's slice of the result. The
+    worker waits at most ``max_wait_ms`` for more callers, but never waits
+    when every caller currently in ``submit`` is already in the batch, so a
+    lone request pays no extra latency.
+    """
+
+    def __init__(self, fn: Callable[[List[Any]], Sequence], max_batch: int = BATCH_MAX_SIZE,
+                 max_wait_ms: float = BATCH_MAX_WAIT_MS, name: str = "batcher"):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._inflight = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = self.items = 0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, items: List[Any]) -> Sequence:
+        if not items:
+            return self.fn(items)
+        fut: Future = Future()
+        with self._lock:
+            self._inflight += 1
+        try:
+            self._start()
+            self._queue.put((list(items), fut))
+            return fut.result()
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+    def _collect(self) -> List[tuple]:
+        reqs = [self._queue.get()]
+        size = len(reqs[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            with self._lock:
+                everyone_in = len(reqs) >= self._inflight
+            if everyone_in and self._queue.empty():
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                req = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            reqs.append(req)
+            size += len(req[0])
+        return reqs
+
+    def _run(self):
+        while True:
+            reqs = self._collect()
+            batch = [x for items, _ in reqs for x in items]
+            try:
+                out = self.fn(batch)
+            except Exception as e:
+                logger.error(f"{self.name}: batch of {len(batch)} failed: {e}")
+                for _, fut in reqs:
+                    fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            start = 0
+            for items, fut in reqs:
+                fut.set_result(out[start:start + len(items)])
+                start += len(items)
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "items": self.items,
+                "avg_batch": self.items / self.batches if self.batches else 0.0}
@@ -0,0 +1,170 @@
+import json, time, threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+import numpy as np
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by total value size, with optional TTL.
+
+    ``sizeof`` returns the cost of a value in bytes (``nbytes`` for numpy
+    arrays by default). Entries older than ``ttl`` seconds count as misses.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float = 0, sizeof: Optional[Callable[[Any], int]] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof or (lambda v: int(getattr(v, "nbytes", 64)))
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, size, stamp = item
+            if self.ttl and time.monotonic() - stamp > self.ttl:
+                del self._data[key]
+                self._bytes -= size
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, size, time.monotonic())
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, s, _) = self._data.popitem(last=False)
+                self._bytes -= s
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"entries": len(self._data), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_ratio": self.hits / total if total else 0.0}
+
+class SemanticCache:
+    """Answer cache matched by question-embedding similarity.
+
+    Entries are scoped by an exact string key (e.g. role set and top_k), so an answer is
+    only ever reused for a caller who could have produced it. Every entry
+    records the index generation it was computed against; when the index
+    changes the whole cache is dropped. Query vectors must be L2-normalized.
+    With ``path`` set, entries are written through to SQLite and reloaded
+    at startup.
+    """
+
+    def __init__(self, max_entries: int, threshold: float, ttl: float = 0, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._scopes: Dict[str, Dict[str, Any]] = {}
+        self._generation = None
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = self.misses = 0
+        if path and max_entries > 0:
+            self._open_db(path)
+
+    def _open_db(self, path: str):
+        import sqlite3
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS answers (scope TEXT, question TEXT, vec BLOB, "
+                         "value TEXT, generation TEXT, created REAL, PRIMARY KEY (scope, question))")
+        rows = self._db.execute("SELECT scope, question, vec, value, generation, created FROM answers "
+                                "ORDER BY created DESC LIMIT ?", (self.max_entries,)).fetchall()
+        for scope, question, vec, value, gen, created in reversed(rows):
+            self._insert(scope, question, np.frombuffer(vec, dtype="float32"), json.loads(value), gen, created)
+
+    def _insert(self, scope: str, question: str, vec, value, generation: str, created: float):
+        key = (scope, question)
+        self._entries.pop(key, None)
+        self._entries[key] = (vec, value, str(generation), created)
+        self._scopes.pop(scope, None)  # similarity matrix rebuilt lazily
+
+    def _reset(self, generation: str):
+        for key in [k for k, e in self._entries.items() if e[2] != generation]:
+            del self._entries[key]
+        self._scopes.clear()
+        self._generation = generation
+        if self._db is not None:
+            self._db.execute("DELETE FROM answers WHERE generation != ?", (generation,))
+            self._db.commit()
+
+    def _matrix(self, scope):
+        cached = self._scopes.get(scope)
+        if cached is None:
+            keys = [k for k in self._entries if k[0] == scope]
+            mat = np.stack([self._entries[k][0] for k in keys]) if keys else None
+            cached = self._scopes[scope] = {"keys": keys, "mat": mat}
+        return cached
+
+    def get(self, vec: np.ndarray, scope: str, generation) -> Any:
+        if self.max_entries <= 0:
+            return None
+        generation = str(generation)
+        with self._lock:
+            if generation != self._generation:
+                self._reset(generation)
+            m = self._matrix(scope)
+            if m["mat"] is not None:
+                sims = m["mat"] @ vec.ravel()
+                best = int(np.argmax(sims))
+                key = m["keys"][best]
+                entry = self._entries.get(key)
+                fresh = entry is not None and (not self.ttl or time.time() - entry[3] <= self.ttl)
+                if sims[best] >= self.threshold and fresh and entry[2] == generation:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, question: str, vec: np.ndarray, scope: str, generation, value: Any):
+        if self.max_entries <= 0:
+            return
+        generation = str(generation)
+        vec = np.ascontiguousarray(vec.ravel(), dtype="float32")
+        now = time.time()
+        with self._lock:
+            if generation != self._generation:
+                self._reset(generation)
+            self._insert(scope, question, vec, value, generation, now)
+            while len(self._entries) > self.max_entries:
+                (old_scope, old_q), _ = self._entries.popitem(last=False)
+                self._scopes.pop(old_scope, None)
+                if self._db is not None:
+                    self._db.execute("DELETE FROM answers WHERE scope = ? AND question = ?",
+                                     (old_scope, old_q))
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                                 (scope, question, vec.tobytes(),
+                                  json.dumps(value, ensure_ascii=False), generation, now))
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0}
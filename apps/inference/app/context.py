@@ -0,0 +1,103 @@
+import os
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+TOKENIZER_MODEL = os.getenv("TOKENIZER_MODEL", os.getenv("LLM_MODEL", "gpt-4o-mini"))
+# chunk_text overlaps chunks by 120 characters, cut at a word boundary
+MAX_OVERLAP_CHARS = 400
+MIN_OVERLAP_CHARS = 16
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+def _get_encoding():
+    """tiktoken encoding of ``TOKENIZER_MODEL``, or False when it cannot be loaded
+    (tiktoken downloads its BPE ranks on first use, which fails offline)."""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    try:
+                        _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+                    except KeyError:
+                        _encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    logger.warning(f"tiktoken unavailable, estimating 4 characters per token: {e}")
+                    _encoding = False
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    enc = _get_encoding()
+    if enc is False:
+        return (len(text) + 3) // 4
+    return len(enc.encode(text, disallowed_special=()))
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    enc = _get_encoding()
+    if enc is False:
+        return text[:max_tokens * 4]
+    return enc.decode(enc.encode(text, disallowed_special=())[:max_tokens])
+
+def overlap(prev: str, text: str) -> int:
+    """Length of the prefix of ``text`` that repeats the end of ``prev`` (0 if none)."""
+    for n in range(min(len(prev), len(text), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if text.startswith(prev[-n:]):
+            return n
+    return 0
+
+def render(hits: List[Dict]) -> str:
+    """Context text for ``hits``: each document's chunks are kept together in
+    document (chunk id) order, documents ordered by their best-ranked chunk,
+    and the overlap between adjacent chunks is printed once."""
+    groups: Dict[Optional[str], List[Dict]] = {}
+    for h in hits:
+        groups.setdefault(h.get("path") or f"#{id(h)}", []).append(h)
+    blocks = []
+    for chunks in groups.values():
+        chunks = sorted(chunks, key=lambda h: h.get("_idx", 0))
+        parts, prev = [], None
+        for h in chunks:
+            text = h["text"]
+            n = overlap(prev, text) if prev is not None else 0
+            if n:
+                # continuation of the previous chunk: same block, no repeated text
+                rest = text[n:].strip()
+                if rest:
+                    parts[-1] += " " + rest
+                prev = text
+                continue
+            parts.append(f"[{h.get('title', 'doc')}] {text}")
+            prev = text
+        blocks.extend(parts)
+    return "\n\n".join(blocks)
+
+def pack(hits: List[Dict], max_tokens: int = CONTEXT_MAX_TOKENS) -> Tuple[str, List[Dict], int]:
+    """Fit ranked ``hits`` into ``max_tokens`` of context.
+
+    Hits are taken in rank order while the rendered context stays within the
+    budget; one that does not fit is skipped so a smaller, lower-ranked one
+    can still be used. If even the top hit alone is too long it is truncated.
+    Returns ``(context, used_hits, context_tokens)``.
+    """
+    used: List[Dict] = []
+    context, tokens = "", 0
+    for h in hits:
+        candidate = render(used + [h])
+        n = count_tokens(candidate)
+        if n <= max_tokens:
+            used.append(h)
+            context, tokens = candidate, n
+    if not used and hits:
+        top = {**hits[0], "text": truncate_tokens(hits[0]["text"], max_tokens)}
+        while top["text"] and count_tokens(render([top])) > max_tokens:
+            top["text"] = top["text"][:int(len(top["text"]) * 0.9)]
+        used = [top] if top["text"] else []
+        context = render(used)
+        tokens = count_tokens(context)
+    return context, used, tokens
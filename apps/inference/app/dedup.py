@@ -0,0 +1,151 @@
+"""Near-duplicate chunk detection for ingestion.
+
+Each chunk gets a 64-bit SimHash over word 3-shingles. Fingerprints live in a
+SQLite LSH table split into four 16-bit bands: two fingerprints within
+Hamming distance 3 share at least one band, so a lookup is an indexed query
+plus a distance check on the few candidates.
+
+The ``members`` table records every document (path, title, roles) that
+contains a chunk, so a chunk shared by several documents survives until the
+last of them is deleted. Only documents with the same roles share a chunk.
+"""
+import os
+import json
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEDUP = os.getenv("DEDUP", "1") not in ("0", "false", "False")
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "3"))  # of 64 bits, at most 3
+DEDUP_MAX_CANDIDATES = 64
+
+_BANDS = 4
+_MASK16 = 0xFFFF
+
+def simhash(text: str) -> int:
+    """64-bit SimHash of ``text`` over lowercased word 3-shingles."""
+    words = text.lower().split()
+    shingles = [" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))] if words else [""]
+    digests = b"".join(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest() for s in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(shingles)
+    return int.from_bytes(np.packbits(votes > 0, bitorder="little").tobytes(), "little")
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def _signed(fp: int) -> int:
+    # SQLite integers are signed 64-bit
+    return fp - (1 << 64) if fp >= 1 << 63 else fp
+
+def _bands(fp: int) -> List[int]:
+    return [(fp >> (16 * i)) & _MASK16 for i in range(_BANDS)]
+
+Member = Tuple[str, Optional[str], List[str]]  # path, title, roles
+
+class Deduper:
+    """Persistent fingerprint index and chunk membership table."""
+
+    def __init__(self, path: str, max_distance: int = DEDUP_MAX_DISTANCE):
+        self.max_distance = min(max_distance, _BANDS - 1)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS fingerprints (chunk_id INTEGER PRIMARY KEY, fp INTEGER NOT NULL, "
+            "b0 INTEGER, b1 INTEGER, b2 INTEGER, b3 INTEGER);"
+            "CREATE INDEX IF NOT EXISTS fp_b0 ON fingerprints (b0);"
+            "CREATE INDEX IF NOT EXISTS fp_b1 ON fingerprints (b1);"
+            "CREATE INDEX IF NOT EXISTS fp_b2 ON fingerprints (b2);"
+            "CREATE INDEX IF NOT EXISTS fp_b3 ON fingerprints (b3);"
+            "CREATE TABLE IF NOT EXISTS members (chunk_id INTEGER, path TEXT, title TEXT, roles TEXT, "
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, UNIQUE (chunk_id, path));"
+            "CREATE INDEX IF NOT EXISTS members_path ON members (path);"
+            "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);")
+        self._db.commit()
+        self._counters = dict(self._db.execute("SELECT name, value FROM counters").fetchall())
+
+    def find(self, fp: int, verify: Callable[[int], bool] = lambda cid: True,
+             accept: Callable[[int], bool] = lambda cid: True) -> Optional[int]:
+        """Closest stored chunk within ``max_distance`` of ``fp`` that passes
+        ``verify`` and ``accept``.
+
+        Candidates failing ``verify`` (deleted, or stale after an offline
+        rebuild) are dropped from the index; those failing ``accept`` are only
+        skipped.
+        """
+        b = _bands(fp)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT chunk_id, fp FROM fingerprints WHERE b0 = ? OR b1 = ? OR b2 = ? OR b3 = ? LIMIT ?",
+                (*b, DEDUP_MAX_CANDIDATES)).fetchall()
+        near = sorted((hamming(fp, f & ((1 << 64) - 1)), cid) for cid, f in rows)
+        for dist, cid in near:
+            if dist > self.max_distance:
+                break
+            if not verify(cid):
+                self.remove([cid])
+            elif accept(cid):
+                return cid
+        return None
+
+    def add(self, chunk_id: int, fp: int):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?)",
+                             (chunk_id, _signed(fp), *_bands(fp)))
+
+    def remove(self, chunk_ids: List[int]):
+        with self._lock:
+            self._db.executemany("DELETE FROM fingerprints WHERE chunk_id = ?", [(int(i),) for i in chunk_ids])
+            self._db.executemany("DELETE FROM members WHERE chunk_id = ?", [(int(i),) for i in chunk_ids])
+            self._db.commit()
+
+    def relink(self, old_id: int, new_id: int):
+        """Move the fingerprint and members of a rewritten chunk to its new id."""
+        with self._lock:
+            self._db.execute("UPDATE fingerprints SET chunk_id = ? WHERE chunk_id = ?", (new_id, old_id))
+            self._db.execute("UPDATE members SET chunk_id = ? WHERE chunk_id = ?", (new_id, old_id))
+
+    def members(self, chunk_id: int) -> List[Member]:
+        """Documents containing ``chunk_id``, first-ingested first."""
+        with self._lock:
+            rows = self._db.execute("SELECT path, title, roles FROM members WHERE chunk_id = ? ORDER BY seq",
+                                    (chunk_id,)).fetchall()
+        return [(p, t, json.loads(r)) for p, t, r in rows]
+
+    def set_member(self, chunk_id: int, path: str, title: Optional[str], roles: List[str]):
+        with self._lock:
+            self._db.execute("INSERT INTO members (chunk_id, path, title, roles) VALUES (?, ?, ?, ?) "
+                             "ON CONFLICT (chunk_id, path) DO UPDATE SET title = excluded.title, roles = excluded.roles",
+                             (chunk_id, path, title, json.dumps(roles)))
+
+    def unlink(self, chunk_id: int, path: str):
+        with self._lock:
+            self._db.execute("DELETE FROM members WHERE chunk_id = ? AND path = ?", (chunk_id, path))
+
+    def chunks_of(self, path: str) -> List[int]:
+        with self._lock:
+            return [r[0] for r in self._db.execute("SELECT chunk_id FROM members WHERE path = ?", (path,))]
+
+    def count(self, **deltas: int):
+        with self._lock:
+            for name, d in deltas.items():
+                self._counters[name] = self._counters.get(name, 0) + d
+                self._db.execute("INSERT INTO counters VALUES (?, ?) ON CONFLICT (name) DO UPDATE "
+                                 "SET value = value + excluded.value", (name, d))
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            n = self._db.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+            c = dict(self._counters)
+        return {"fingerprints": n, "chunks_checked": c.get("checked", 0), "duplicates": c.get("duplicates", 0),
+                "embeddings_saved": c.get("duplicates", 0),
+                "bytes_saved": c.get("bytes_saved", 0)}
@@ -0,0 +1,168 @@
+"""Persistent, content-addressed cache of chunk embeddings.
+
+One file per model, ``<sha1(model)[:16]>.emb`` under the cache directory: a
+16-byte header (magic, dim) followed by fixed-size records of
+``sha256(text)[:16]`` and the float32 vector. Writers append under an
+exclusive ``flock``, so the inference service and the ingestion CLI
+(``workers/ingestion-cli/ingest.py`` uses this class too) can share one
+cache; readers memory-map the file and index it by the first 8 key bytes,
+picking up records other processes appended on the next lookup.
+"""
+import os
+import struct
+import hashlib
+import logging
+import threading
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not POSIX
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"ECEMB1\0\0"
+_HEADER = struct.Struct("<8sII")  # magic, dim, reserved
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()[:16]
+
+def cache_path(cache_dir: str, model: str) -> str:
+    return os.path.join(cache_dir, hashlib.sha1(model.encode("utf-8")).hexdigest()[:16] + ".emb")
+
+class EmbeddingCache:
+    """Embeddings keyed by (model, SHA-256 of the text), stored on disk."""
+
+    def __init__(self, cache_dir: str, model: str):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = cache_path(cache_dir, model)
+        self.model = model
+        self.dim: Optional[int] = None
+        self._mm = None
+        self._rows = 0
+        self._k0 = np.empty(0, dtype="<u8")    # sorted first key halves
+        self._row = np.empty(0, dtype=np.int64)  # their record numbers
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def _dtype(self) -> np.dtype:
+        return np.dtype([("k0", "<u8"), ("k1", "<u8"), ("vec", "<f4", (self.dim,))])
+
+    def _refresh(self):
+        """Index records appended since the last look, by any process."""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if self.dim is None:
+            if size < _HEADER.size:
+                return
+            with open(self.path, "rb") as f:
+                magic, dim, _ = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{self.path} is not an embedding cache")
+            self.dim = dim
+        rows = (size - _HEADER.size) // self._dtype().itemsize
+        if rows <= self._rows:
+            return
+        self._mm = np.memmap(self.path, dtype=self._dtype(), mode="r", offset=_HEADER.size, shape=(rows,))
+        new = np.asarray(self._mm["k0"][self._rows:rows])
+        order = np.argsort(new, kind="stable")
+        pos = np.searchsorted(self._k0, new[order])
+        self._k0 = np.insert(self._k0, pos, new[order])
+        self._row = np.insert(self._row, pos, order + self._rows)
+        self._rows = rows
+
+    @staticmethod
+    def _halves(keys: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+        k = np.frombuffer(b"".join(keys), dtype="<u8").reshape(-1, 2)
+        return k[:, 0], k[:, 1]
+
+    def _find(self, keys: List[bytes]) -> np.ndarray:
+        """Record number of each key, or -1."""
+        out = np.full(len(keys), -1, dtype=np.int64)
+        if not keys or not self._rows:
+            return out
+        k0, k1 = self._halves(keys)
+        pos = np.searchsorted(self._k0, k0)
+        for i, p in enumerate(pos):
+            # equal 64-bit prefixes are practically unique; check the rest anyway
+            while p < len(self._k0) and self._k0[p] == k0[i]:
+                r = self._row[p]
+                if self._mm["k1"][r] == k1[i]:
+                    out[i] = r
+                    break
+                p += 1
+        return out
+
+    def get_many(self, texts: List[str]) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        """``(vectors, hit)``: a (n, dim) array filled where ``hit`` is True
+        (None when the cache is still empty)."""
+        with self._lock:
+            self._refresh()
+            rows = self._find([text_key(t) for t in texts])
+            hit = rows >= 0
+            self.hits += int(hit.sum())
+            self.misses += int((~hit).sum())
+            if self.dim is None:
+                return None, hit
+            vecs = np.empty((len(texts), self.dim), dtype="float32")
+            if hit.any():
+                vecs[hit] = self._mm["vec"][rows[hit]]
+            return vecs, hit
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        with self._lock, open(self.path, "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                size = f.seek(0, os.SEEK_END)
+                if size < _HEADER.size:
+                    f.truncate(0)
+                    f.write(_HEADER.pack(MAGIC, vectors.shape[1], 0))
+                    f.flush()
+                self._refresh()
+                if self.dim != vectors.shape[1]:
+                    logger.warning(f"Embedding cache {self.path} holds dim {self.dim}, not {vectors.shape[1]}; not caching")
+                    return
+                rec = self._dtype().itemsize
+                torn = (f.seek(0, os.SEEK_END) - _HEADER.size) % rec
+                if torn:  # a writer died mid-record
+                    f.truncate(f.tell() - torn)
+                keys = [text_key(t) for t in texts]
+                seen = set()
+                new = [i for i, (k, r) in enumerate(zip(keys, self._find(keys)))
+                       if r < 0 and not (k in seen or seen.add(k))]
+                if not new:
+                    return
+                records = np.empty(len(new), dtype=self._dtype())
+                records["k0"], records["k1"] = self._halves([keys[i] for i in new])
+                records["vec"] = vectors[new]
+                f.write(records.tobytes())
+                f.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def encode(self, texts: List[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Vectors for ``texts``, calling ``encode`` only for the ones not cached."""
+        vecs, hit = self.get_many(texts)
+        miss = np.flatnonzero(~hit)
+        if len(miss):
+            embs = np.asarray(encode([texts[i] for i in miss]), dtype="float32")
+            self.put_many([texts[i] for i in miss], embs)
+            if vecs is None:
+                vecs = np.empty((len(texts), embs.shape[1]), dtype="float32")
+            vecs[miss] = embs
+        return vecs
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refresh()
+            total = self.hits + self.misses
+            return {"entries": self._rows, "hits": self.hits, "misses": self.misses,
+                    "hit_ratio": self.hits / total if total else 0.0,
+                    "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0}
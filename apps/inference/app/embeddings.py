@@ -1,28 +1,82 @@
 import os
 import logging
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from . import readiness, onnxrt
+from .cache import LRUCache
+from .embcache import EmbeddingCache
+from .utils import normalize_query
+from .batching import MicroBatcher, BATCHING, BATCH_MAX_SIZE
 
 logger = logging.getLogger(__name__)
 
 EMB_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+QUERY_CACHE_BYTES = int(os.getenv("QUERY_CACHE_BYTES", str(16 * 1024 * 1024)))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+EMBED_CACHE = os.getenv("EMBED_CACHE", "1") not in ("0", "false", "False")
+# shared with workers/ingestion-cli, which defaults to <index>/embcache too
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", os.path.join(os.getenv("INDEX_DIR", "/data/index"), "embcache"))
 
-# Initialize model with error handling
-try:
+# normalized question -> query vector, keyed by model so a model swap never reuses vectors
+query_cache = LRUCache(QUERY_CACHE_BYTES, QUERY_CACHE_TTL)
+
+# (model, sha256 of chunk text) -> vector, on disk; skips re-encoding on re-ingest
+embedding_cache = EmbeddingCache(EMBED_CACHE_DIR, EMB_MODEL) if EMBED_CACHE else None
+
+def _load_model():
+    if onnxrt.MODEL_BACKEND == "onnx":
+        return onnxrt.load(EMB_MODEL, "embed")
+    # imported here: sentence_transformers pulls in torch, which takes seconds
+    from sentence_transformers import SentenceTransformer
     logger.info(f"Loading embedding model: {EMB_MODEL}")
-    _model = SentenceTransformer(EMB_MODEL)
-    logger.info("Embedding model loaded successfully")
-except Exception as e:
-    logger.error(f"Failed to load embedding model: {e}")
-    raise
+    return SentenceTransformer(EMB_MODEL)
+
+# loaded in the background at startup (see app/readiness.py)
+embedding_model = readiness.component("embedding_model", _load_model)
+
+def _encode(texts: list[str]) -> np.ndarray:
+    return embedding_model.get().encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+
+# concurrent small encode calls (queries) share one forward pass
+encode_batcher = MicroBatcher(_encode, name="embed-batcher")
 
 def embed_texts(texts: list[str]) -> np.ndarray:
-    """Generate embeddings for texts with error handling."""
+    """Generate embeddings for query texts with error handling; small calls
+    share a forward pass with concurrent queries."""
     try:
         if not texts:
             return np.array([])
-        embs = _model.encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+        if BATCHING and len(texts) < BATCH_MAX_SIZE:
+            embs = encode_batcher.submit(texts)
+        else:
+            # ingestion batches are already large; batching would only add queueing
+            embs = _encode(texts)
         return embs.astype("float32")
     except Exception as e:
         logger.error(f"Failed to generate embeddings: {e}")
         raise
+
+def _encode_chunks(texts: list[str]) -> np.ndarray:
+    return _encode(texts).astype("float32")
+
+def embed_chunks(texts: list[str]) -> np.ndarray:
+    """Embed document chunks on the calling (ingest) thread; texts embedded
+    before with this model are read from ``embedding_cache`` instead.
+
+    Chunks never go through ``encode_batcher``: they would slow the queries
+    sharing their forward pass and escape the ingest thread's lower priority.
+    """
+    if not texts:
+        return np.array([])
+    if embedding_cache is None:
+        return _encode_chunks(texts)
+    return embedding_cache.encode(texts, _encode_chunks)
+
+def embed_query(question: str) -> np.ndarray:
+    """Embed one question as a (1, dim) array, serving repeats from ``query_cache``."""
+    key = (EMB_MODEL, normalize_query(question))
+    vec = query_cache.get(key)
+    if vec is None:
+        vec = embed_texts([key[1]])[0]
+        query_cache.put(key, vec)
+    # callers normalize in place (faiss.normalize_L2); never hand out the cached array
+    return vec.reshape(1, -1).copy()
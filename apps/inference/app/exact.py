@@ -0,0 +1,154 @@
+"""Float32 copies of stored vectors, for re-scoring quantized search results.
+
+Quantized index kinds (``sq8``, ``fp16``, ``ivfpq``) hold only compressed
+codes in memory. The original vectors are kept in ``vectors.npy`` next to the
+index: a structured array of ``(id, vec)`` rows sorted by chunk id, written
+into each snapshot generation and memory-mapped, so only the rows of re-scored
+candidates are paged in. Rows added since the last snapshot stay in memory
+(they are in the WAL as well).
+"""
+import os
+import logging
+import threading
+from typing import Iterable, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FILENAME = "vectors.npy"
+_BLOCK = 65536
+
+def row_dtype(dim: int) -> np.dtype:
+    return np.dtype([("id", "<i8"), ("vec", "<f4", (dim,))])
+
+def write_vectors(path: str, dim: int, n: int, blocks: Iterable[Tuple[np.ndarray, np.ndarray]]) -> int:
+    """Write ``n`` rows given as ``(ids, vectors)`` blocks in id order to ``path``
+    (atomically); returns the number of rows written."""
+    tmp = path + ".tmp"
+    out = np.lib.format.open_memmap(tmp, mode="w+", dtype=row_dtype(dim), shape=(n,))
+    row = 0
+    for ids, vecs in blocks:
+        out["id"][row:row + len(ids)] = ids
+        out["vec"][row:row + len(ids)] = vecs
+        row += len(ids)
+    out.flush()
+    del out
+    if row != n:
+        os.remove(tmp)
+        raise ValueError(f"expected {n} vectors for {path}, got {row}")
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return row
+
+class ExactVectors:
+    """Chunk id -> float32 vector: the mmap'd snapshot plus an in-memory tail."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dim = 0
+        self._base = None
+        self._tail_ids: List[int] = []
+        self._tail_rows = {}
+        self._buf = np.empty((0, 0), dtype="float32")
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        self._base = None
+        if not os.path.exists(self.path):
+            return
+        base = np.load(self.path, mmap_mode="r")
+        if base.dtype.names != ("id", "vec") or base.ndim != 1:
+            logger.warning(f"Ignoring {self.path}: not a vector side file")
+            return
+        self._base = base
+        self.dim = base.dtype["vec"].shape[0]
+
+    @property
+    def last_id(self) -> int:
+        if self._tail_ids:
+            return self._tail_ids[-1]
+        if self._base is not None and len(self._base):
+            return int(self._base["id"][-1])
+        return -1
+
+    def __len__(self) -> int:
+        return (len(self._base) if self._base is not None else 0) + len(self._tail_ids)
+
+    def extend(self, ids, vectors: np.ndarray):
+        """Append vectors of ascending new ids; ids already known are skipped."""
+        with self._lock:
+            self._extend(np.asarray(ids, dtype=np.int64), np.asarray(vectors, dtype="float32"))
+
+    def _extend(self, ids: np.ndarray, vectors: np.ndarray):
+        new = ids > self.last_id
+        if not new.any():
+            return
+        ids, vectors = ids[new], vectors[new]
+        if not self.dim:
+            self.dim = vectors.shape[1]
+        n = len(self._tail_ids)
+        if n + len(ids) > len(self._buf):
+            buf = np.empty((max(2 * len(self._buf), n + len(ids), 1024), self.dim), dtype="float32")
+            if n:
+                buf[:n] = self._buf[:n]
+            self._buf = buf
+        self._buf[n:n + len(ids)] = vectors
+        for r, i in enumerate(ids.tolist(), n):
+            self._tail_rows[i] = r
+        self._tail_ids.extend(ids.tolist())
+
+    def get(self, ids) -> Optional[np.ndarray]:
+        """Vectors of ``ids`` as an (n, dim) array, or None if any is unknown."""
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            out = np.empty((len(ids), self.dim), dtype="float32")
+            found = np.zeros(len(ids), dtype=bool)
+            if self._base is not None and len(self._base):
+                base_ids = self._base["id"]
+                pos = np.minimum(np.searchsorted(base_ids, ids), len(base_ids) - 1)
+                found = base_ids[pos] == ids
+                out[found] = self._base["vec"][pos[found]]
+            for j in np.flatnonzero(~found):
+                r = self._tail_rows.get(int(ids[j]))
+                if r is None:
+                    return None
+                out[j] = self._buf[r]
+            return out
+
+    def snapshot(self) -> Tuple[Optional[np.ndarray], np.ndarray, np.ndarray]:
+        """``(base, tail_ids, tail_vectors)`` to write a new snapshot from without the lock."""
+        with self._lock:
+            n = len(self._tail_ids)
+            return self._base, np.asarray(self._tail_ids, dtype=np.int64), self._buf[:n].copy()
+
+    def write_snapshot(self, snap, dead, path: str) -> int:
+        """Write the rows of ``snap`` not in ``dead`` as the side file at ``path``."""
+        base, tail_ids, tail_vecs = snap
+        dead = np.asarray(sorted(dead), dtype=np.int64)
+        keep_base = ~np.isin(base["id"], dead) if base is not None else np.empty(0, dtype=bool)
+        keep_tail = ~np.isin(tail_ids, dead)
+
+        def blocks():
+            for s in range(0, len(keep_base), _BLOCK):
+                rows = base[s:s + _BLOCK][keep_base[s:s + _BLOCK]]
+                yield rows["id"], rows["vec"]
+            yield tail_ids[keep_tail], tail_vecs[keep_tail]
+
+        return write_vectors(path, self.dim, int(keep_base.sum() + keep_tail.sum()), blocks())
+
+    def rebase(self, next_id: int, path: str):
+        """Switch to the side file just written at ``path``; tail rows from
+        ``next_id`` on stay."""
+        with self._lock:
+            self.path = path
+            n = len(self._tail_ids)
+            ids = np.asarray(self._tail_ids, dtype=np.int64)
+            vecs = self._buf[:n]
+            self._tail_ids, self._tail_rows = [], {}
+            self._buf = np.empty((0, self.dim), dtype="float32")
+            self._open()
+            keep = ids >= next_id
+            if keep.any():
+                self._extend(ids[keep], vecs[keep])
@@ -0,0 +1,16 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# Embedding, BM25, FAISS and rerank release the GIL in native code; size the
+# pool to the cores rather than to the number of in-flight requests, which
+# spend most of their time awaiting the LLM.
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 4)))
+
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="rag-cpu")
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run a blocking, CPU-bound call on the dedicated executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, functools.partial(fn, *args, **kwargs))
@@ -1,16 +1,289 @@
-from typing import List
+import os, json, mmap, struct
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from scipy import sparse
+
 try:
     from rank_bm25 import BM25Okapi
 except Exception:  # pragma: no cover
     BM25Okapi = None  # optional dependency guard
 
+def tokenize(text: str) -> List[str]:
+    return text.lower().split()
+
 class SimpleBM25:
     def __init__(self, docs: List[str]):
-        tokens = [d.lower().split() for d in docs]
+        tokens = [tokenize(d) for d in docs]
         self._bm25 = BM25Okapi(tokens) if BM25Okapi and docs else None
         self._tokens = tokens
 
     def scores(self, query: str) -> List[float]:
         if not self._bm25:
             return [0.0] * len(self._tokens)
-        return list(self._bm25.get_scores(query.lower().split()))
+        return list(self._bm25.get_scores(tokenize(query)))
+
+MAGIC = b"ECBM25\0\0"
+_PREAMBLE = struct.Struct("<8sQQ")  # magic, footer_offset, footer_len
+
+class Vocab:
+    """term -> term id: a sorted utf-8 term table (e.g. memory-mapped from a
+    saved index, ids = positions) plus a dict of terms added since."""
+
+    def __init__(self, blob: bytes = b"", offsets: Optional[np.ndarray] = None):
+        self._blob = blob
+        self._off = offsets if offsets is not None else np.zeros(1, dtype=np.uint64)
+        self._base = len(self._off) - 1
+        self._extra: Dict[str, int] = {}
+
+    def _term(self, i: int) -> bytes:
+        return bytes(self._blob[int(self._off[i]):int(self._off[i + 1])])
+
+    def get(self, term: str, default=None):
+        key = term.encode("utf-8")
+        lo, hi = 0, self._base
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._base and self._term(lo) == key:
+            return lo
+        return self._extra.get(term, default)
+
+    def __setitem__(self, term: str, tid: int):
+        self._extra[term] = tid
+
+    def __len__(self) -> int:
+        return self._base + len(self._extra)
+
+    def items(self) -> Iterator[Tuple[bytes, int]]:
+        """``(utf-8 term, id)`` pairs."""
+        for i in range(self._base):
+            yield self._term(i), i
+        for t, i in self._extra.items():
+            yield t.encode("utf-8"), i
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first, without sorting the whole array."""
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.size:
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(scores.size)
+    return part[np.argsort(-scores[part], kind="stable")]
+
+class _Postings:
+    """One published state of a ``BM25Index``; never modified once published."""
+    __slots__ = ("segments", "doc_len", "df", "idf", "avgdl")
+
+    def __init__(self, segments: List[sparse.csc_matrix], doc_len: np.ndarray, df: np.ndarray, epsilon: float):
+        self.segments, self.doc_len, self.df = segments, doc_len, df
+        n = int(doc_len.size)
+        self.avgdl = float(doc_len.sum()) / n if n else 0.0
+        idf = np.log(n - df + 0.5) - np.log(df + 0.5)
+        avg_idf = float(idf.mean()) if idf.size else 0.0
+        self.idf = np.where(idf < 0, epsilon * avg_idf, idf)
+
+class BM25Index:
+    """Okapi BM25 over a sparse document-term matrix that grows by appending.
+
+    Documents are stored in CSC segments (rows = documents, columns = terms) so
+    a query only touches the columns of its own terms. ``add`` tokenizes only
+    the new documents and updates document frequencies, IDF and avgdl in
+    place; small segments are merged once there are more than
+    ``max_segments``. Scores match ``rank_bm25.BM25Okapi`` (including its
+    epsilon floor for negative IDF).
+
+    Writers (``add``) must be serialized by the caller, but searches need
+    no lock: ``add`` builds the new segments and statistics aside and
+    publishes them with one reference swap, so a search sees either the
+    old documents or the new ones, never a mix.
+
+    ``save`` writes the postings to one file that ``load`` memory-maps, so
+    processes serving the same snapshot share its pages; documents added
+    after loading go to in-memory segments.
+    """
+
+    def __init__(self, docs: Iterable[str] = (), k1: float = 1.5, b: float = 0.75,
+                 epsilon: float = 0.25, max_segments: int = 8, batch_size: int = 4096):
+        self.k1, self.b, self.epsilon = k1, b, epsilon
+        self.max_segments = max_segments
+        self.vocab = Vocab()
+        self._frozen = 0  # leading segments mapped from a saved file, never merged
+        self._postings = _Postings([], np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64), epsilon)
+        # consume lazily so a large corpus is never held as one list of strings
+        it = iter(docs)
+        while batch := list(islice(it, batch_size)):
+            self.add(batch)
+
+    def __len__(self) -> int:
+        return int(self._postings.doc_len.size)
+
+    @property
+    def _segments(self) -> List[sparse.csc_matrix]:
+        return self._postings.segments
+
+    def _encode(self, docs: List[str]) -> sparse.csr_matrix:
+        rows, cols = [], []
+        for i, doc in enumerate(docs):
+            for tok in tokenize(doc):
+                tid = self.vocab.get(tok)
+                if tid is None:
+                    tid = self.vocab[tok] = len(self.vocab)
+                rows.append(i); cols.append(tid)
+        data = np.ones(len(rows), dtype=np.float32)
+        # duplicate (row, col) entries are summed into term frequencies
+        m = sparse.coo_matrix((data, (rows, cols)), shape=(len(docs), len(self.vocab)))
+        return m.tocsr()
+
+    def add(self, docs: List[str]):
+        """Append documents; their ids continue from the current ``len(self)``."""
+        if not docs:
+            return
+        old = self._postings
+        block = self._encode(docs)
+        n_terms = block.shape[1]
+        df = np.zeros(n_terms, dtype=np.int64)
+        df[:old.df.size] = old.df
+        df += np.bincount(block.indices, minlength=n_terms)
+        doc_len = np.concatenate([old.doc_len, np.asarray(block.sum(axis=1)).ravel().astype(np.float32)])
+        segments = old.segments + [block.tocsc()]
+        if len(segments) > self.max_segments:
+            segments = self._merge(segments, n_terms)
+        self._postings = _Postings(segments, doc_len, df, self.epsilon)
+
+    def _merge(self, segments: List[sparse.csc_matrix], n_terms: int) -> List[sparse.csc_matrix]:
+        segs = [self._resize(s, n_terms) for s in segments[self._frozen:]]
+        if len(segs) > 1:
+            return segments[:self._frozen] + [sparse.vstack(segs, format="csc")]
+        return segments
+
+    @staticmethod
+    def _resize(seg: sparse.csc_matrix, n_terms: int) -> sparse.csc_matrix:
+        if seg.shape[1] == n_terms:
+            return seg
+        # new terms only add empty trailing columns
+        indptr = np.concatenate([seg.indptr, np.full(n_terms - seg.shape[1], seg.indptr[-1], dtype=seg.indptr.dtype)])
+        return sparse.csc_matrix((seg.data, seg.indices, indptr), shape=(seg.shape[0], n_terms))
+
+    def save(self, path: str, extra: Optional[Dict[str, np.ndarray]] = None):
+        """Write the index to ``path`` (atomic replace) as one segment with
+        terms in sorted order; ``extra`` arrays are stored alongside."""
+        postings = self._postings
+        n_terms = postings.df.size
+        terms = sorted((t, tid) for t, tid in self.vocab.items() if tid < n_terms)
+        order = np.fromiter((tid for _, tid in terms), dtype=np.int64, count=len(terms))
+        if postings.segments:
+            merged = sparse.vstack([self._resize(s, n_terms) for s in postings.segments], format="csc")
+        else:
+            merged = sparse.csc_matrix((0, n_terms), dtype=np.float32)
+        merged = merged[:, order].tocsc()
+        idx = np.int32 if merged.nnz < 2**31 else np.int64
+        offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+        offsets[1:] = np.cumsum([len(t) for t, _ in terms])
+        arrays = {"terms": np.frombuffer(b"".join(t for t, _ in terms), dtype=np.uint8),
+                  "term_off": offsets, "indptr": merged.indptr.astype(idx),
+                  "indices": merged.indices.astype(idx), "data": merged.data.astype(np.float32),
+                  "doc_len": postings.doc_len, "df": postings.df[order]}
+        arrays.update(extra or {})
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_PREAMBLE.pack(MAGIC, 0, 0))
+            cols = {}
+            for name, arr in arrays.items():
+                f.write(b"\0" * (-f.tell() % 8))
+                arr = np.ascontiguousarray(arr)
+                cols[name] = {"offset": f.tell(), "dtype": arr.dtype.str, "count": int(arr.size)}
+                arr.tofile(f)
+            footer = json.dumps({"columns": cols, "docs": int(postings.doc_len.size), "k1": self.k1, "b": self.b,
+                                 "epsilon": self.epsilon}).encode("utf-8")
+            foot_off = f.tell()
+            f.write(footer)
+            f.seek(0)
+            f.write(_PREAMBLE.pack(MAGIC, foot_off, len(footer)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> Tuple["BM25Index", Dict[str, np.ndarray]]:
+        """Memory-map an index written by ``save``; returns it with the extra arrays."""
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, foot_off, foot_len = _PREAMBLE.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a BM25 index")
+        footer = json.loads(mm[foot_off:foot_off + foot_len].decode("utf-8"))
+        arrays = {name: np.frombuffer(mm, dtype=np.dtype(c["dtype"]), count=c["count"], offset=c["offset"])
+                  for name, c in footer["columns"].items()}
+        index = cls(k1=footer["k1"], b=footer["b"], epsilon=footer["epsilon"], **kwargs)
+        index.vocab = Vocab(arrays.pop("terms"), arrays.pop("term_off"))
+        n_docs, n_terms = footer["docs"], len(index.vocab)
+        data, indices, indptr = arrays.pop("data"), arrays.pop("indices"), arrays.pop("indptr")
+        segments = []
+        if n_docs:
+            seg = sparse.csc_matrix((n_docs, n_terms), dtype=np.float32)
+            # assigned directly: the constructor would copy the mapped arrays
+            seg.data, seg.indices, seg.indptr = data, indices, indptr
+            segments = [seg]
+            index._frozen = 1
+        # small per-document / per-term arrays are copied out of the map
+        index._postings = _Postings(segments, np.array(arrays.pop("doc_len"), dtype=np.float32),
+                                    np.array(arrays.pop("df"), dtype=np.int64), index.epsilon)
+        return index, arrays
+
+    def score_matches(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Dense scores plus a boolean mask of documents containing a query term."""
+        return self._score(self._postings, query)
+
+    def _score(self, p: _Postings, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        n = int(p.doc_len.size)
+        scores = np.zeros(n, dtype=np.float64)
+        hit = np.zeros(n, dtype=bool)
+        terms: Dict[int, int] = {}
+        for tok in tokenize(query):
+            tid = self.vocab.get(tok)
+            # terms of documents being added are not in this state yet
+            if tid is not None and tid < p.idf.size:
+                terms[tid] = terms.get(tid, 0) + 1
+        if not terms or not n:
+            return scores, hit
+        tids = np.fromiter(terms.keys(), dtype=np.int64)
+        weights = p.idf[tids] * np.fromiter(terms.values(), dtype=np.float64)
+        offset = 0
+        for seg in p.segments:
+            n_seg = seg.shape[0]
+            present = tids < seg.shape[1]
+            if present.any():
+                sub = seg[:, tids[present]].tocoo()
+                tf = sub.data.astype(np.float64)
+                dl = p.doc_len[offset + sub.row]
+                norm = tf + self.k1 * (1 - self.b + self.b * dl / p.avgdl)
+                contrib = weights[present][sub.col] * tf * (self.k1 + 1) / norm
+                scores[offset:offset + n_seg] += np.bincount(sub.row, weights=contrib, minlength=n_seg)
+                hit[offset + sub.row] = True
+            offset += n_seg
+        return scores, hit
+
+    def get_scores(self, query: str) -> np.ndarray:
+        """Dense BM25 score for every document."""
+        return self.score_matches(query)[0]
+
+    def search(self, query: str, k: int, mask: np.ndarray | None = None) -> List[Tuple[int, float]]:
+        """Top-k ``(doc_id, score)`` pairs among documents containing a query term.
+
+        ``mask`` is an optional boolean array over document ids; documents
+        outside it (or past its end, e.g. added since it was built) are
+        never returned.
+        """
+        scores, hit = self._score(self._postings, query)
+        if mask is not None:
+            n = min(hit.size, mask.size)
+            hit[n:] = False
+            hit[:n] &= mask[:n]
+        matched = np.flatnonzero(hit)
+        best = matched[top_k(scores[matched], k)]
+        return [(int(i), float(scores[i])) for i in best]
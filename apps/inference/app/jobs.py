@@ -0,0 +1,191 @@
+import os
+import time
+import itertools
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_COMMIT_CHUNKS = int(os.getenv("INGEST_COMMIT_CHUNKS", "512"))
+INGEST_COMMIT_WAIT = float(os.getenv("INGEST_COMMIT_WAIT", "0.5"))
+INGEST_NICE = int(os.getenv("INGEST_NICE", "10"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "1000"))
+
+def _lower_priority():
+    # Linux schedules threads individually, so this only demotes the calling
+    # ingestion thread; query threads keep their priority
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), INGEST_NICE)
+    except (AttributeError, OSError):  # pragma: no cover - not Linux / not permitted
+        pass
+
+class IngestJob:
+    def __init__(self, files: List[Dict[str, Any]], roles: List[str]):
+        self.id = uuid.uuid4().hex
+        self.roles = roles
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.files = [{"name": f["name"], "path": f.get("path"), "status": f.get("status", "queued"),
+                       "chunks": 0, "error": f.get("error")} for f in files]
+        self._pending = sum(f["status"] == "queued" for f in self.files)
+
+    @property
+    def status(self) -> str:
+        states = {f["status"] for f in self.files}
+        if self.finished is None:
+            return "running" if states - {"queued"} else "queued"
+        return "failed" if states == {"failed"} else "done"
+
+    def to_dict(self) -> Dict[str, Any]:
+        done = sum(f["status"] in ("done", "failed") for f in self.files)
+        return {"id": self.id, "status": self.status, "created": self.created, "finished": self.finished,
+                "progress": {"files": len(self.files), "processed": done,
+                             "chunks": sum(f["chunks"] for f in self.files)},
+                "files": [dict(f) for f in self.files]}
+
+class IngestQueue:
+    """Background ingestion: ``submit`` returns a job at once.
+
+    ``workers`` threads (niced below query threads) extract and chunk files
+    in parallel. A single committer thread gathers the chunks of finished
+    files and indexes them with one ``add_chunks`` call per batch of about
+    ``commit_chunks`` chunks, so many small files cost one embedding pass
+    and one WAL append rather than one each. A file with more chunks than
+    one batch is streamed straight to ``add_document`` by its worker, so its
+    chunks are never all in memory.
+
+    ``chunk_batches(name, path, roles)`` yields a file's chunk dicts in
+    batches of at most ``commit_chunks``.
+    """
+
+    def __init__(self, chunk_batches: Callable[[str, str, List[str]], Iterable[List[Dict]]],
+                 add_chunks: Callable[[List[Dict]], Any],
+                 add_document: Optional[Callable[[str, Iterable[List[Dict]]], int]] = None,
+                 workers: int = INGEST_WORKERS, commit_chunks: int = INGEST_COMMIT_CHUNKS,
+                 commit_wait: float = INGEST_COMMIT_WAIT):
+        self.chunk_batches = chunk_batches
+        self.add_chunks = add_chunks
+        self.add_document = add_document
+        self.workers = workers
+        self.commit_chunks = commit_chunks
+        self.commit_wait = commit_wait
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._files: "queue.Queue" = queue.Queue()
+        self._ready: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._extracting = 0
+        self._threads: List[threading.Thread] = []
+
+    def _start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._extract_loop, name=f"ingest-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._commit_loop, name="ingest-commit", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def submit(self, files: List[Dict[str, Any]], roles: List[str]) -> IngestJob:
+        """Queue ``files`` (dicts with ``name`` and ``path`` of a saved upload; a
+        ``status`` of ``failed`` plus ``error`` records a rejected file)."""
+        job = IngestJob(files, roles)
+        with self._lock:
+            self._start()
+            self._jobs[job.id] = job
+            while len(self._jobs) > INGEST_JOB_HISTORY:
+                self._jobs.popitem(last=False)
+            if not job._pending:
+                job.finished = time.time()
+        for i, f in enumerate(job.files):
+            if f["status"] == "queued":
+                self._files.put((job, i))
+        logger.info(f"Ingest job {job.id} queued with {job._pending} files")
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job is not None else None
+
+    def _set(self, job: IngestJob, i: int, **fields):
+        with self._lock:
+            job.files[i].update(fields)
+            if fields.get("status") in ("done", "failed"):
+                job._pending -= 1
+                if not job._pending:
+                    job.finished = time.time()
+                    logger.info(f"Ingest job {job.id} finished: {job.status}")
+
+    def _extract_loop(self):
+        _lower_priority()
+        while True:
+            job, i = self._files.get()
+            f = job.files[i]
+            with self._lock:
+                self._extracting += 1
+            self._set(job, i, status="extracting")
+            try:
+                batches = iter(self.chunk_batches(f["name"], f["path"], job.roles))
+                chunks = next(batches, [])
+                more = next(batches, None)
+                if more is not None and self.add_document is not None:
+                    self._set(job, i, status="embedding")
+                    n = self.add_document(f["path"], itertools.chain([chunks, more], batches))
+                    self._set(job, i, status="done", chunks=n)
+                    continue
+                if more is not None:
+                    chunks = chunks + more + [c for b in batches for c in b]
+                if not chunks:
+                    raise ValueError("No text content found in file")
+                self._set(job, i, status="embedding")
+                self._ready.put((job, i, chunks))
+            except Exception as e:
+                logger.error(f"Ingest job {job.id}: {f['name']} failed: {e}")
+                self._set(job, i, status="failed", error=str(getattr(e, "detail", e)))
+            finally:
+                with self._lock:
+                    self._extracting -= 1
+
+    def _commit_loop(self):
+        _lower_priority()
+        while True:
+            batch = [self._ready.get()]
+            size = len(batch[0][2])
+            deadline = time.monotonic() + self.commit_wait
+            # keep collecting while other files are still being extracted
+            while size < self.commit_chunks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._idle():
+                    break
+                try:
+                    item = self._ready.get(timeout=min(remaining, 0.05))
+                except queue.Empty:
+                    continue
+                batch.append(item)
+                size += len(item[2])
+            self._commit(batch)
+
+    def _idle(self) -> bool:
+        """Nothing else can join the batch: no file queued, extracting or ready."""
+        with self._lock:
+            return self._files.empty() and self._ready.empty() and not self._extracting
+
+    def _commit(self, batch: List[tuple]):
+        chunks = [c for _, _, cs in batch for c in cs]
+        try:
+            self.add_chunks(chunks)
+        except Exception as e:
+            logger.error(f"Ingest commit of {len(batch)} files failed: {e}")
+            for job, i, _ in batch:
+                self._set(job, i, status="failed", error=str(e))
+            return
+        for job, i, cs in batch:
+            self._set(job, i, status="done", chunks=len(cs))
+        logger.info(f"Ingest committed {len(chunks)} chunks from {len(batch)} files")
@@ -1,27 +1,78 @@
 import os
+import asyncio
 import logging
+import weakref
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI
-from typing import Optional
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+from . import readiness
+from .context import count_tokens
+from .metrics import Counter
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 # Load environment variables
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# without it the service starts but is not ready, and answers carry the error
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY environment variable is required")
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "256"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
 
 # Initialize client lazily to avoid import-time issues
 client = None
+# one AsyncOpenAI per event loop; an entry goes away with its loop
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+def _require_key():
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY environment variable is required")
 
 def get_client():
     global client
     if client is None:
+        _require_key()
+        from openai import OpenAI  # imported on first use to keep app import fast
         client = OpenAI(api_key=OPENAI_API_KEY)
     return client
 
+# the client (and the openai package) is created in the background at startup
+llm_client = readiness.component("llm", get_client)
+
+def get_async_client() -> "AsyncOpenAI":
+    """AsyncOpenAI sharing one pooled HTTP client per event loop."""
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None:
+        _require_key()
+        from openai import AsyncOpenAI
+        http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+            timeout=LLM_TIMEOUT,
+        )
+        async_client = _async_clients[loop] = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http)
+    return async_client
+
+async def close_async_client():
+    """Close the running loop's client and its connection pool (app shutdown)."""
+    async_client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if async_client is not None:
+        await async_client.close()
+
+prompt_tokens_total = Counter("llm_prompt_tokens_total", "Prompt tokens sent to the LLM.")
+completion_tokens_total = Counter("llm_completion_tokens_total", "Completion tokens generated by the LLM.")
+
+class StreamFailed(Exception):
+    """Raised by ``astream`` after its fallback text when the stream broke off."""
+
+# Prefix of the fallback answer returned when the OpenAI call fails
+ERROR_PREFIX = "I encountered an error while generating an answer"
+
 SYSTEM = (
     "You are a helpful assistant that answers questions based on the provided context. "
     "Always cite your sources using [title] format. "
@@ -30,6 +81,23 @@ SYSTEM = (
     "Be concise but comprehensive in your answers."
 )
 
+def _messages(question: str, context: str) -> list:
+    return [
+        {"role": "system", "content": SYSTEM},
+        {"role": "user", "content": f"Question:\n{question}\n\nContext:\n{context}\n\nAnswer succinctly with citations."}
+    ]
+
+def prompt_tokens(question: str, context: str) -> int:
+    """Tokens of the chat prompt for ``question``/``context``, counting the
+    few tokens of per-message framing the chat format adds."""
+    return sum(count_tokens(m["content"]) + 4 for m in _messages(question, context)) + 3
+
+def _count_usage(usage, question: str, context: str, answer: str):
+    """Add a call's tokens to the counters, as reported by the API or else counted here."""
+    prompt, completion = getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+    prompt_tokens_total.inc(prompt if isinstance(prompt, int) else prompt_tokens(question, context))
+    completion_tokens_total.inc(completion if isinstance(completion, int) else count_tokens(answer))
+
 def generate(question: str, context: str) -> str:
     """Generate answer using OpenAI with comprehensive error handling."""
     try:
@@ -40,21 +108,51 @@ def generate(question: str, context: str) -> str:
             logger.warning("Empty context provided for question")
             return "I don't have enough information to answer this question."
         
-        messages = [
-            {"role": "system", "content": SYSTEM},
-            {"role": "user", "content": f"Question:\n{question}\n\nContext:\n{context}\n\nAnswer succinctly with citations."}
-        ]
+        messages = _messages(question, context)
         
         logger.info(f"Generating answer for question: {question[:100]}...")
         
         resp = get_client().chat.completions.create(
-            model="gpt-4o-mini", 
+            model=LLM_MODEL, 
             messages=messages, 
             temperature=0.2,
             max_tokens=1000
         )
         
         answer = resp.choices[0].message.content
+        _count_usage(getattr(resp, "usage", None), question, context, answer or "")
+        if not answer:
+            logger.warning("Empty response from OpenAI")
+            return "I don't know."
+        
+        logger.info(f"Generated answer: {answer[:100]}...")
+        return answer
+        
+    except Exception as e:
+        logger.error(f"LLM generation failed: {e}")
+        return f"{ERROR_PREFIX}: {str(e)}"
+
+async def agenerate(question: str, context: str) -> str:
+    """Non-blocking ``generate``: awaits the OpenAI call on the shared async client."""
+    try:
+        if not question or not question.strip():
+            raise ValueError("Question cannot be empty")
+        
+        if not context or not context.strip():
+            logger.warning("Empty context provided for question")
+            return "I don't have enough information to answer this question."
+        
+        logger.info(f"Generating answer for question: {question[:100]}...")
+        
+        resp = await get_async_client().chat.completions.create(
+            model=LLM_MODEL,
+            messages=_messages(question, context),
+            temperature=0.2,
+            max_tokens=1000
+        )
+        
+        answer = resp.choices[0].message.content
+        _count_usage(getattr(resp, "usage", None), question, context, answer or "")
         if not answer:
             logger.warning("Empty response from OpenAI")
             return "I don't know."
@@ -64,4 +162,45 @@ def generate(question: str, context: str) -> str:
         
     except Exception as e:
         logger.error(f"LLM generation failed: {e}")
-        return f"I encountered an error while generating an answer: {str(e)}"
+        return f"{ERROR_PREFIX}: {str(e)}"
+
+async def astream(question: str, context: str) -> AsyncIterator[str]:
+    """Yield answer tokens as OpenAI streams them.
+
+    Closing the generator (e.g. the client disconnected) closes the upstream
+    stream, which stops generation. A failure is yielded as the usual
+    ``ERROR_PREFIX`` fallback text, possibly after some tokens, followed by
+    ``StreamFailed`` so callers know the answer is incomplete.
+    """
+    if not question or not question.strip():
+        raise ValueError("Question cannot be empty")
+    
+    if not context or not context.strip():
+        logger.warning("Empty context provided for question")
+        yield "I don't have enough information to answer this question."
+        return
+    
+    logger.info(f"Streaming answer for question: {question[:100]}...")
+    stream = None
+    parts = []
+    try:
+        stream = await get_async_client().chat.completions.create(
+            model=LLM_MODEL,
+            messages=_messages(question, context),
+            temperature=0.2,
+            max_tokens=1000,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield parts[-1]
+    except Exception as e:
+        logger.error(f"LLM streaming failed: {e}")
+        yield f"{ERROR_PREFIX}: {str(e)}"
+        raise StreamFailed(str(e)) from e
+    finally:
+        if stream is not None:
+            # streamed chunks carry no usage; what was generated before a disconnect counts too
+            _count_usage(None, question, context, "".join(parts))
+            await stream.close()
@@ -1,20 +1,27 @@
-import os, io, logging
+import os, io, json, codecs, logging
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 
 # Load environment variables
 load_dotenv()
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from .schemas import QueryRequest, QueryResponse
-from .rag import answer, add_chunks
-from .utils import chunk_text
+from .rag import (aanswer, astream_answer, add_chunks, add_document, delete_document, answer_cache, reranker,
+                  deduper, snapshot_generation, index_stats, INDEX_MODE, READ_ONLY)
+from .executor import run_cpu
+from .llm import close_async_client
+from . import readiness, metrics
+from .jobs import IngestQueue, INGEST_COMMIT_CHUNKS
+from .embeddings import query_cache, embedding_cache
+from .utils import chunk_text, chunk_sections
 from pypdf import PdfReader
 from docx import Document as Docx
 from markdown import markdown
 from bs4 import BeautifulSoup
 import time
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
 PORT = int(os.getenv("PORT", "8000"))
 DOCS_DIR = os.getenv("DOCS_DIR", "/data/docs")
@@ -26,7 +33,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Enterprise Chat Assistant with RAG - Inference")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # models, index and LLM client load in the background; /ready reports them
+    readiness.start()
+    yield
+    await close_async_client()
+
+app = FastAPI(title="Enterprise Chat Assistant with RAG - Inference", lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
 # Global error handler
@@ -40,89 +54,299 @@ async def global_exception_handler(request, exc):
 
 @app.get("/health")
 def health():
-    return {"ok": True, "timestamp": time.time()}
+    return {"ok": True, "timestamp": time.time(), "index_mode": INDEX_MODE, "snapshot": snapshot_generation()}
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until the models and index are loaded."""
+    ok = readiness.ready()
+    return JSONResponse(status_code=200 if ok else 503,
+                        content={"ready": ok, "components": readiness.status()})
+
+def require_writer():
+    """Ingestion and deletes are owned by the single writer process."""
+    if READ_ONLY:
+        raise HTTPException(status_code=409, detail="This replica is read-only (INDEX_MODE=reader); "
+                                                    "send ingestion and deletes to the writer")
+
+@app.get("/rag/cache/stats")
+def rag_cache_stats():
+    return {"answers": answer_cache.stats(), "query_embeddings": query_cache.stats(),
+            "rerank": reranker.stats(), "dedup": deduper.stats() if deduper is not None else None,
+            "chunk_embeddings": embedding_cache.stats() if embedding_cache is not None else None}
+
+def _cache_stats() -> Dict[str, Dict[str, Any]]:
+    caches = {"answers": answer_cache, "query_embeddings": query_cache, "rerank": reranker.cache,
+              "chunk_embeddings": embedding_cache}
+    return {name: c.stats() for name, c in caches.items() if c is not None}
+
+def _index_stat(key: str):
+    return lambda: (index_stats() or {}).get(key)
+
+query_seconds = metrics.Histogram("rag_query_seconds", "End-to-end latency of answered queries.", ["mode"])
+_answer_seconds, _stream_seconds = query_seconds.labels("answer"), query_seconds.labels("stream")
+_upload_seconds = metrics.ingest_stage.labels("upload")
+metrics.Gauge("rag_index_chunks", "Live chunks in the index being served.", _index_stat("chunks"))
+metrics.Gauge("rag_index_tombstones", "Deleted chunks not yet compacted away.", _index_stat("tombstones"))
+metrics.Gauge("rag_index_vectors", "Vectors in the FAISS index, including deleted ones.", _index_stat("vectors"))
+metrics.Gauge("rag_metadata_bytes", "Chunk metadata held in process memory (heap) or memory-mapped.",
+              lambda: {"heap": (index_stats() or {}).get("meta_heap_bytes"),
+                       "mapped": (index_stats() or {}).get("meta_mapped_bytes")}, ["kind"])
+metrics.Gauge("rag_cache_hit_ratio", "Hits over lookups of each cache since startup.",
+              lambda: {name: s["hit_ratio"] for name, s in _cache_stats().items()}, ["cache"])
+metrics.Gauge("rag_cache_entries", "Entries held by each cache.",
+              lambda: {name: s["entries"] for name, s in _cache_stats().items()}, ["cache"])
+metrics.Gauge("rag_component_load_seconds", "Time each model or index took to load at startup.",
+              lambda: {name: s["seconds"] for name, s in readiness.status().items()}, ["component"])
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint: stage latency histograms, index and cache gauges, LLM token counters."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.post("/rag/query", response_model=QueryResponse)
-def rag_query(req: QueryRequest):
+async def rag_query(req: QueryRequest, request: Request):
+    if req.stream:
+        return await rag_query_stream(req, request)
     start_time = time.time()
     logger.info(f"RAG query started: {req.question[:100]}...")
     
     try:
-        result = answer(req.question, req.roles, req.top_k)
+        result = await aanswer(req.question, req.roles, req.top_k)
         duration = time.time() - start_time
-        logger.info(f"RAG query completed in {duration:.2f}s, sources: {len(result.sources)}")
+        _answer_seconds.observe(duration)
+        logger.info(f"RAG query completed in {duration:.2f}s, sources: {len(result['sources'])}")
         return result
     except Exception as e:
         duration = time.time() - start_time
         logger.error(f"RAG query failed after {duration:.2f}s: {e}")
         raise HTTPException(status_code=500, detail=f"RAG query failed: {str(e)}")
 
+@app.post("/rag/query/stream")
+async def rag_query_stream(req: QueryRequest, request: Request):
+    """Server-sent events: ``sources`` first, then one ``token`` event per LLM
+    delta, then ``done``. Generation stops when the client disconnects."""
+    start_time = time.time()
+    logger.info(f"RAG stream started: {req.question[:100]}...")
+
+    async def events():
+        stream = astream_answer(req.question, req.roles, req.top_k)
+        first_token = None
+        try:
+            async for event, data in stream:
+                if await request.is_disconnected():
+                    logger.info(f"RAG stream cancelled by client after {time.time() - start_time:.2f}s")
+                    break
+                if event == "token" and first_token is None:
+                    first_token = time.time() - start_time
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+            else:
+                _stream_seconds.observe(time.time() - start_time)
+                logger.info(f"RAG stream completed in {time.time() - start_time:.2f}s, "
+                            f"first token after {first_token or 0:.2f}s")
+        except Exception as e:
+            logger.error(f"RAG stream failed after {time.time() - start_time:.2f}s: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': f'RAG query failed: {str(e)}'})}\n\n"
+        finally:
+            await stream.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.delete("/rag/documents/{path:path}")
+async def rag_delete_document(path: str):
+    """Remove a document's chunks from the index (and its copy under DOCS_DIR)."""
+    require_writer()
+    # relative paths name files under DOCS_DIR, as stored by /rag/ingest
+    full = path if os.path.isabs(path) else os.path.join(DOCS_DIR, path)
+    n = await run_cpu(delete_document, full)
+    removed = False
+    docs_root = os.path.realpath(DOCS_DIR)
+    if os.path.realpath(full).startswith(docs_root + os.sep) and os.path.isfile(full):
+        os.remove(full)
+        removed = True
+    if not n and not removed:
+        raise HTTPException(status_code=404, detail=f"No indexed document at {full}")
+    logger.info(f"Document deleted: {full}, {n} chunks")
+    return {"ok": True, "path": full, "chunks": n}
+
+ALLOWED_EXTENSIONS = ['.pdf', '.docx', '.md', '.txt', '.markdown']
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "10")) * 1024 * 1024
+UPLOAD_BLOCK_BYTES = 1024 * 1024
+
+async def save_upload(file: UploadFile, dst: str) -> int:
+    """Stream an upload to ``dst`` in blocks; returns its size.
+
+    Raises 400 as soon as it exceeds ``MAX_UPLOAD_BYTES``, leaving nothing behind.
+    """
+    tmp = dst + ".part"
+    size = 0
+    try:
+        with _upload_seconds.time(), open(tmp, "wb") as f:
+            while True:
+                block = await file.read(UPLOAD_BLOCK_BYTES)
+                if not block:
+                    break
+                size += len(block)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=400,
+                                        detail=f"File too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)}MB)")
+                f.write(block)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return size
+
+@app.post("/rag/ingest/jobs", status_code=202)
+async def rag_ingest_jobs(files: List[UploadFile] = File(...), roles: str = Form("all")):
+    """Queue several uploads for background ingestion and return the job id at once."""
+    require_writer()
+    os.makedirs(DOCS_DIR, exist_ok=True)
+    entries = []
+    for file in files:
+        name = os.path.basename(file.filename or "")
+        if os.path.splitext(name)[1].lower() not in ALLOWED_EXTENSIONS:
+            entries.append({"name": name, "status": "failed",
+                            "error": f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"})
+            continue
+        dst = os.path.join(DOCS_DIR, name)
+        try:
+            await save_upload(file, dst)
+        except HTTPException as e:
+            entries.append({"name": name, "status": "failed", "error": e.detail})
+            continue
+        entries.append({"name": name, "path": dst})
+    if not any(e.get("path") for e in entries):
+        raise HTTPException(status_code=400, detail="No valid files to ingest")
+    job = ingest_queue.submit(entries, roles.split(",") or ["all"])
+    return ingest_queue.get(job.id)
+
+@app.get("/rag/ingest/jobs/{job_id}")
+def rag_ingest_job(job_id: str):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown ingest job")
+    return job
+
 @app.post("/rag/ingest")
 async def rag_ingest(file: UploadFile, roles: str = Form("all")):
     start_time = time.time()
-    logger.info(f"Document ingestion started: {file.filename}")
+    # never let the client's name reach outside DOCS_DIR
+    name = os.path.basename(file.filename or "")
+    logger.info(f"Document ingestion started: {name}")
     
     try:
-        # Validate file size (10MB limit)
-        content = await file.read()
-        if len(content) > 10 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="File too large (max 10MB)")
-        
+        require_writer()
+        if not name:
+            raise HTTPException(status_code=400, detail="Missing file name")
         # Validate file type
-        allowed_extensions = ['.pdf', '.docx', '.md', '.txt', '.markdown']
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        if file_ext not in allowed_extensions:
-            raise HTTPException(status_code=400, detail=f"Invalid file type. Allowed: {', '.join(allowed_extensions)}")
+        file_ext = os.path.splitext(name)[1].lower()
+        if file_ext not in ALLOWED_EXTENSIONS:
+            raise HTTPException(status_code=400, detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}")
         
         os.makedirs(DOCS_DIR, exist_ok=True)
-        dst = os.path.join(DOCS_DIR, file.filename)
+        dst = os.path.join(DOCS_DIR, name)
         
-        # Save file
-        with open(dst, "wb") as f:
-            f.write(content)
+        # Stream the upload to disk; the size limit is enforced while reading
+        await save_upload(file, dst)
         
-        # Extract and chunk text
-        text = extract_text(file.filename, content)
-        if not text.strip():
-            raise HTTPException(status_code=400, detail="No text content found in file")
-        
-        chunks = [{"text": t, "title": file.filename, "path": dst, "roles": roles.split(",") or ["all"]}
-                  for t in chunk_text(text)]
-        
-        if not chunks:
-            raise HTTPException(status_code=400, detail="No valid chunks extracted from file")
-        
-        # Add to index
-        add_chunks(chunks)
+        # Extract, chunk and embed page by page off the event loop so queries keep flowing
+        n = await run_cpu(add_document, dst, iter_chunk_batches(
+            name, dst, roles.split(",") or ["all"]))
         
         duration = time.time() - start_time
-        logger.info(f"Document ingestion completed: {file.filename}, {len(chunks)} chunks in {duration:.2f}s")
+        logger.info(f"Document ingestion completed: {name}, {n} chunks in {duration:.2f}s")
         
-        return {"ok": True, "chunks": len(chunks), "duration": duration}
+        return {"ok": True, "chunks": n, "duration": duration}
         
     except HTTPException:
         raise
     except Exception as e:
         duration = time.time() - start_time
-        logger.error(f"Document ingestion failed: {file.filename} after {duration:.2f}s: {e}")
+        logger.error(f"Document ingestion failed: {name} after {duration:.2f}s: {e}")
         raise HTTPException(status_code=500, detail=f"Document ingestion failed: {str(e)}")
 
+def iter_sections(name: str, source) -> Iterator[Tuple[Optional[int], str]]:
+    """Yield ``(page, text)`` sections of a document at a path or file object.
+
+    PDFs yield one section per page and DOCX one per paragraph, numbered by
+    page breaks, so a large document is never held as one string. Markdown is
+    converted whole; plain text is read in blocks without page numbers.
+    """
+    n = name.lower()
+    if n.endswith(".pdf"):
+        for i, page in enumerate(PdfReader(source).pages):
+            yield i + 1, page.extract_text() or ""
+    elif n.endswith(".docx"):
+        page = 1
+        for p in Docx(source).paragraphs:
+            yield page, p.text
+            # explicit breaks, or where Word last rendered one
+            page += max(len(p._p.xpath('.//w:br[@w:type="page"]')),
+                        len(p._p.xpath('.//w:lastRenderedPageBreak')))
+    else:
+        f = open(source, "rb") if isinstance(source, str) else source
+        try:
+            if n.endswith(".md") or n.endswith(".markdown"):
+                html = markdown(f.read().decode("utf-8", errors="ignore"))
+                soup = BeautifulSoup(html, "html.parser")
+                yield None, soup.get_text("\n")
+                return
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+            rest = ""
+            while True:
+                block = f.read(UPLOAD_BLOCK_BYTES)
+                text = rest + decoder.decode(block, final=not block)
+                if not block:
+                    break
+                # split at the last line break so no word spans two sections
+                # (they are rejoined with one); very long lines split at a space
+                cut = text.rfind("\n")
+                if cut < 0 and len(text) > 4 * UPLOAD_BLOCK_BYTES:
+                    cut = text.rfind(" ")
+                if cut < 0:
+                    rest = text
+                    continue
+                rest = text[cut + 1:]
+                yield None, text[:cut]
+            if text:
+                yield None, text
+        finally:
+            if f is not source:
+                f.close()
+
 def extract_text(name: str, content: bytes) -> str:
     """Extract text from various file formats with error handling."""
     try:
-        n = name.lower()
-        if n.endswith(".pdf"):
-            rd = PdfReader(io.BytesIO(content))
-            return "\n".join([(p.extract_text() or "") for p in rd.pages])
-        elif n.endswith(".docx"):
-            d = Docx(io.BytesIO(content))
-            return "\n".join([p.text for p in d.paragraphs])
-        elif n.endswith(".md") or n.endswith(".markdown"):
-            html = markdown(content.decode("utf-8", errors="ignore"))
-            soup = BeautifulSoup(html, "html.parser")
-            return soup.get_text("\n")
-        else:
-            return content.decode("utf-8", errors="ignore")
+        return "\n".join(text for _, text in iter_sections(name, io.BytesIO(content)))
+    except Exception as e:
+        logger.error(f"Text extraction failed for {name}: {e}")
+        raise HTTPException(status_code=400, detail=f"Failed to extract text from {name}: {str(e)}")
+
+def iter_chunk_batches(name: str, path: str, roles: List[str],
+                       batch_size: int = INGEST_COMMIT_CHUNKS) -> Iterator[List[Dict[str, Any]]]:
+    """Chunks of the file at ``path`` in batches of ``batch_size``, with page numbers.
+
+    Raises 400 when extraction fails or the file has no text.
+    """
+    batch: List[Dict[str, Any]] = []
+    n = 0
+    try:
+        for page, text in chunk_sections(iter_sections(name, path)):
+            batch.append({"text": text, "title": name, "path": path, "roles": roles, "page": page})
+            if len(batch) >= batch_size:
+                n += len(batch)
+                yield batch
+                batch = []
     except Exception as e:
         logger.error(f"Text extraction failed for {name}: {e}")
         raise HTTPException(status_code=400, detail=f"Failed to extract text from {name}: {str(e)}")
+    if not n and not batch:
+        raise HTTPException(status_code=400, detail="No text content found in file")
+    if batch:
+        yield batch
+
+# background ingestion; extraction and commits run below query priority
+ingest_queue = IngestQueue(iter_chunk_batches, lambda chunks: add_chunks(chunks),
+                           lambda path, batches: add_document(path, batches))
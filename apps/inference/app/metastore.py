@@ -0,0 +1,293 @@
+"""Memory-mapped columnar storage for chunk metadata.
+
+``meta.bin`` layout (little endian)::
+
+    preamble   magic(8) rows(u64) footer_offset(u64) footer_len(u64)
+    text       utf-8 blob of every chunk text, back to back
+    extra      utf-8 JSON blob of any keys besides title/path/roles/text
+    columns    title u32[n] | path u32[n] | roles u32[n]
+               text_off u64[n+1] | extra_off u64[n+1] | ids i64[n]   (8-byte aligned)
+    footer     JSON: interned strings, interned role sets, column offsets, info
+
+``ids`` are the stable chunk ids (ascending; files written before they
+existed use the row number). ``info`` carries store counters such as the
+next chunk id.
+
+Title/path ids index the string table and role ids the role-set table, so
+every column is fixed width and can be viewed straight out of the mmap.
+Records are only materialized for the rows that are actually read.
+"""
+import os, sys, json, mmap, struct, tempfile, shutil, bisect
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+import numpy as np
+
+MAGIC = b"ECMETA2\0"
+_MAGICS = (b"ECMETA1\0", MAGIC)
+_PREAMBLE = struct.Struct("<8sQQQ")
+_NONE = 0xFFFFFFFF
+CORE_KEYS = ("title", "path", "roles", "text")
+
+class ColumnarMeta:
+    """Read-only, mmap-backed view of a ``meta.bin`` file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, rows, foot_off, foot_len = _PREAMBLE.unpack_from(self._mm, 0)
+        if magic not in _MAGICS:
+            raise ValueError(f"{path} is not a chunk metadata file")
+        footer = json.loads(self._mm[foot_off:foot_off + foot_len].decode("utf-8"))
+        self._rows = rows
+        self._strings: List[str] = footer["strings"]
+        self._rolesets: List[List[str]] = footer["rolesets"]
+        cols = footer["columns"]
+        self._title = self._column(cols["title"], np.uint32, rows)
+        self._path = self._column(cols["path"], np.uint32, rows)
+        self._roles = self._column(cols["roles"], np.uint32, rows)
+        self._text_off = self._column(cols["text_off"], np.uint64, rows + 1)
+        self._extra_off = self._column(cols["extra_off"], np.uint64, rows + 1)
+        self.ids = self._column(cols["ids"], np.int64, rows) if "ids" in cols else np.arange(rows, dtype=np.int64)
+        self.info: Dict[str, Any] = footer.get("info", {})
+
+    def _column(self, offset: int, dtype, count: int) -> np.ndarray:
+        return np.frombuffer(self._mm, dtype=dtype, count=count, offset=offset)
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def _str(self, sid: int) -> Optional[str]:
+        return None if sid == _NONE else self._strings[sid]
+
+    def text(self, i: int) -> str:
+        return self._mm[int(self._text_off[i]):int(self._text_off[i + 1])].decode("utf-8")
+
+    def roles(self, i: int) -> List[str]:
+        return list(self._rolesets[int(self._roles[i])])
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        a, b = int(self._extra_off[i]), int(self._extra_off[i + 1])
+        rec = json.loads(self._mm[a:b].decode("utf-8")) if b > a else {}
+        rec.update(title=self._str(int(self._title[i])), path=self._str(int(self._path[i])),
+                   roles=self.roles(i), text=self.text(i))
+        return rec
+
+    def iter_texts(self) -> Iterator[str]:
+        for i in range(self._rows):
+            yield self.text(i)
+
+    @property
+    def next_id(self) -> int:
+        last = int(self.ids[-1]) + 1 if self._rows else 0
+        return max(int(self.info.get("next_id", 0)), last)
+
+    def row_of(self, chunk_id: int) -> int:
+        """Row holding ``chunk_id``, or -1."""
+        r = int(np.searchsorted(self.ids, chunk_id))
+        return r if r < self._rows and self.ids[r] == chunk_id else -1
+
+    def rows_with_path(self, path: str) -> np.ndarray:
+        try:
+            sid = self._strings.index(path)
+        except ValueError:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(self._path == sid)
+
+    def iter_roles(self) -> Iterator[List[str]]:
+        sets = self._rolesets
+        for r in self._roles:
+            yield sets[int(r)]
+
+    def nbytes(self) -> int:
+        return len(self._mm)
+
+    def close(self):
+        # numpy views keep the buffer exported; drop them before closing the map
+        self._title = self._path = self._roles = self._text_off = self._extra_off = self.ids = None
+        try:
+            self._mm.close()
+        except BufferError:  # pragma: no cover - a caller still holds a view
+            pass
+        self._f.close()
+
+def _pad(f, align: int = 8):
+    rem = f.tell() % align
+    if rem:
+        f.write(b"\0" * (align - rem))
+
+def write_columnar(path: str, records: Iterable[Dict[str, Any]], ids: Optional[Iterable[int]] = None,
+                   info: Optional[Dict[str, Any]] = None) -> int:
+    """Stream ``records`` into a new ``meta.bin`` at ``path`` (atomic replace).
+
+    ``ids`` are the records' chunk ids (default: row numbers). Returns the
+    number of rows written.
+    """
+    strings: Dict[str, int] = {}
+    rolesets: Dict[tuple, int] = {}
+    title, paths, roles = [], [], []
+    text_off, extra_off = [], [0]
+
+    def intern(s):
+        if s is None:
+            return _NONE
+        sid = strings.get(s)
+        if sid is None:
+            sid = strings[s] = len(strings)
+        return sid
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f, tempfile.TemporaryFile() as extra:
+        f.write(_PREAMBLE.pack(MAGIC, 0, 0, 0))
+        text_off.append(f.tell())
+        for rec in records:
+            title.append(intern(rec.get("title")))
+            paths.append(intern(rec.get("path")))
+            rs = tuple(rec.get("roles") or ["all"])
+            rid = rolesets.get(rs)
+            if rid is None:
+                rid = rolesets[rs] = len(rolesets)
+            roles.append(rid)
+            f.write((rec.get("text") or "").encode("utf-8"))
+            text_off.append(f.tell())
+            rest = {k: v for k, v in rec.items() if k not in CORE_KEYS}
+            if rest:
+                extra.write(json.dumps(rest, ensure_ascii=False).encode("utf-8"))
+            extra_off.append(extra.tell())
+        extra_start = f.tell()
+        extra.seek(0)
+        shutil.copyfileobj(extra, f)
+        n = len(title)
+        ids = np.arange(n, dtype=np.int64) if ids is None else np.fromiter(ids, dtype=np.int64, count=n)
+        cols = {}
+        for name, arr, dtype in (("title", title, np.uint32), ("path", paths, np.uint32),
+                                 ("roles", roles, np.uint32), ("text_off", text_off, np.uint64),
+                                 ("extra_off", np.asarray(extra_off) + extra_start, np.uint64),
+                                 ("ids", ids, np.int64)):
+            _pad(f)
+            cols[name] = f.tell()
+            np.asarray(arr, dtype=dtype).tofile(f)
+        footer = json.dumps({
+            "strings": list(strings),
+            "rolesets": [list(r) for r in rolesets],
+            "columns": cols,
+            "info": info or {},
+        }, ensure_ascii=False).encode("utf-8")
+        foot_off = f.tell()
+        f.write(footer)
+        f.seek(0)
+        f.write(_PREAMBLE.pack(MAGIC, n, foot_off, len(footer)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return n
+
+def read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def convert_jsonl(jsonl_path: str, bin_path: str, info: Optional[Dict[str, Any]] = None) -> int:
+    """Convert a legacy ``meta.jsonl`` into ``meta.bin`` without loading it whole."""
+    return write_columnar(bin_path, read_jsonl(jsonl_path), info=info)
+
+class ChunkMeta:
+    """Chunk metadata as an mmap'd snapshot plus an in-memory tail.
+
+    Rows appended since the last snapshot (``extend``) stay in the tail until
+    compaction writes a new ``meta.bin`` and ``rebase`` swaps it in. Rows are
+    ordered by chunk id; ``get`` looks a record up by id.
+    """
+
+    def __init__(self, base: Optional[ColumnarMeta] = None, tail: Optional[List[Dict[str, Any]]] = None,
+                 tail_ids: Optional[List[int]] = None):
+        self.base = base
+        self.tail: List[Dict[str, Any]] = tail or []
+        if tail_ids is None:
+            tail_ids = list(range(self._base_next(), self._base_next() + len(self.tail)))
+        self.tail_ids: List[int] = tail_ids
+
+    def _base_next(self) -> int:
+        return self.base.next_id if self.base is not None else 0
+
+    @property
+    def base_rows(self) -> int:
+        return len(self.base) if self.base is not None else 0
+
+    @property
+    def next_id(self) -> int:
+        return self.tail_ids[-1] + 1 if self.tail_ids else self._base_next()
+
+    @property
+    def ids(self) -> np.ndarray:
+        """Chunk id of every row, in row order."""
+        tail = np.asarray(self.tail_ids, dtype=np.int64)
+        return np.concatenate([self.base.ids, tail]) if self.base is not None else tail
+
+    def __len__(self) -> int:
+        return self.base_rows + len(self.tail)
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if i < self.base_rows:
+            return self.base[i]
+        return self.tail[i - self.base_rows]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def row_of(self, chunk_id: int) -> int:
+        """Row holding ``chunk_id``, or -1."""
+        if self.tail_ids and chunk_id >= self.tail_ids[0]:
+            r = bisect.bisect_left(self.tail_ids, chunk_id)
+            return self.base_rows + r if r < len(self.tail_ids) and self.tail_ids[r] == chunk_id else -1
+        return self.base.row_of(chunk_id) if self.base is not None else -1
+
+    def get(self, chunk_id: int) -> Optional[Dict[str, Any]]:
+        r = self.row_of(int(chunk_id))
+        return self[r] if r >= 0 else None
+
+    def ids_with_path(self, path: str) -> List[int]:
+        ids = [int(self.base.ids[r]) for r in self.base.rows_with_path(path)] if self.base is not None else []
+        return ids + [i for i, m in zip(self.tail_ids, self.tail) if m.get("path") == path]
+
+    def extend(self, metas: List[Dict[str, Any]], ids: Optional[List[int]] = None):
+        if ids is None:
+            ids = range(self.next_id, self.next_id + len(metas))
+        self.tail.extend(metas)
+        self.tail_ids.extend(int(i) for i in ids)
+
+    def text(self, i: int) -> str:
+        if i < self.base_rows:
+            return self.base.text(i)
+        return self.tail[i - self.base_rows].get("text", "")
+
+    def iter_texts(self) -> Iterator[str]:
+        if self.base is not None:
+            yield from self.base.iter_texts()
+        for m in self.tail:
+            yield m.get("text", "")
+
+    def iter_roles(self) -> Iterator[List[str]]:
+        if self.base is not None:
+            yield from self.base.iter_roles()
+        for m in self.tail:
+            yield m.get("roles", ["all"])
+
+    def rebase(self, base: ColumnarMeta) -> "ChunkMeta":
+        """New view over ``base`` keeping only tail rows the snapshot lacks."""
+        cut = bisect.bisect_left(self.tail_ids, base.next_id)
+        return ChunkMeta(base, self.tail[cut:], self.tail_ids[cut:])
+
+    def resident_bytes(self) -> int:
+        """Rough size of the in-memory tail (the snapshot is mmap'd)."""
+        return sum(len(m.get("text", "")) + 64 for m in self.tail)
+
+if __name__ == "__main__":
+    # python -m app.metastore /data/index/meta.jsonl [/data/index/meta.bin]
+    src = sys.argv[1]
+    dst = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.path.dirname(src), "meta.bin")
+    print(f"ok: {convert_jsonl(src, dst)} rows -> {dst}")
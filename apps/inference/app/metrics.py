@@ -0,0 +1,203 @@
+"""Prometheus metrics, served in the text exposition format by ``GET /metrics``.
+
+Histograms and counters are updated on the request path, so an observation
+is a bisect and a few additions under an uncontended lock; callers bind
+their label values once (``rag_stage.labels("bm25")``) at import. Gauges
+are callbacks evaluated only when ``/metrics`` is scraped.
+"""
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+
+# seconds; from a cached embedding lookup to a slow LLM answer
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics: List["_Metric"] = []
+# set on a thread whose histogram samples are dropped (see ``unrecorded``)
+_local = threading.local()
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)] + ([extra] if extra else [])
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _num(v: float) -> str:
+    return "+Inf" if v == float("inf") else repr(float(v))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _init_series(self):
+        if not self.labelnames:
+            self.labels()  # scraped as 0 before the first observation
+
+    def labels(self, *values: str):
+        """The series for these label values; bind it once outside hot loops."""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child())
+        return child
+
+    def _child(self):
+        raise NotImplementedError
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+class _Timer:
+    __slots__ = ("_observe", "_start")
+
+    def __init__(self, observe: Callable[[float], None]):
+        self._observe = observe
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._observe(time.perf_counter() - self._start)
+
+class _HistogramSeries:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        if getattr(_local, "unrecorded", False):
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self) -> _Timer:
+        """Context manager observing the seconds its block takes."""
+        return _Timer(self.observe)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, doc, labelnames)
+        self._init_series()
+
+    def _child(self):
+        return _HistogramSeries(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def samples(self) -> List[str]:
+        out = []
+        for values, s in sorted(self._children.items()):
+            with s._lock:
+                counts, total = list(s.counts), s.sum
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="' + _num(bound) + '"'
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, values)} {_num(total)}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}")
+        return out
+
+class _CounterSeries:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, doc, labelnames)
+        self._init_series()
+
+    def _child(self):
+        return _CounterSeries()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, values)} {_num(s.value)}"
+                for values, s in sorted(self._children.items())]
+
+class Gauge(_Metric):
+    """A value read from ``fn`` at scrape time.
+
+    Without labels ``fn`` returns a number; with labels it returns a dict
+    from label values (a tuple, or a string for one label) to numbers. None
+    leaves the gauge out of the scrape.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, fn: Callable[[], Union[None, float, Dict]],
+                 labelnames: Sequence[str] = ()):
+        super().__init__(name, doc, labelnames)
+        self.fn = fn
+
+    def samples(self) -> List[str]:
+        value = self.fn()
+        if value is None:
+            return []
+        if not self.labelnames:
+            return [f"{self.name} {_num(value)}"]
+        return [f"{self.name}{_labels(self.labelnames, k if isinstance(k, tuple) else (k,))} {_num(v)}"
+                for k, v in sorted(value.items()) if v is not None]
+
+@contextmanager
+def unrecorded():
+    """Drop the histogram samples this thread takes inside the block, so
+    synthetic traffic (startup warmup) does not skew the latency series."""
+    _local.unrecorded = True
+    try:
+        yield
+    finally:
+        _local.unrecorded = False
+
+def render() -> str:
+    """Every registered metric in the Prometheus text format."""
+    lines = []
+    for m in _metrics:
+        try:
+            samples = m.samples()
+        except Exception as e:  # a broken gauge must not take the scrape down
+            lines.append(f"# {m.name} failed: {_escape(str(e))}")
+            continue
+        lines += [f"# HELP {m.name} {m.doc}", f"# TYPE {m.name} {m.kind}"] + samples
+    return "\n".join(lines) + "\n"
+
+# shared by the modules that time pipeline stages
+rag_stage = Histogram("rag_stage_seconds", "Time spent in each stage of answering a query.", ["stage"])
+ingest_stage = Histogram("ingest_stage_seconds", "Time spent in each stage of ingesting documents.", ["stage"])
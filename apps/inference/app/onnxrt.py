@@ -0,0 +1,244 @@
+"""ONNX Runtime backend for the embedding and rerank models.
+
+With ``MODEL_BACKEND=onnx`` the service runs the sentence-transformers
+models through ONNX Runtime instead of PyTorch, optionally with int8 dynamic
+quantization (``ONNX_QUANTIZE=1``). ``OnnxEncoder`` and ``OnnxCrossEncoder``
+have the ``encode``/``predict`` methods the service calls on
+``SentenceTransformer`` and ``CrossEncoder``, so ``embed_texts`` and the
+reranker work unchanged.
+
+A model is exported once to ``ONNX_DIR/<model>/`` (``model.onnx``,
+``model.int8.onnx``, ``tokenizer.json`` and ``onnx.json``). Exporting needs
+torch; serving an exported model needs only onnxruntime and tokenizers.
+Export ahead of time and check the result against torch with:
+
+    python -m app.onnxrt export --kind embed [--model NAME] [--quantize]
+    python -m app.onnxrt parity --kind rerank [--model NAME] [--quantize]
+"""
+import os, json, argparse, logging
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "torch").lower()  # "torch" | "onnx"
+ONNX_DIR = os.getenv("ONNX_DIR", "/data/onnx")
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "0") not in ("0", "false", "False")
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 = one per core
+ONNX_BATCH_SIZE = int(os.getenv("ONNX_BATCH_SIZE", "32"))
+# the lowest cosine between torch and ONNX outputs `parity` accepts
+PARITY_MIN_COSINE = float(os.getenv("PARITY_MIN_COSINE", "0.99"))
+KINDS = ("embed", "rerank")
+DEFAULT_MODELS = {
+    "embed": os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+    "rerank": os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+}
+CONFIG = "onnx.json"
+
+def model_dir(model: str, root: str = ONNX_DIR) -> str:
+    return os.path.join(root, model.strip("/").replace("/", "__"))
+
+def _filename(quantize: bool) -> str:
+    return "model.int8.onnx" if quantize else "model.onnx"
+
+def _wrap(net, names: List[str], output: str):
+    """The transformer with positional inputs and a single output, for export."""
+    import torch
+
+    class Exported(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.net = net
+
+        def forward(self, *inputs):
+            return getattr(self.net(**dict(zip(names, inputs))), output)
+
+    return Exported()
+
+def export(model: str, kind: str, directory: Optional[str] = None, quantize: bool = False) -> str:
+    """Export ``model`` (a sentence-transformers embedder or cross-encoder) to
+    ONNX, plus its int8 quantization with ``quantize``; returns the directory."""
+    import inspect, torch
+    directory = directory or model_dir(model)
+    if kind == "embed":
+        from sentence_transformers import SentenceTransformer
+        st = SentenceTransformer(model, device="cpu")
+        pooling = st[1].get_pooling_mode_str() if len(st) > 1 else "mean"
+        if pooling not in ("mean", "cls"):
+            raise ValueError(f"{model}: {pooling} pooling is not supported by the ONNX backend")
+        net, tokenizer, output = st[0].auto_model, st.tokenizer, "last_hidden_state"
+        config = {"kind": kind, "max_length": st.max_seq_length, "pooling": pooling}
+    elif kind == "rerank":
+        from sentence_transformers import CrossEncoder
+        ce = CrossEncoder(model, device="cpu")
+        net, tokenizer, output = ce.model, ce.tokenizer, "logits"
+        config = {"kind": kind, "max_length": ce.max_length or min(tokenizer.model_max_length, 512),
+                  "activation": "sigmoid" if isinstance(ce.default_activation_function, torch.nn.Sigmoid) else None}
+    else:
+        raise ValueError(f"Unknown model kind {kind!r}, expected one of {KINDS}")
+    net.eval()
+    sample = tokenizer(["an export sample"], ["a second segment"] if kind == "rerank" else None,
+                       return_tensors="pt")
+    names = list(sample.keys())
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, _filename(False))
+    axes = {n: {0: "batch", 1: "tokens"} for n in names}
+    axes["output"] = {0: "batch", 1: "tokens"} if kind == "embed" else {0: "batch"}
+    # the TorchScript exporter; newer torch defaults to the dynamo one
+    kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(_wrap(net, names, output), tuple(sample[n] for n in names), path + ".tmp",
+                          input_names=names, output_names=["output"], dynamic_axes=axes,
+                          opset_version=14, **kwargs)
+    os.replace(path + ".tmp", path)
+    tokenizer.backend_tokenizer.save(os.path.join(directory, "tokenizer.json"))
+    with open(os.path.join(directory, CONFIG), "w", encoding="utf-8") as f:
+        json.dump({**config, "model": model, "pad_token": tokenizer.pad_token,
+                   "pad_id": tokenizer.pad_token_id}, f)
+    logger.info(f"Exported {kind} model {model} to {path}")
+    if quantize:
+        _quantize(directory)
+    return directory
+
+def _quantize(directory: str):
+    """int8 dynamic quantization of the exported weights; activations stay float."""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    src, dst = os.path.join(directory, _filename(False)), os.path.join(directory, _filename(True))
+    quantize_dynamic(src, dst + ".tmp", weight_type=QuantType.QInt8)
+    os.replace(dst + ".tmp", dst)
+    logger.info(f"Quantized {src} to int8")
+
+class _OnnxModel:
+    def __init__(self, directory: str, quantize: bool = False, threads: int = ONNX_THREADS,
+                 batch_size: int = ONNX_BATCH_SIZE):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        with open(os.path.join(directory, CONFIG), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        opts = ort.SessionOptions()
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(os.path.join(directory, _filename(quantize)), opts,
+                                            providers=["CPUExecutionProvider"])
+        self.inputs = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(directory, "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.config["max_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_id"], pad_token=self.config["pad_token"])
+        self.batch_size = batch_size
+
+    def _run(self, batch) -> Tuple[np.ndarray, np.ndarray]:
+        encodings = self.tokenizer.encode_batch(batch)
+        feed = {"input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64)}
+        out = self.session.run(None, {k: v for k, v in feed.items() if k in self.inputs})[0]
+        return out, feed["attention_mask"]
+
+class OnnxEncoder(_OnnxModel):
+    """``SentenceTransformer.encode`` on an exported embedding model."""
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return int(self.session.get_outputs()[0].shape[-1])
+
+    def encode(self, texts: Sequence[str], normalize_embeddings: bool = True, convert_to_numpy: bool = True,
+               **_) -> np.ndarray:
+        parts = []
+        for i in range(0, len(texts), self.batch_size):
+            hidden, mask = self._run(list(texts[i:i + self.batch_size]))
+            if self.config["pooling"] == "cls":
+                pooled = hidden[:, 0]
+            else:
+                m = mask[..., None].astype(np.float32)
+                pooled = (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+            parts.append(pooled.astype(np.float32))
+        vecs = np.concatenate(parts) if parts else np.zeros((0, self.get_sentence_embedding_dimension()), np.float32)
+        if normalize_embeddings:
+            vecs /= np.clip(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12, None)
+        return vecs
+
+class OnnxCrossEncoder(_OnnxModel):
+    """``CrossEncoder.predict`` on an exported cross-encoder."""
+
+    def predict(self, pairs: Sequence[Tuple[str, str]], **_) -> np.ndarray:
+        scores = []
+        for i in range(0, len(pairs), self.batch_size):
+            logits, _ = self._run([tuple(p) for p in pairs[i:i + self.batch_size]])
+            scores.append(logits[:, 0] if logits.shape[1] == 1 else logits)
+        scores = np.concatenate(scores) if scores else np.zeros(0, np.float32)
+        if self.config.get("activation") == "sigmoid":
+            scores = 1 / (1 + np.exp(-scores))
+        return scores
+
+def load(model: str, kind: str, quantize: bool = ONNX_QUANTIZE, root: str = ONNX_DIR):
+    """The ONNX Runtime model for ``model``, exported first if needed."""
+    directory = model_dir(model, root)
+    if not os.path.exists(os.path.join(directory, CONFIG)):
+        logger.warning(f"No ONNX export of {model} in {directory}; exporting it now (needs torch)")
+        export(model, kind, directory)
+    if quantize and not os.path.exists(os.path.join(directory, _filename(True))):
+        _quantize(directory)
+    logger.info(f"Loading {kind} model {model} on ONNX Runtime{' (int8)' if quantize else ''}")
+    return (OnnxEncoder if kind == "embed" else OnnxCrossEncoder)(directory, quantize)
+
+_PARITY_QUESTIONS = ["How many vacation days do new employees get?", "Who approves expense reports?",
+                     "How do I rotate the on-call pager?"]
+_PARITY_PASSAGES = ["Full-time employees accrue fifteen vacation days per year, starting on their first day.",
+                    "Expense reports under $500 are approved by the employee's manager; larger ones need finance.",
+                    "The on-call rotation changes every Monday at 10:00; hand the pager over in the team channel.",
+                    "The cafeteria serves breakfast from 7:30 to 9:30 on weekdays.",
+                    "Production deploys are frozen during the last week of each quarter."]
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a, b = np.atleast_2d(a), np.atleast_2d(b)
+    return (a * b).sum(axis=1) / np.clip(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12, None)
+
+def parity(model: str, kind: str, quantize: bool = False, root: str = ONNX_DIR,
+           questions: Sequence[str] = _PARITY_QUESTIONS, passages: Sequence[str] = _PARITY_PASSAGES) -> Dict:
+    """Compare the ONNX model with torch on sample texts.
+
+    For embeddings, the cosine between each text's two vectors; for rerank,
+    the cosine between each question's two score vectors over the passages,
+    centered so it measures agreement on the ranking rather than the common
+    offset, and whether both put the same passage first. ``ok`` is whether the lowest
+    cosine reaches ``PARITY_MIN_COSINE``.
+    """
+    onnx_model = load(model, kind, quantize, root)
+    if kind == "embed":
+        from sentence_transformers import SentenceTransformer
+        texts = list(questions) + list(passages)
+        ref = SentenceTransformer(model, device="cpu").encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+        cos = _cosine(ref, onnx_model.encode(texts))
+        report = {"texts": len(texts)}
+    else:
+        from sentence_transformers import CrossEncoder
+        pairs = [(q, p) for q in questions for p in passages]
+        shape = (len(questions), len(passages))
+        ref = np.asarray(CrossEncoder(model, device="cpu").predict(pairs)).reshape(shape)
+        got = np.asarray(onnx_model.predict(pairs)).reshape(shape)
+        cos = _cosine(ref - ref.mean(axis=1, keepdims=True), got - got.mean(axis=1, keepdims=True))
+        report = {"pairs": len(pairs), "max_abs_diff": float(np.abs(ref - got).max()),
+                  "top1_agreement": float((ref.argmax(axis=1) == got.argmax(axis=1)).mean())}
+    return {**report, "min_cosine": float(cos.min()), "mean_cosine": float(cos.mean()),
+            "ok": bool(cos.min() >= PARITY_MIN_COSINE)}
+
+def _main():
+    ap = argparse.ArgumentParser(prog="python -m app.onnxrt")
+    ap.add_argument("cmd", choices=["export", "parity"],
+                    help="export a model to ONNX, or compare the export with torch")
+    ap.add_argument("--kind", required=True, choices=KINDS)
+    ap.add_argument("--model", help="defaults to EMBEDDING_MODEL / RERANK_MODEL")
+    ap.add_argument("--quantize", action="store_true", default=ONNX_QUANTIZE, help="int8 dynamic quantization")
+    ap.add_argument("--onnx-dir", default=ONNX_DIR)
+    args = ap.parse_args()
+
+    model = args.model or DEFAULT_MODELS[args.kind]
+    if args.cmd == "export":
+        print(f"ok: {export(model, args.kind, model_dir(model, args.onnx_dir), args.quantize)}")
+        return
+    report = parity(model, args.kind, args.quantize, args.onnx_dir)
+    print(" ".join(f"{k}={v:.4f}" if isinstance(v, float) else f"{k}={v}" for k, v in report.items()))
+    if not report["ok"]:
+        raise SystemExit(f"parity below PARITY_MIN_COSINE={PARITY_MIN_COSINE}")
+
+if __name__ == "__main__":
+    _main()
@@ -1,11 +1,20 @@
 import os
+import time
 import logging
-from typing import List, Dict
+import threading
+from typing import AsyncIterator, Iterable, Iterator, List, Dict, Tuple, Any, Optional
 import numpy as np
-from sentence_transformers import CrossEncoder
 from .store import VectorStore
-from .llm import generate
+from . import snapshots, readiness, onnxrt
+from .llm import generate, agenerate, astream, prompt_tokens, ERROR_PREFIX, StreamFailed
+from .context import pack
+from .executor import run_cpu
+from .cache import SemanticCache
+from .batching import MicroBatcher, BATCHING
+from .rerank import Reranker
 from .retriever import HybridRetriever
+from .dedup import Deduper, DEDUP, simhash, hamming
+from .metrics import rag_stage, ingest_stage, unrecorded
 
 logger = logging.getLogger(__name__)
 
@@ -13,115 +22,544 @@ EMB_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2
 INDEX_DIR = os.getenv("INDEX_DIR", "/data/index")
 TOP_K_DEFAULT = int(os.getenv("TOP_K", "5"))
 RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+ANSWER_CACHE_ENTRIES = int(os.getenv("ANSWER_CACHE_ENTRIES", "1024"))  # 0 disables
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH")  # optional SQLite backing file
+# "writer" owns ingestion (one per INDEX_DIR); "reader" serves queries from the
+# writer's memory-mapped snapshot and follows its WAL
+INDEX_MODE = os.getenv("INDEX_MODE", "writer").lower()
+READ_ONLY = INDEX_MODE == "reader"
+READER_REFRESH_SECONDS = float(os.getenv("READER_REFRESH_SECONDS", "2"))
+# how often a writer looks for snapshot generations published by the ingestion CLI
+SNAPSHOT_POLL_SECONDS = float(os.getenv("SNAPSHOT_POLL_SECONDS", "5"))
+# run a few queries through retrieval and rerank before reporting ready
+WARMUP = os.getenv("WARMUP", "1") not in ("0", "false", "False")
+WARMUP_QUERIES_FILE = os.getenv("WARMUP_QUERIES_FILE")  # one question per line
 
 # Import embeddings from separate module
-from .embeddings import embed_texts
-
-try:
-    logger.info(f"Initializing vector store at: {INDEX_DIR}")
-    _store = VectorStore(INDEX_DIR)
-    _retriever = HybridRetriever(_store)
-    logger.info("Vector store initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize vector store: {e}")
-    raise
-
-_cross = None
-try:
+from .embeddings import embed_chunks, embed_query
+
+# per-stage latency histograms (app/metrics.py); bm25, faiss and fuse are timed by the retriever
+_embed_seconds, _cache_seconds, _rerank_seconds, _pack_seconds, _llm_seconds, _first_token_seconds = (
+    rag_stage.labels(s) for s in ("embed", "answer_cache", "rerank", "pack", "llm", "llm_first_token"))
+_extract_seconds, _embed_chunks_seconds, _add_seconds, _bm25_add_seconds, _retire_seconds, _document_seconds = (
+    ingest_stage.labels(s) for s in ("extract", "embed", "index", "bm25", "retire", "document"))
+
+answer_cache = SemanticCache(ANSWER_CACHE_ENTRIES, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_PATH)
+
+def _open_index(verify: bool = True) -> Tuple[VectorStore, HybridRetriever]:
+    store = VectorStore(INDEX_DIR, read_only=READ_ONLY, verify=verify)
+    retriever = HybridRetriever(store)
+    # a writer publishes meta.bin and BM25 postings for a CLI-built snapshot
+    store.seal()
+    return store, retriever
+
+deduper = Deduper(os.path.join(INDEX_DIR, "dedup.sqlite")) if DEDUP and not READ_ONLY else None
+
+# set by _load_index, then swapped by _reload
+_store: VectorStore | None = None
+_retriever: HybridRetriever | None = None
+
+def _load_index():
+    global _store, _retriever
+    logger.info(f"Initializing {INDEX_MODE} vector store at: {INDEX_DIR}")
+    _store, _retriever = _open_index()
+    threading.Thread(target=_follow_index, name="index-follower", daemon=True).start()
+    return _store.snapshot
+
+def _load_rerank_model():
+    if onnxrt.MODEL_BACKEND == "onnx":
+        return onnxrt.load(RERANK_MODEL, "rerank")
+    from sentence_transformers import CrossEncoder  # pulls in torch; see embeddings._load_model
     logger.info(f"Loading rerank model: {RERANK_MODEL}")
-    _cross = CrossEncoder(RERANK_MODEL)
-    logger.info("Rerank model loaded successfully")
-except Exception as e:
-    logger.warning(f"Failed to load rerank model (optional): {e}")
-    _cross = None
+    return CrossEncoder(RERANK_MODEL)
+
+# loaded in the background at startup (see app/readiness.py); requests wait for the index
+vector_index = readiness.component("index", _load_index)
+rerank_model = readiness.component("rerank_model", _load_rerank_model, required=False)
+
+def _reload():
+    """Open the current snapshot generation and swap it in.
 
+    Queries already running finish on the store and retriever they started
+    with; a writer's ingestion waits for the swap.
+    """
+    global _store, _retriever
+    gen = snapshots.current(INDEX_DIR)
+    if gen is not None:
+        # checked while the current generation still serves
+        snapshots.verify(INDEX_DIR, gen, checksums=snapshots.SNAPSHOT_VERIFY)
+    old = _store
+    if READ_ONLY:
+        _store, _retriever = _open_index(verify=False)
+    else:
+        with _write_lock:
+            old.close()
+            _store, _retriever = _open_index(verify=False)
+        snapshots.collect(INDEX_DIR)
+    if _store.lineage != old.lineage and reranker.cache is not None:
+        # chunk ids start over in a rebuilt corpus
+        reranker.cache.clear()
+    logger.info(f"Switched to snapshot generation {_store.snapshot}: {_store.stats()['chunks']} chunks")
 
-def _rerank(question: str, hits: List[Dict]) -> List[Dict]:
+def _follow_index():
+    """Swap in new snapshot generations; readers also follow the writer's WAL."""
+    failed = None
+    while True:
+        time.sleep(READER_REFRESH_SECONDS if READ_ONLY else SNAPSHOT_POLL_SECONDS)
+        try:
+            if _store.stale():
+                gen = snapshots.current(INDEX_DIR)
+                if gen != failed:
+                    try:
+                        _reload()
+                    except Exception:
+                        failed = gen  # not retried until another generation is published
+                        raise
+            elif READ_ONLY and _store.refresh() == "append":
+                _retriever.extend([])
+        except Exception as e:
+            logger.error(f"Following the index at {INDEX_DIR} failed: {e}")
+
+def snapshot_generation() -> int | None:
+    return _store.snapshot if _store is not None else None
+
+def index_stats() -> Dict[str, int] | None:
+    """``VectorStore.stats`` of the index being served, None while it loads."""
+    store = _store
+    return store.stats() if store is not None else None
+
+# serializes index writes so chunk ids reach BM25 in order and dedup
+# membership stays consistent with the store
+_write_lock = threading.Lock()
+
+def _predict(pairs: List[Tuple[str, str]]) -> np.ndarray:
+    return np.asarray(rerank_model.get().predict(pairs))
+
+# (question, chunk) pairs from concurrent requests are scored in one pass
+rerank_batcher = MicroBatcher(_predict, name="rerank-batcher")
+
+reranker = Reranker(lambda pairs: rerank_batcher.submit(pairs) if BATCHING else _predict(pairs), RERANK_MODEL)
+
+def _rerank(question: str, hits: List[Dict], k: int) -> List[Dict]:
     """Rerank hits using cross-encoder if available."""
-    if not _cross or not hits: 
+    if not hits:
+        return hits
+    try:
+        rerank_model.get()
+    except RuntimeError:  # optional: failed to load
         return hits
     try:
-        pairs = [(question, h["text"]) for h in hits]
-        scores = _cross.predict(pairs)
-        ranked = sorted(zip(hits, scores), key=lambda x: x[1], reverse=True)
-        return [{**h, "score": float(s)} for h, s in ranked]
+        ranked, report = reranker.rerank(question, hits, k)
+        logger.info(f"Rerank scored {report['pairs_scored']} pairs "
+                    f"({report['pairs_cached']} cached) of {report['candidates']} candidates")
+        return ranked
     except Exception as e:
         logger.warning(f"Reranking failed, using original order: {e}")
         return hits
 
+NO_DOCS_ANSWER = "I don't have enough information to answer your question. Please try uploading relevant documents first."
+# usage of an answer that made no LLM call
+NO_USAGE = {"prompt_tokens": 0, "context_tokens": 0, "chunks": 0, "chunks_dropped": 0}
+
+def _prepare(question: str, roles: List[str], top_k: int | None, warmup: bool = False) -> Dict:
+    """Validate inputs and look the question up in the answer cache (not for
+    ``warmup`` questions, which would count as misses)."""
+    k = top_k or TOP_K_DEFAULT
+    
+    # Validate inputs
+    if not question or not question.strip():
+        raise ValueError("Question cannot be empty")
+    if not roles:
+        roles = ["all"]
+    
+    logger.info(f"Processing question: {question[:100]}... with roles: {roles}")
+    
+    vector_index.get()
+    # the whole query runs on the snapshot current when it started
+    retriever = _retriever
+    store = retriever.store
+    # Near-duplicate question from a caller with the same roles on the same index
+    with _embed_seconds.time():
+        q_vec = embed_query(question)
+    req = {"question": question, "roles": roles, "k": k, "retriever": retriever,
+           "generation": f"{store.lineage}:{store.generation}",
+           "scope": f"{k}|{','.join(sorted(set(roles)))}", "q_vec": q_vec}
+    if warmup:
+        req["cached"] = None
+        return req
+    with _cache_seconds.time():
+        req["cached"] = answer_cache.get(req["q_vec"], req["scope"], req["generation"])
+    if req["cached"] is not None:
+        logger.info("Answer served from semantic cache")
+    return req
+
+def _retrieve(req: Dict) -> List[Dict]:
+    """Hybrid retrieval followed by rerank, limited to k hits and packed into
+    the context token budget; sets ``req["context"]`` and ``req["usage"]``."""
+    hits = req["retriever"].hybrid(req["question"], req["roles"], req["k"] * 2)
+    if not hits:
+        logger.warning("No relevant documents found")
+        return []
+    with _rerank_seconds.time():
+        hits = _rerank(req["question"], hits, req["k"])[:req["k"]]
+    with _pack_seconds.time():
+        req["context"], used, context_tokens = pack(hits)
+        req["usage"] = {"prompt_tokens": prompt_tokens(req["question"], req["context"]),
+                        "context_tokens": context_tokens, "chunks": len(used),
+                        "chunks_dropped": len(hits) - len(used)}
+    logger.info(f"Prompt is {req['usage']['prompt_tokens']} tokens "
+                f"({context_tokens} context tokens from {len(used)} of {len(hits)} chunks)")
+    return used
+
+def _sources(hits: List[Dict]) -> List[Dict]:
+    return [{
+        "title": h.get("title", "doc"), 
+        "score": h.get("score", 0.0), 
+        "path": h.get("path"), 
+        "page": h.get("page"), 
+        "roles": h.get("roles", [])
+    } for h in hits]
+
+def _finish(req: Dict, hits: List[Dict], ans: str, complete: bool = True) -> Dict:
+    """Format sources and cache a successful, ``complete`` answer."""
+    sources = _sources(hits)
+    
+    logger.info(f"Generated answer with {len(sources)} sources")
+    result = {"answer": ans, "sources": sources, "usage": req["usage"]}
+    if complete and not ans.startswith(ERROR_PREFIX):
+        answer_cache.put(req["question"], req["q_vec"], req["scope"], req["generation"], result)
+    return result
+
+_WARMUP_QUERIES = ["What is our vacation policy?", "How do I reset my password?",
+                   "Who do I contact about an expense report?"]
+
+def _warmup() -> int:
+    """Run the warmup questions through embedding, retrieval, rerank and prompt
+    packing so the first real queries don't pay for cold caches and kernels;
+    returns the number of questions run."""
+    queries = _WARMUP_QUERIES
+    if WARMUP_QUERIES_FILE:
+        with open(WARMUP_QUERIES_FILE, "r", encoding="utf-8") as f:
+            queries = [q.strip() for q in f if q.strip()]
+    with unrecorded():
+        for q in queries:
+            _retrieve(_prepare(q, ["all"], None, warmup=True))
+    logger.info(f"Warmed up with {len(queries)} queries")
+    return len(queries)
+
+if WARMUP:
+    readiness.component("warmup", _warmup, required=False)
+
 def answer(question: str, roles: List[str], top_k: int | None = None) -> Dict:
     """Generate answer using RAG pipeline with comprehensive error handling."""
     try:
-        k = top_k or TOP_K_DEFAULT
-        
-        # Validate inputs
-        if not question or not question.strip():
-            raise ValueError("Question cannot be empty")
-        if not roles:
-            roles = ["all"]
-        
-        logger.info(f"Processing question: {question[:100]}... with roles: {roles}")
-        
-        # Retrieve relevant documents
-        hits = _retriever.hybrid(question, roles, k * 2)
+        req = _prepare(question, roles, top_k)
+        if req["cached"] is not None:
+            return req["cached"]
+        hits = _retrieve(req)
         if not hits:
-            logger.warning("No relevant documents found")
-            return {
-                "answer": "I don't have enough information to answer your question. Please try uploading relevant documents first.",
-                "sources": []
-            }
-        
-        # Rerank and limit results
-        hits = _rerank(question, hits)[:k]
-        
-        # Build context
-        context = "\n\n".join([f"[{h.get('title','doc')}] {h['text']}" for h in hits])
-        
-        # Generate answer
-        ans = generate(question, context)
-        
-        # Format sources
-        sources = [{
-            "title": h.get("title", "doc"), 
-            "score": h.get("score", 0.0), 
-            "path": h.get("path"), 
-            "roles": h.get("roles", [])
-        } for h in hits]
-        
-        logger.info(f"Generated answer with {len(sources)} sources")
-        return {"answer": ans, "sources": sources}
+            return {"answer": NO_DOCS_ANSWER, "sources": []}
+        with _llm_seconds.time():
+            ans = generate(question, req["context"])
+        return _finish(req, hits, ans)
         
     except Exception as e:
         logger.error(f"RAG answer generation failed: {e}")
         raise
 
-def add_chunks(chunks: List[Dict]):
-    """Add document chunks to the vector store with error handling."""
+async def aanswer(question: str, roles: List[str], top_k: int | None = None) -> Dict:
+    """``answer`` for the event loop: CPU stages run on the CPU executor and the
+    LLM call is awaited, so a request holds no thread while the model generates."""
     try:
-        if not chunks:
-            logger.warning("No chunks provided for indexing")
-            return
-        
-        logger.info(f"Adding {len(chunks)} chunks to index")
+        req = await run_cpu(_prepare, question, roles, top_k)
+        if req["cached"] is not None:
+            return req["cached"]
+        hits = await run_cpu(_retrieve, req)
+        if not hits:
+            return {"answer": NO_DOCS_ANSWER, "sources": []}
+        with _llm_seconds.time():
+            ans = await agenerate(question, req["context"])
+        return _finish(req, hits, ans)
         
-        texts = [c["text"] for c in chunks]
-        metas = [{
+    except Exception as e:
+        logger.error(f"RAG answer generation failed: {e}")
+        raise
+
+async def astream_answer(question: str, roles: List[str], top_k: int | None = None) -> AsyncIterator[Tuple[str, Any]]:
+    """Streaming ``aanswer``: yields ``("sources", [...])`` as soon as retrieval is
+    done, then ``("token", text)`` per LLM delta, then ``("done", {"answer": ..., "usage": ...})``;
+    answers served from the cache add ``"cached": True`` and report no usage.
+    The full answer is cached only if the stream ran to completion without
+    an LLM failure."""
+    req = await run_cpu(_prepare, question, roles, top_k)
+    cached = req["cached"]
+    if cached is not None:
+        yield "sources", cached["sources"]
+        yield "token", cached["answer"]
+        yield "done", {"answer": cached["answer"], "usage": dict(NO_USAGE), "cached": True}
+        return
+    hits = await run_cpu(_retrieve, req)
+    if not hits:
+        yield "sources", []
+        yield "token", NO_DOCS_ANSWER
+        yield "done", {"answer": NO_DOCS_ANSWER, "usage": dict(NO_USAGE)}
+        return
+    yield "sources", _sources(hits)
+    parts = []
+    tokens = astream(question, req["context"])
+    started = time.perf_counter()
+    complete = True
+    try:
+        async for tok in tokens:
+            if not parts:
+                _first_token_seconds.observe(time.perf_counter() - started)
+            parts.append(tok)
+            yield "token", tok
+    except StreamFailed:
+        complete = False  # the fallback text was streamed; don't cache a truncated answer
+    finally:
+        await tokens.aclose()
+    _llm_seconds.observe(time.perf_counter() - started)
+    ans = "".join(parts)
+    _finish(req, hits, ans, complete)
+    yield "done", {"answer": ans, "usage": req["usage"]}
+
+def _metas(chunks: List[Dict]) -> List[Dict]:
+    metas = []
+    for c in chunks:
+        m = {
             "title": c.get("title"), 
             "path": c.get("path"), 
             "roles": c.get("roles", ["all"]), 
             "text": c["text"]
-        } for c in chunks]
+        }
+        if c.get("page") is not None:
+            m["page"] = c["page"]
+        metas.append(m)
+    return metas
+
+def add_chunks(chunks: List[Dict], replace: bool = True):
+    """Add document chunks to the vector store with error handling.
+
+    With ``replace`` the chunks previously indexed for the same paths are
+    deleted once the new ones are searchable, so re-ingesting a file updates
+    it instead of duplicating it. With dedup on, near-duplicates of indexed
+    chunks are linked to them instead of being embedded again.
+    """
+    try:
+        if not chunks:
+            logger.warning("No chunks provided for indexing")
+            return
         
-        embs = embed_texts(texts)
-        _store.add(embs, metas)
+        logger.info(f"Adding {len(chunks)} chunks to index")
         
-        # Refresh BM25 index
-        from .retriever import HybridRetriever
-        global _retriever
-        _retriever = HybridRetriever(_store)
+        metas = _metas(chunks)
+        paths = {m["path"] for m in metas if m["path"]} if replace else set()
+        vector_index.get()
+        with _write_lock:
+            renamed: Dict[int, int] = {}
+            previous = _previous(paths)
+            kept = _index(metas)
+            _retire(previous, kept, renamed)
         
         logger.info(f"Successfully indexed {len(chunks)} chunks")
         
     except Exception as e:
         logger.error(f"Failed to add chunks to index: {e}")
         raise
+
+def add_document(path: str, batches: Iterable[List[Dict]]) -> int:
+    """Index one document streamed as batches of chunks; returns the chunk count.
+
+    Only one batch is held in memory. The chunks of the document's previous
+    version are retired after the last batch, as ``add_chunks`` does; if a
+    batch fails, the chunks added so far are released instead.
+    """
+    n = 0
+    vector_index.get()
+    with _write_lock, _document_seconds.time():
+        renamed: Dict[int, int] = {}
+        previous = _previous({path})
+        kept: List[Tuple[str, int]] = []
+        try:
+            for chunks in _timed(batches):
+                if chunks:
+                    kept += _index(_metas(chunks))
+                    n += len(chunks)
+        except Exception:
+            # roll back to the previous version: release what this ingest added
+            _retire({path: {c for _, c in kept}}, [(path, c) for c in previous.get(path, ())], renamed)
+            raise
+        _retire(previous, kept, renamed)
+    logger.info(f"Indexed {n} chunks of {path}")
+    return n
+
+def _timed(batches: Iterable[List[Dict]]) -> Iterator[List[Dict]]:
+    """``batches``, timing how long each takes to extract and chunk."""
+    it = iter(batches)
+    while True:
+        started = time.perf_counter()
+        chunks = next(it, None)
+        if chunks is None:
+            return
+        _extract_seconds.observe(time.perf_counter() - started)
+        yield chunks
+
+def _previous(paths) -> Dict[str, set]:
+    """Live chunk ids each document in ``paths`` contains before an ingest."""
+    if deduper is None:
+        return {p: set(_store.ids_for_path(p)) for p in paths}
+    return {p: {i for i in set(deduper.chunks_of(p)) | set(_store.ids_for_path(p)) if _store.is_live(i)}
+            for p in paths}
+
+def _index(metas: List[Dict]) -> List[Tuple[str, int]]:
+    """Index ``metas``; returns the ``(path, chunk id)`` pairs now holding them."""
+    if deduper is not None:
+        return _index_deduped(metas)
+    ids = _append([m["text"] for m in metas], metas)
+    return [(m["path"], i) for m, i in zip(metas, ids)]
+
+def _append(texts: List[str], metas: List[Dict]) -> List[int]:
+    """Embed chunks and add them to the store and BM25; returns their ids."""
+    with _embed_chunks_seconds.time():
+        embs = embed_chunks(texts)
+    with _add_seconds.time():
+        ids = _store.add(embs, metas)
+    # Append the new chunks to BM25 instead of rebuilding it
+    with _bm25_add_seconds.time():
+        _retriever.extend(texts, ids)
+    return ids
+
+def _retire(previous: Dict[str, set], kept: List[Tuple[str, int]], renamed: Dict[int, int]):
+    """Release each document's previous chunks that the new version did not keep."""
+    with _retire_seconds.time():
+        kept = {(p, _resolve(c, renamed)) for p, c in kept}
+        stale = [(p, _resolve(c, renamed)) for p, old in previous.items() for c in old]
+        stale = [(p, c) for p, c in stale if (p, c) not in kept]
+        if deduper is None:
+            _store.delete([c for _, c in stale])
+        else:
+            for p, cid in stale:
+                _detach(_resolve(cid, renamed), p, renamed)
+            deduper.commit()
+        if stale:
+            logger.info(f"Replaced {len(stale)} previous chunks of {len(previous)} document(s)")
+
+def _union_roles(members) -> List[str]:
+    return sorted({r for _, _, roles in members for r in (roles or ["all"])})
+
+def _role_key(roles: Optional[List[str]]) -> frozenset:
+    return frozenset(roles or ["all"])
+
+def _members(cid: int):
+    """Documents containing chunk ``cid``; seeded from its metadata when the
+    chunk predates dedup or the recorded members are stale (offline rebuild)."""
+    meta = _store.get_meta(cid)
+    members = deduper.members(cid)
+    if not members or members[0][0] != meta["path"]:
+        deduper.remove([cid])
+        members = [(meta["path"], meta.get("title"), meta.get("roles") or ["all"])]
+        deduper.set_member(cid, *members[0])
+    return members
+
+def _rewrite(cid: int, meta: Dict, renamed: Dict[int, int]) -> int:
+    new = _store.rewrite(cid, meta)
+    _retriever.extend([meta["text"]], [new])
+    deduper.relink(cid, new)
+    renamed[cid] = new
+    return new
+
+def _link(cid: int, m: Dict) -> int:
+    """Record that ``m``'s document contains chunk ``cid``; returns ``cid``.
+
+    Only documents with the same roles share a chunk, so its path and title
+    never name a document the reader could not see.
+    """
+    _members(cid)
+    deduper.set_member(cid, m["path"], m["title"], m["roles"])
+    return cid
+
+def _detach(cid: int, path: str, renamed: Dict[int, int]):
+    """Drop document ``path`` from chunk ``cid``; the chunk is deleted with its
+    last document, otherwise its roles and primary path are recomputed."""
+    rest = [x for x in _members(cid) if x[0] != path]
+    if not rest:
+        _store.delete([cid])
+        deduper.remove([cid])
+        return
+    deduper.unlink(cid, path)
+    meta = _store.get_meta(cid)
+    p, title, _ = rest[0]
+    roles = _union_roles(rest)
+    if (meta["path"], meta.get("title")) != (p, title) or set(roles) != set(meta.get("roles") or ["all"]):
+        _rewrite(cid, {**meta, "path": p, "title": title, "roles": roles}, renamed)
+
+def _resolve(cid: int, renamed: Dict[int, int]) -> int:
+    while cid in renamed:
+        cid = renamed[cid]
+    return cid
+
+def _index_deduped(metas: List[Dict]) -> List[Tuple[str, int]]:
+    def same_chunk(cid: int, fp: int) -> bool:
+        return (_store.is_live(cid)
+                and hamming(simhash(_store.get_meta(cid)["text"]), fp) <= deduper.max_distance)
+    
+    fresh, fps, batch_links, linked = [], [], [], []
+    bands: Dict[Tuple[int, int], List[int]] = {}
+    for m in metas:
+        fp, key = simhash(m["text"]), _role_key(m["roles"])
+        # near-duplicates within the batch link to the first occurrence with the same roles
+        near = {j for b in range(4) for j in bands.get((b, (fp >> (16 * b)) & 0xFFFF), ())}
+        j = next((j for j in sorted(near)
+                  if hamming(fps[j], fp) <= deduper.max_distance and _role_key(fresh[j]["roles"]) == key), None)
+        if j is not None:
+            batch_links.append((j, m))
+            continue
+        cid = deduper.find(fp, verify=lambda c: same_chunk(c, fp),
+                           accept=lambda c: _role_key(_store.get_meta(c).get("roles")) == key)
+        if cid is not None:
+            linked.append((m["path"], _link(cid, m)))
+            continue
+        for b in range(4):
+            bands.setdefault((b, (fp >> (16 * b)) & 0xFFFF), []).append(len(fresh))
+        fresh.append(m)
+        fps.append(fp)
+    
+    ids: List[int] = []
+    if fresh:
+        ids = _append([m["text"] for m in fresh], fresh)
+        for cid, fp, m in zip(ids, fps, fresh):
+            deduper.add(cid, fp)
+            deduper.set_member(cid, m["path"], m["title"], m["roles"])
+            linked.append((m["path"], cid))
+    for j, m in batch_links:
+        linked.append((m["path"], _link(ids[j], m)))
+    
+    dups = len(metas) - len(fresh)
+    saved = sum(len(m["text"].encode("utf-8")) for m in metas) - sum(len(m["text"].encode("utf-8")) for m in fresh)
+    deduper.count(checked=len(metas), duplicates=dups, bytes_saved=saved + dups * 4 * _store.dim)
+    deduper.commit()
+    if dups:
+        logger.info(f"Dedup: embedded {len(fresh)} of {len(metas)} chunks")
+    return linked
+
+def delete_document(path: str) -> int:
+    """Tombstone every chunk of the document at ``path``; returns the count.
+
+    A chunk shared with other documents through dedup is kept for them.
+    """
+    vector_index.get()
+    with _write_lock:
+        if deduper is None:
+            n = _store.delete_path(path)
+        else:
+            renamed: Dict[int, int] = {}
+            ids = {i for i in set(deduper.chunks_of(path)) | set(_store.ids_for_path(path)) if _store.is_live(i)}
+            for cid in ids:
+                _detach(_resolve(cid, renamed), path, renamed)
+            deduper.commit()
+            n = len(ids)
+    logger.info(f"Deleted {n} chunks of {path}")
+    return n
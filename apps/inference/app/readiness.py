@@ -0,0 +1,98 @@
+"""Background loading of the service's heavy state, and what ``/ready`` reports.
+
+Models, the index and the LLM client are registered as components when their
+modules are imported, but nothing is loaded then: ``start`` (called when the
+app starts) loads all of them at once on worker threads, and ``Component.get``
+loads one on first use (or waits for it). Importing the app stays fast and
+``/health`` answers while they load.
+"""
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class Component:
+    """One piece of state loaded in the background, with its load time.
+
+    An optional component (``required=False``) that fails to load does not
+    keep the service from being ready; callers fall back without it.
+    """
+
+    def __init__(self, name: str, load: Callable[[], Any], required: bool = True):
+        self.name = name
+        self.required = required
+        self.state = "pending"  # -> loading -> ready | failed
+        self.value = None
+        self.error: Optional[str] = None
+        self.seconds: Optional[float] = None
+        self._load = load
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start loading on a background thread, unless already started."""
+        with self._lock:
+            if self.state != "pending":
+                return
+            self.state = "loading"
+        threading.Thread(target=self._run, name=f"load-{self.name}", daemon=True).start()
+
+    def _run(self):
+        started = time.perf_counter()
+        try:
+            self.value = self._load()
+            self.state = "ready"
+            logger.info(f"Loaded {self.name} in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.state = "failed"
+            if self.required:
+                logger.error(f"Failed to load {self.name}: {e}")
+            else:
+                logger.warning(f"Failed to load {self.name} (optional): {e}")
+        finally:
+            self.seconds = time.perf_counter() - started
+            self._done.set()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """The loaded value, loading it first if needed.
+
+        Raises RuntimeError if loading failed and TimeoutError if it takes
+        longer than ``timeout`` seconds.
+        """
+        self.start()
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.name} is still loading")
+        if self.state == "failed":
+            raise RuntimeError(f"{self.name} failed to load: {self.error}")
+        return self.value
+
+    def status(self) -> Dict[str, Any]:
+        return {"state": self.state, "required": self.required,
+                "seconds": round(self.seconds, 3) if self.seconds is not None else None, "error": self.error}
+
+_components: Dict[str, Component] = {}
+
+def component(name: str, load: Callable[[], Any], required: bool = True) -> Component:
+    """Register a component; nothing is loaded until ``start`` or ``get``."""
+    c = _components[name] = Component(name, load, required)
+    return c
+
+def start():
+    """Load every registered component concurrently in the background."""
+    for c in list(_components.values()):
+        c.start()
+
+def ready() -> bool:
+    """Whether every required component is loaded and the optional ones have
+    finished, loaded or not."""
+    return all(c.state == "ready" if c.required else c.done for c in _components.values())
+
+def status() -> Dict[str, Dict[str, Any]]:
+    return {name: c.status() for name, c in _components.items()}
@@ -0,0 +1,92 @@
+import os
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, List, Sequence, Tuple
+from .cache import LRUCache
+from .utils import normalize_query
+
+logger = logging.getLogger(__name__)
+
+RERANK_CACHE_ENTRIES = int(os.getenv("RERANK_CACHE_ENTRIES", "100000"))  # 0 disables
+RERANK_CASCADE = os.getenv("RERANK_CASCADE", "0") not in ("0", "false", "False")
+RERANK_MARGIN = float(os.getenv("RERANK_MARGIN", "0.3"))
+
+def rrf_margins(scores: Sequence[float]) -> List[float]:
+    """Gap between consecutive fused scores, relative to the top score."""
+    if not scores or scores[0] <= 0:
+        return [0.0] * max(len(scores) - 1, 0)
+    return [(scores[i] - scores[i + 1]) / scores[0] for i in range(len(scores) - 1)]
+
+class Reranker:
+    """Cross-encoder rerank stage with a pair-score cache and an optional cascade.
+
+    Scores are cached per (question hash, chunk id, model), so repeated
+    questions only score chunks they have not seen. In cascade mode the
+    cross-encoder is skipped when the top fused (RRF) score leads the runner-up
+    by at least ``margin`` of itself, and candidates after a gap of that size
+    past position ``k`` are cut without scoring.
+    """
+
+    def __init__(self, predict: Callable[[List[Tuple[str, str]]], Sequence[float]], model: str,
+                 cache_entries: int = RERANK_CACHE_ENTRIES, cascade: bool = RERANK_CASCADE,
+                 margin: float = RERANK_MARGIN):
+        self.predict = predict
+        self.model = model
+        self.cascade = cascade
+        self.margin = margin
+        self.cache = LRUCache(cache_entries, sizeof=lambda v: 1) if cache_entries > 0 else None
+        self._lock = threading.Lock()
+        self.queries = self.skipped = self.pairs_scored = self.pairs_cached = 0
+
+    def _window(self, hits: List[Dict], k: int) -> int:
+        """Number of leading candidates that need cross-encoder scores (0 = trust RRF)."""
+        if not self.cascade or len(hits) < 2:
+            return len(hits)
+        margins = rrf_margins([h.get("score", 0.0) for h in hits])
+        if margins[0] >= self.margin:
+            return 0
+        for i in range(max(k, 1) - 1, len(margins)):
+            if margins[i] >= self.margin:
+                return i + 1
+        return len(hits)
+
+    def rerank(self, question: str, hits: List[Dict], k: int) -> Tuple[List[Dict], Dict[str, int]]:
+        """Hits reordered by cross-encoder score, plus counts of pairs scored and cached."""
+        window = self._window(hits, k)
+        report = {"candidates": len(hits), "pairs_scored": 0, "pairs_cached": 0}
+        if window == 0:
+            with self._lock:
+                self.queries += 1
+                self.skipped += 1
+            return hits, report
+
+        qhash = hashlib.sha1(normalize_query(question).encode("utf-8")).hexdigest()
+        cands = hits[:window]
+        scores: List = [None] * window
+        missing = []
+        for i, h in enumerate(cands):
+            if self.cache is not None and "_idx" in h:
+                scores[i] = self.cache.get((qhash, h["_idx"], self.model))
+            if scores[i] is None:
+                missing.append(i)
+        if missing:
+            fresh = self.predict([(question, cands[i]["text"]) for i in missing])
+            for i, s in zip(missing, fresh):
+                scores[i] = float(s)
+                if self.cache is not None and "_idx" in cands[i]:
+                    self.cache.put((qhash, cands[i]["_idx"], self.model), scores[i])
+        report["pairs_scored"] = len(missing)
+        report["pairs_cached"] = window - len(missing)
+        with self._lock:
+            self.queries += 1
+            self.pairs_scored += report["pairs_scored"]
+            self.pairs_cached += report["pairs_cached"]
+
+        ranked = sorted(zip(cands, scores), key=lambda x: x[1], reverse=True)
+        return [{**h, "score": s} for h, s in ranked], report
+
+    def stats(self) -> Dict[str, float]:
+        return {"queries": self.queries, "skipped": self.skipped,
+                "pairs_scored": self.pairs_scored, "pairs_cached": self.pairs_cached,
+                "cache": self.cache.stats() if self.cache is not None else None}
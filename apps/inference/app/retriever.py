@@ -1,52 +1,127 @@
 import os
+import logging
+import threading
+from itertools import islice
 from typing import List, Dict, Any, Tuple
-from rank_bm25 import BM25Okapi
+import numpy as np
 from .store import VectorStore
-from .embeddings import embed_texts
+from .embeddings import embed_query
+from .hybrid.bm25 import BM25Index
+from .metrics import rag_stage
+
+logger = logging.getLogger(__name__)
 
 RRF_K = int(os.getenv("RRF_K", "60"))
 
+_bm25_seconds, _faiss_seconds, _fuse_seconds = (rag_stage.labels(s) for s in ("bm25", "faiss", "fuse"))
+
 class HybridRetriever:
+    """BM25 + vector retrieval fused with reciprocal rank fusion.
+
+    The BM25 postings are saved as ``bm25.bin`` into each snapshot generation
+    a writable store publishes, and memory-mapped when a store is opened on
+    the generation instead of re-tokenizing the corpus; chunks newer than the
+    saved file are added from the store's metadata.
+    """
+
     def __init__(self, store: VectorStore):
         self.store = store
-        self._bm25 = None
-        self._bm25_tokens = None
-        self._build_bm25()
+        self._bm25: BM25Index | None = None
+        self._ids = np.empty(0, dtype=np.int64)  # chunk id of each BM25 document
+        self._lock = threading.Lock()
+        self._build_bm25(from_snapshot=True)
+        if not store.read_only:
+            # tombstoned chunks leave the store on compaction; drop them here too
+            store.on_purge(self.refresh)
+            store.on_snapshot(self.save)
 
-    def _build_bm25(self):
-        texts = self.store.all_texts()
-        self._bm25_tokens = [t.lower().split() for t in texts]
-        self._bm25 = BM25Okapi(self._bm25_tokens) if texts else None
+    def _load_snapshot(self):
+        """``(bm25, ids)`` from ``bm25.bin`` if it belongs to the store's corpus."""
+        path = os.path.join(self.store.snapshot_dir, "bm25.bin")
+        if not os.path.exists(path) or self.store.lineage is None:
+            return None
+        try:
+            bm25, extra = BM25Index.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring {path}: {e}")
+            return None
+        # chunk ids restart when the corpus is rebuilt; stale ids would match other texts
+        if bytes(extra.get("lineage", b"")).decode("ascii", "ignore") != self.store.lineage:
+            return None
+        return bm25, np.asarray(extra["ids"])
+
+    def _build_bm25(self, from_snapshot: bool = False):
+        snap = self._load_snapshot() if from_snapshot else None
+        if snap is not None:
+            bm25, ids = snap
+        else:
+            meta = self.store.all_meta()
+            ids = meta.ids
+            bm25 = BM25Index(islice(meta.iter_texts(), len(ids)))
+        with self._lock:
+            self._bm25, self._ids = bm25, ids
+        # chunks added while the index was being built (or since the snapshot)
+        self._catch_up()
+
+    def save(self, directory: str):
+        """Write the BM25 postings to ``directory/bm25.bin`` for restarts and read-only replicas."""
+        lineage = np.frombuffer((self.store.lineage or "").encode("ascii"), dtype=np.uint8)
+        self._catch_up()
+        with self._lock:
+            self._bm25.save(os.path.join(directory, "bm25.bin"), {"ids": self._ids[:len(self._bm25)], "lineage": lineage})
+
+    def _catch_up(self):
+        meta = self.store.all_meta()
+        with self._lock:
+            last = int(self._ids[-1]) if self._ids.size else -1
+            ids = meta.ids
+            new = ids[ids > last]
+            if new.size:
+                self._bm25.add([meta.get(i).get("text", "") for i in new])
+                self._ids = np.concatenate([self._ids, new])
 
     def refresh(self):
         self._build_bm25()
 
+    def extend(self, texts: List[str], ids: List[int] | None = None):
+        """Index chunks just appended to the store without rebuilding BM25."""
+        if ids is None:
+            self._catch_up()
+            return
+        with self._lock:
+            last = int(self._ids[-1]) if self._ids.size else -1
+            keep = [(t, i) for t, i in zip(texts, ids) if i > last]
+            if keep:
+                self._bm25.add([t for t, _ in keep])
+                self._ids = np.concatenate([self._ids, np.asarray([i for _, i in keep], dtype=np.int64)])
+
     def _bm25_search(self, question: str, top_k: int, roles: List[str]) -> List[Tuple[int, float]]:
-        if not self._bm25: return []
-        scores = self._bm25.get_scores(question.lower().split())
-        metas = self.store.all_meta()
-        pairs = []
-        for i, sc in enumerate(scores):
-            m = metas[i]
-            allowed = set(m.get("roles",["all"]))
-            if "all" in allowed or allowed.intersection(set(roles)):
-                pairs.append((i, float(sc)))
-        pairs.sort(key=lambda x: x[1], reverse=True)
-        return pairs[: top_k * 4]
+        bm25, ids = self._bm25, self._ids
+        if not len(bm25): return []
+        visible = self.store.role_mask(roles)
+        # role bitmaps are indexed by chunk id, BM25 by document position;
+        # documents whose id is not recorded yet (mid-extend) stay masked out
+        ids = ids[:len(bm25)]
+        mask = np.zeros(len(bm25), dtype=bool)
+        known = ids < visible.size
+        mask[:len(ids)][known] = visible[ids[known]]
+        return [(int(ids[pos]), sc) for pos, sc in bm25.search(question, top_k * 4, mask=mask)]
 
     def _vector_search(self, question: str, top_k: int, roles: List[str]) -> List[Tuple[int,float]]:
-        q_vec = embed_texts([question])
-        hits = self.store.search(q_vec, top_k, roles)
+        q_vec = embed_query(question)
+        with _faiss_seconds.time():
+            hits = self.store.search(q_vec, top_k, roles)
         return [(h["_idx"], float(h["score"])) for h in hits]
 
     def hybrid(self, question: str, roles: List[str], top_k: int) -> List[Dict[str, Any]]:
-        bm25_hits = self._bm25_search(question, top_k, roles)
+        with _bm25_seconds.time():
+            bm25_hits = self._bm25_search(question, top_k, roles)
         vec_hits = self._vector_search(question, top_k, roles)
-        score_map = {}
-        for rank, (idx, _sc) in enumerate(bm25_hits):
-            score_map[idx] = score_map.get(idx, 0.0) + 1.0 / (RRF_K + rank + 1)
-        for rank, (idx, _sc) in enumerate(vec_hits):
-            score_map[idx] = score_map.get(idx, 0.0) + 1.0 / (RRF_K + rank + 1)
-        merged = sorted(score_map.items(), key=lambda x: x[1], reverse=True)[: top_k]
-        metas = self.store.all_meta()
-        return [{**metas[idx], "score": float(sc), "_idx": idx} for idx, sc in merged]
+        with _fuse_seconds.time():
+            score_map = {}
+            for rank, (idx, _sc) in enumerate(bm25_hits):
+                score_map[idx] = score_map.get(idx, 0.0) + 1.0 / (RRF_K + rank + 1)
+            for rank, (idx, _sc) in enumerate(vec_hits):
+                score_map[idx] = score_map.get(idx, 0.0) + 1.0 / (RRF_K + rank + 1)
+            merged = sorted(score_map.items(), key=lambda x: x[1], reverse=True)[: top_k]
+            return [{**self.store.get_meta(idx), "score": float(sc), "_idx": idx} for idx, sc in merged]
@@ -5,9 +5,11 @@ class QueryRequest(BaseModel):
     question: str
     roles: List[str] = ["all"]
     top_k: int | None = None
+    stream: bool = False
     chat_id: str | None = None
     user_id: str | None = None
 
 class QueryResponse(BaseModel):
     answer: str
     sources: List[Dict[str, Any]]
+    usage: Dict[str, int] | None = None
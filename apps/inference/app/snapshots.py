@@ -0,0 +1,206 @@
+"""Numbered, immutable snapshot generations of an index directory.
+
+Each generation is a directory ``snapshots/<N>/`` holding the files of one
+snapshot (``index.faiss``, ``meta.bin`` or ``meta.jsonl``, ``vectors.npy``,
+``serving.faiss``, ``bm25.bin``) and a ``MANIFEST.json`` with their sizes and
+SHA-256 checksums. A generation is written to a staging directory, renamed
+into place and then made live by atomically replacing the ``CURRENT`` file,
+so readers never see a half-written snapshot. Superseded generations are
+deleted by ``collect`` once they have been out of use for a grace period.
+
+The ingestion CLI (workers/ingestion-cli/ingest.py) publishes and collects
+generations with this module too.
+"""
+import os, sys, json, time, uuid, fcntl, shutil, hashlib, logging
+from typing import Any, Dict, List, Optional
+from .wal import fsync_dir
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOTS = "snapshots"
+CURRENT = "CURRENT"
+MANIFEST = "MANIFEST.json"
+# superseded generations are kept this long for processes still loading them
+SNAPSHOT_GRACE_SECONDS = float(os.getenv("SNAPSHOT_GRACE_SECONDS", "600"))
+# ... and the newest ones are kept regardless
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "2"))
+# also hash every file before loading a generation (a full read of the index);
+# the manifest and file sizes are always checked, checksums are taken at publish
+SNAPSHOT_VERIFY = os.getenv("SNAPSHOT_VERIFY", "0") not in ("0", "false", "False")
+# staging directories untouched this long belong to a crashed publisher
+_STALE_STAGING = 86400
+# snapshot files of the layout before generations, left at the top of INDEX_DIR
+LEGACY_FILES = ("index.faiss", "meta.bin", "meta.jsonl", "vectors.npy", "serving.faiss", "bm25.bin", "snapshot.json")
+
+def _root(index_dir: str) -> str:
+    return os.path.join(index_dir, SNAPSHOTS)
+
+def path(index_dir: str, gen: int) -> str:
+    return os.path.join(_root(index_dir), f"{gen:08d}")
+
+def current(index_dir: str) -> Optional[int]:
+    """The live generation, or None for an index directory without any."""
+    try:
+        with open(os.path.join(index_dir, CURRENT), "r", encoding="ascii") as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def generations(index_dir: str) -> List[int]:
+    root = _root(index_dir)
+    if not os.path.isdir(root):
+        return []
+    return sorted(int(n) for n in os.listdir(root) if n.isdigit())
+
+def manifest(index_dir: str, gen: int) -> Dict[str, Any]:
+    with open(os.path.join(path(index_dir, gen), MANIFEST), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def file_sha256(p: str) -> str:
+    h = hashlib.sha256()
+    with open(p, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def verify(index_dir: str, gen: int, checksums: bool = True):
+    """Raise ValueError unless every file of ``gen`` matches its manifest.
+
+    Without ``checksums`` only presence and sizes are compared, which reads
+    no file contents.
+    """
+    d = path(index_dir, gen)
+    try:
+        files = manifest(index_dir, gen)["files"]
+    except (OSError, ValueError, KeyError) as e:
+        raise ValueError(f"Snapshot generation {gen} has no readable manifest: {e}") from None
+    for name, want in files.items():
+        p = os.path.join(d, name)
+        if not os.path.exists(p) or os.path.getsize(p) != want["size"] or \
+                (checksums and file_sha256(p) != want["sha256"]):
+            raise ValueError(f"Snapshot generation {gen}: {name} does not match its manifest")
+
+def stage(index_dir: str) -> str:
+    """A new, empty directory to write the next generation into."""
+    d = os.path.join(_root(index_dir), f".staging-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+    os.makedirs(d)
+    return d
+
+def link_or_copy(src: str, dst: str):
+    """Share an unchanged file between generations (they are never modified)."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def publish(index_dir: str, staging: str, info: Optional[Dict[str, Any]] = None,
+            expect: Optional[int] = -1) -> Optional[int]:
+    """Turn ``staging`` into the next generation and make it current.
+
+    ``info`` is recorded in the manifest. With ``expect`` (a generation or
+    None for none), nothing is published if another process made a different
+    generation current in the meantime; the staging directory is removed and
+    None returned. Returns the new generation number.
+
+    The checksums are taken here, once, from the fsynced files; opening a
+    generation compares only sizes unless ``SNAPSHOT_VERIFY`` is set.
+    """
+    files = {}
+    for name in sorted(os.listdir(staging)):
+        p = os.path.join(staging, name)
+        with open(p, "rb") as f:
+            os.fsync(f.fileno())
+        files[name] = {"size": os.path.getsize(p), "sha256": file_sha256(p)}
+    with open(os.path.join(_root(index_dir), ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        live = current(index_dir)
+        if expect != -1 and live != expect:
+            shutil.rmtree(staging, ignore_errors=True)
+            return None
+        gen = max(generations(index_dir) + [live or 0]) + 1
+        with open(os.path.join(staging, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump({**(info or {}), "generation": gen, "created": time.time(), "files": files}, f)
+            f.flush(); os.fsync(f.fileno())
+        fsync_dir(staging)
+        os.rename(staging, path(index_dir, gen))
+        fsync_dir(_root(index_dir))
+        tmp = os.path.join(index_dir, CURRENT + ".tmp")
+        with open(tmp, "w", encoding="ascii") as f:
+            f.write(f"{gen}\n")
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(index_dir, CURRENT))
+        fsync_dir(index_dir)
+    logger.info(f"Published snapshot generation {gen} of {index_dir}")
+    return gen
+
+def collect(index_dir: str, grace: float = SNAPSHOT_GRACE_SECONDS, keep: int = SNAPSHOT_KEEP) -> List[int]:
+    """Delete generations superseded more than ``grace`` seconds ago, except the
+    ``keep`` newest; returns the deleted generation numbers.
+
+    Files of a deleted generation stay readable to processes that already
+    opened or mapped them, so only processes still loading it need the grace.
+    """
+    live = current(index_dir)
+    if live is None:
+        return []
+    now, deleted = time.time(), []
+    gens = [g for g in generations(index_dir) if g <= live]
+    kept = set(gens[-keep:]) if keep > 0 else set()
+    for old, newer in zip(gens, gens[1:]):
+        if old in kept:
+            continue
+        try:
+            superseded = manifest(index_dir, newer)["created"]
+        except (OSError, ValueError, KeyError):
+            continue
+        if now - superseded >= grace:
+            shutil.rmtree(path(index_dir, old), ignore_errors=True)
+            deleted.append(old)
+    root = _root(index_dir)
+    for name in os.listdir(root):
+        d = os.path.join(root, name)
+        if not name.startswith(".staging-"):
+            continue
+        try:
+            newest = max([os.path.getmtime(d)] + [os.path.getmtime(os.path.join(d, n)) for n in os.listdir(d)])
+        except OSError:  # published meanwhile
+            continue
+        if now - newest >= _STALE_STAGING:
+            shutil.rmtree(d, ignore_errors=True)
+    # the pre-generation snapshot at the top of the directory
+    for name in LEGACY_FILES:
+        p = os.path.join(index_dir, name)
+        if os.path.exists(p) and now - os.path.getmtime(p) >= grace:
+            os.remove(p)
+    if deleted:
+        logger.info(f"Deleted snapshot generations {deleted} of {index_dir}")
+    return deleted
+
+def _main():
+    import argparse
+    ap = argparse.ArgumentParser(prog="python -m app.snapshots")
+    ap.add_argument("cmd", choices=["list", "verify", "gc"],
+                    help="list generations, check their checksums, or delete superseded ones")
+    ap.add_argument("--index-dir", default=os.getenv("INDEX_DIR", "/data/index"))
+    args = ap.parse_args()
+
+    if args.cmd == "gc":
+        print(f"ok: deleted generations {collect(args.index_dir)}")
+        return
+    live, failed = current(args.index_dir), 0
+    for gen in generations(args.index_dir):
+        if args.cmd == "verify":
+            try:
+                verify(args.index_dir, gen)
+                status = "ok"
+            except ValueError as e:
+                status, failed = str(e), failed + 1
+        else:
+            m = manifest(args.index_dir, gen)
+            status = f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(m['created']))}  {', '.join(sorted(m['files']))}"
+        print(f"{'*' if gen == live else ' '} {gen:8d}  {status}")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    _main()
@@ -1,57 +1,569 @@
-import os, json
-from typing import List, Dict, Any
+import os, time, uuid, shutil, fcntl, logging, threading
+from typing import Any, Callable, Dict, List, Optional, Set
 import numpy as np
 import faiss
+from .roles import RoleBitmap
+from . import ann, snapshots
+from .exact import ExactVectors, FILENAME as EXACT_FILENAME
+from .wal import WriteAheadLog, fsync_dir
+from .metastore import ChunkMeta, ColumnarMeta, convert_jsonl, read_jsonl, write_columnar
+
+logger = logging.getLogger(__name__)
+
+# Compact the WAL into a fresh snapshot once it grows past this many bytes
+WAL_COMPACT_BYTES = int(os.getenv("WAL_COMPACT_BYTES", str(64 * 1024 * 1024)))
+# ... or once this fraction of stored chunks are tombstones
+TOMBSTONE_COMPACT_RATIO = float(os.getenv("TOMBSTONE_COMPACT_RATIO", "0.2"))
+# write serving.faiss (an mmap-able copy of flat/SQ indexes) for read-only replicas
+SERVING_INDEX = os.getenv("SERVING_INDEX", "0") not in ("0", "false", "False")
+
+# writer locks held by this process, by index directory (flock is per open file)
+_writer_locks: Dict[str, Any] = {}
+_writer_locks_guard = threading.Lock()
+
+def _lock_writer(index_dir: str):
+    key = os.path.realpath(index_dir)
+    with _writer_locks_guard:
+        if key in _writer_locks:
+            return
+        f = open(os.path.join(index_dir, "writer.lock"), "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            raise RuntimeError(f"Another process is the writer of {index_dir}; "
+                               f"start this one with INDEX_MODE=reader") from None
+        _writer_locks[key] = f
 
 class VectorStore:
-    def __init__(self, index_dir: str):
+    """FAISS index plus chunk metadata, keyed by stable chunk ids.
+
+    Ids are assigned on ``add`` and never reused. ``delete`` tombstones ids:
+    they are cleared from the role bitmaps, so search skips them at once,
+    and the next compaction drops them from the index and metadata.
+
+    With a lossy ``index_type`` a float32 copy of every vector is kept in
+    ``vectors.npy`` (``ExactVectors``) and search re-scores the top
+    ``top_k * RESCORE_FACTOR`` candidates with it.
+
+    Snapshots are numbered generations (``app/snapshots.py``); a store loads
+    the current one and each compaction publishes the next. ``stale`` tells
+    when another process (the ingestion CLI) published a newer one; the
+    owner then opens a new store on it and ``close``s this one.
+
+    One process per index directory is the writer (``writer.lock``). Any
+    number of ``read_only`` stores can serve the same directory: they
+    memory-map the snapshot (``serving.faiss`` when the writer produces it),
+    so processes on a host share its pages, and ``refresh`` follows the
+    writer's WAL into a small in-memory tail index.
+    """
+
+    def __init__(self, index_dir: str, compact_bytes: int = WAL_COMPACT_BYTES, index_type: str = ann.INDEX_TYPE,
+                 read_only: bool = False, verify: bool = True):
         self.index_dir = index_dir
-        os.makedirs(index_dir, exist_ok=True)
-        self.index_path = os.path.join(index_dir, "index.faiss")
-        self.meta_path = os.path.join(index_dir, "meta.jsonl")
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(index_dir, exist_ok=True)
+            _lock_writer(index_dir)
+        # None for a directory from before generations: its snapshot is at the top
+        self.snapshot = snapshots.current(index_dir)
+        if self.snapshot is not None and verify:
+            snapshots.verify(index_dir, self.snapshot, checksums=snapshots.SNAPSHOT_VERIFY)
+        self._use_dir(snapshots.path(index_dir, self.snapshot) if self.snapshot is not None else index_dir)
+        self.compact_bytes = compact_bytes
+        self.index_type = index_type
         self._index = None
-        self._meta: List[Dict[str, Any]] = []
+        self._meta = ChunkMeta()
+        self._roles = RoleBitmap()
+        self._dead: Set[int] = set()
+        self._deleted_total = 0
+        self._listeners: List[Callable[[], None]] = []
+        self._snapshot_listeners: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._compacting = threading.Lock()
+        self._wal = WriteAheadLog(os.path.join(index_dir, "wal"), read_only=read_only)
+        self._exact = None
+        self._tail = None  # read-only: vectors replayed from the writer's WAL
+        self._index_max = -1
+        self.lineage = None
+        self._staged = None  # writer: next generation, derived from a snapshot the service did not write
+        self._closed = False
         self._load()
 
+    def _use_dir(self, snapshot_dir: str):
+        self.snapshot_dir = snapshot_dir
+        self.index_path = os.path.join(snapshot_dir, "index.faiss")
+        self.meta_path = os.path.join(snapshot_dir, "meta.bin")
+        # written by older releases and by workers/ingestion-cli
+        self.legacy_meta_path = os.path.join(snapshot_dir, "meta.jsonl")
+        self.serving_path = os.path.join(snapshot_dir, "serving.faiss")
+
+    def _read_index(self):
+        if not self.read_only:
+            # snapshots from before chunk ids existed are labelled by row
+            return ann.with_ids(faiss.read_index(self.index_path))
+        if os.path.exists(self.serving_path) and \
+                os.path.getmtime(self.serving_path) >= os.path.getmtime(self.index_path):
+            return ann.read_serving(self.serving_path)
+        index = ann.read_serving(self.index_path)
+        if not isinstance(ann.unwrap(index), faiss.IndexIVF):
+            logger.warning(f"{self.index_path} is loaded into private memory; set SERVING_INDEX=1 "
+                           f"on the writer to share flat/SQ indexes between processes")
+        return ann.with_ids(index)
+
     def _load(self):
         if os.path.exists(self.index_path):
-            self._index = faiss.read_index(self.index_path)
-        if os.path.exists(self.meta_path):
-            with open(self.meta_path, "r", encoding="utf-8") as f:
-                self._meta = [json.loads(l) for l in f]
-
-    def _save(self):
-        if self._index:
-            faiss.write_index(self._index, self.index_path)
-        with open(self.meta_path, "w", encoding="utf-8") as f:
-            for m in self._meta: f.write(json.dumps(m, ensure_ascii=False) + "\n")
-
-    def add(self, embeddings: np.ndarray, metas: List[Dict[str, Any]]):
-        if self._index is None:
-            self._index = faiss.IndexFlatIP(embeddings.shape[1])
+            self._index = self._read_index()
+            self._index_max = ann.max_id(self._index)
+        lossy = ann.is_lossy(self.index_type) or (
+            self._index is not None and ann.is_lossy(ann.index_kind(self._index)))
+        if lossy and ann.RESCORE_FACTOR:
+            self._exact = ExactVectors(os.path.join(self.snapshot_dir, EXACT_FILENAME))
+        info = snapshots.manifest(self.index_dir, self.snapshot) if self.snapshot is not None else {}
+        meta_path = self.meta_path
+        if not self.read_only and self._needs_meta_bin():
+            if self.snapshot is None:
+                # a directory from before generations; its first compaction publishes one
+                self._convert(self.meta_path, None)
+            else:
+                meta_path = self._stage(info.get("lineage"))
+        if os.path.exists(meta_path):
+            self._meta = ChunkMeta(ColumnarMeta(meta_path))
+            self._deleted_total = int(self._meta.base.info.get("deleted_total", 0))
+            self.lineage = self._meta.base.info.get("lineage")
+        elif os.path.exists(self.legacy_meta_path):
+            # a reader ahead of the writer, which publishes meta.bin for it
+            logger.warning(f"{self.legacy_meta_path} is held in memory until the writer publishes meta.bin")
+            self._meta = ChunkMeta(None, list(read_jsonl(self.legacy_meta_path)))
+        self.lineage = self.lineage or info.get("lineage") or self._wal_lineage()
+        if self.lineage is None and not self.read_only:
+            self.lineage = uuid.uuid4().hex
+        if self._claim_wal():
+            self._replay()
+        self._roles.add(self._meta.iter_roles(), self._meta.ids)
+        self._roles.remove(self._dead)
+
+    def _needs_meta_bin(self) -> bool:
+        """Whether the loaded snapshot has meta.jsonl (from the ingestion CLI or
+        an older release) but no up-to-date meta.bin."""
+        return os.path.exists(self.legacy_meta_path) and (
+            not os.path.exists(self.meta_path)
+            or os.path.getmtime(self.legacy_meta_path) > os.path.getmtime(self.meta_path))
+
+    def _stage(self, lineage: Optional[str]) -> str:
+        """Start the next generation from the loaded snapshot with meta.bin
+        converted from meta.jsonl; ``seal`` publishes it. Returns its meta.bin."""
+        self._staged = snapshots.stage(self.index_dir)
+        # meta.jsonl too: the ingestion CLI's delta runs read it
+        for name in ("index.faiss", EXACT_FILENAME, "meta.jsonl"):
+            if os.path.exists(os.path.join(self.snapshot_dir, name)):
+                snapshots.link_or_copy(os.path.join(self.snapshot_dir, name), os.path.join(self._staged, name))
+        return self._convert(os.path.join(self._staged, "meta.bin"), lineage)
+
+    def _convert(self, meta_path: str, lineage: Optional[str]) -> str:
+        # a new corpus: chunk ids start over, so derived snapshots (BM25) are stale
+        rows = convert_jsonl(self.legacy_meta_path, meta_path, {"lineage": lineage or uuid.uuid4().hex})
+        logger.info(f"Converted {self.legacy_meta_path} to columnar metadata ({rows} rows)")
+        return meta_path
+
+    def seal(self):
+        """Publish the generation staged at load (see ``_stage``) once the
+        snapshot listeners have added their files to it."""
+        with self._compacting:
+            staging, self._staged = self._staged, None
+            if staging is None:
+                return
+            if SERVING_INDEX and os.path.exists(os.path.join(staging, "index.faiss")):
+                self._write_serving(faiss.read_index(os.path.join(staging, "index.faiss")), staging)
+            for fn in self._snapshot_listeners:
+                fn(staging)
+            self._publish(staging, {"lineage": self.lineage})
+
+    def _wal_lineage(self) -> Optional[str]:
+        """Lineage of the snapshot the WAL extends (``wal/LINEAGE``)."""
+        try:
+            with open(os.path.join(self._wal.wal_dir, "LINEAGE"), "r", encoding="ascii") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _claim_wal(self) -> bool:
+        """Whether the WAL extends the loaded snapshot. A writer discards the log
+        of a superseded corpus (the ingestion CLI published a rebuild) and marks
+        the log as its own."""
+        logged = self._wal_lineage()
+        if logged == self.lineage:
+            return True
+        if self.read_only:
+            return False
+        # a log without a mark predates generations and extends the snapshot at the top
+        if logged is not None or self.snapshot is not None:
+            if self._wal.segments():
+                logger.warning(f"Discarding the write-ahead log of a superseded snapshot of {self.index_dir}")
+            self._wal.reset()
+        tmp = os.path.join(self._wal.wal_dir, "LINEAGE.tmp")
+        with open(tmp, "w", encoding="ascii") as f:
+            f.write(self.lineage)
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self._wal.wal_dir, "LINEAGE"))
+        fsync_dir(self._wal.wal_dir)
+        return True
+
+    def _replay(self):
+        """Re-apply WAL records newer than the snapshot.
+
+        The index and metadata files are replaced one after the other, so each
+        is caught up independently from its own next chunk id.
+        """
+        return self._replay_wal()
+
+    def _replay_wal(self, resume: bool = False) -> int:
+        meta_next = self._meta.next_id
+        vec_next = max(meta_next, self._index_max + 1)
+        if self._tail is not None and self._tail.ntotal:
+            vec_next = max(vec_next, int(ann.index_ids(self._tail)[-1]) + 1)
+        replayed = 0
+        for start, vecs, metas in self._wal.replay(resume):
+            if vecs is None:
+                live = {i for i in metas if self._meta.row_of(i) >= 0} - self._dead
+                self._dead |= live
+                self._deleted_total += len(live)
+                if resume:
+                    self._roles.remove(live)
+                replayed += 1
+                continue
+            if start > min(vec_next, meta_next):
+                logger.warning(f"WAL record at chunk {start} does not follow the snapshot; ignoring rest of log")
+                break
+            ids = np.arange(start, start + len(vecs), dtype="int64")
+            if self._exact is not None:
+                self._exact.extend(ids, vecs)
+            if ids[-1] >= meta_next:
+                new = ids >= meta_next
+                added = [m for m, n in zip(metas, new) if n]
+                self._meta.extend(added, ids[new].tolist())
+                meta_next = self._meta.next_id
+                if resume:
+                    self._roles.add((m.get("roles", ["all"]) for m in added), ids[new])
+            if ids[-1] >= vec_next:
+                new = ids >= vec_next
+                if self.read_only:
+                    # the mapped snapshot cannot grow
+                    if self._tail is None:
+                        self._tail = faiss.IndexIDMap2(faiss.IndexFlatIP(vecs.shape[1]))
+                    self._tail.add_with_ids(np.ascontiguousarray(vecs[new]), ids[new])
+                else:
+                    if self._index is None:
+                        self._index = ann.empty_index(self.index_type, vecs.shape[1])
+                    self._index.add_with_ids(np.ascontiguousarray(vecs[new]), ids[new])
+                vec_next = int(ids[-1]) + 1
+            replayed += 1
+        if replayed and not resume:
+            logger.info(f"Replayed {replayed} WAL records, {len(self._meta)} chunks loaded")
+        return replayed
+
+    def add(self, embeddings: np.ndarray, metas: List[Dict[str, Any]]) -> List[int]:
+        """Append chunks; returns their new chunk ids."""
+        self._check_writable()
+        embeddings = np.ascontiguousarray(embeddings, dtype="float32")
         faiss.normalize_L2(embeddings)
-        self._index.add(embeddings.astype("float32"))
-        self._meta.extend(metas)
-        self._save()
+        with self._lock:
+            start = self._meta.next_id
+            ids = np.arange(start, start + len(metas), dtype="int64")
+            self._wal.append(start, embeddings, metas)
+            if self._index is None:
+                self._index = ann.empty_index(self.index_type, embeddings.shape[1])
+            self._index.add_with_ids(embeddings, ids)
+            if self._exact is not None:
+                self._exact.extend(ids, embeddings)
+            self._meta.extend(metas, ids.tolist())
+            self._roles.add((m.get("roles", ["all"]) for m in metas), ids)
+        self._maybe_compact()
+        return ids.tolist()
+
+    def delete(self, ids) -> int:
+        """Tombstone chunk ids; returns how many were live."""
+        self._check_writable()
+        with self._lock:
+            ids = sorted({int(i) for i in ids} - self._dead)
+            ids = [i for i in ids if self._meta.row_of(i) >= 0]
+            if not ids:
+                return 0
+            self._wal.append_delete(ids)
+            self._roles.remove(ids)
+            self._dead.update(ids)
+            self._deleted_total += len(ids)
+        self._maybe_compact()
+        return len(ids)
+
+    def rewrite(self, chunk_id: int, meta: Dict[str, Any]) -> int:
+        """Re-add a chunk's stored vector under new metadata and tombstone the old
+        id; returns the new id. Nothing is re-embedded."""
+        self._check_writable()
+        with self._lock:
+            vec = self._exact.get([chunk_id]) if self._exact is not None else None
+            # quantized indexes only reconstruct an approximation
+            vec = vec[0] if vec is not None else ann.reconstruct(self._index, chunk_id)
+        new_id = self.add(vec[None, :], [meta])[0]
+        self.delete([chunk_id])
+        return new_id
+
+    def _check_writable(self):
+        if self.read_only:
+            raise PermissionError(f"The vector store at {self.index_dir} is read-only (INDEX_MODE=reader)")
+        if self._closed:
+            raise RuntimeError(f"This store of {self.index_dir} was closed; it was replaced by a newer snapshot")
+
+    def stale(self) -> bool:
+        """Whether another process made a different snapshot generation current."""
+        with self._compacting:  # not while publishing one of our own
+            return snapshots.current(self.index_dir) != self.snapshot
 
-    def search(self, query_vec: np.ndarray, top_k: int, roles: List[str]):
-        if self._index is None or self._index.ntotal == 0:
+    def close(self):
+        """Stop writing through this store (its replacement takes over the WAL);
+        waits for a running compaction. Searches keep working."""
+        with self._compacting:
+            self._closed = True
+            self._wal.close()
+
+    def is_live(self, chunk_id: int) -> bool:
+        with self._lock:
+            return chunk_id not in self._dead and self._meta.row_of(chunk_id) >= 0
+
+    def ids_for_path(self, path: str) -> List[int]:
+        """Live chunk ids of the document stored at ``path``."""
+        with self._lock:
+            return [i for i in self._meta.ids_with_path(path) if i not in self._dead]
+
+    def delete_path(self, path: str) -> int:
+        return self.delete(self.ids_for_path(path))
+
+    def on_purge(self, fn: Callable[[], None]):
+        """Call ``fn`` after a compaction physically removed tombstoned chunks."""
+        self._listeners.append(fn)
+
+    def on_snapshot(self, fn: Callable[[str], None]):
+        """Call ``fn(directory)`` with each new generation before it is published,
+        so it can add files derived from the snapshot."""
+        self._snapshot_listeners.append(fn)
+
+    def refresh(self) -> Optional[str]:
+        """Catch a read-only store up with the writer's WAL.
+
+        Returns ``"append"`` after replaying new records, None when nothing
+        changed. A new generation needs a new store (see ``stale``).
+        """
+        if not self.read_only:
+            return None
+        # the writer has moved on to another snapshot's log
+        if self._wal_lineage() != self.lineage:
+            return None
+        with self._lock:
+            replayed = self._replay_wal(resume=True)
+        return "append" if replayed else None
+
+    def _maybe_compact(self):
+        if self.read_only or self._closed:
+            return
+        due = (self._wal.size_bytes() >= self.compact_bytes
+               or ann.should_build(self._index, self.index_type)
+               or len(self._dead) > TOMBSTONE_COMPACT_RATIO * len(self._meta))
+        if due and not self._compacting.locked():
+            threading.Thread(target=self.compact, name="vectorstore-compact", daemon=True).start()
+
+    def compact(self):
+        """Publish a snapshot of the live rows as the next generation and drop
+        the WAL it covers.
+
+        Tombstoned chunks are left out of the snapshot and the in-memory index.
+        Adds and deletes keep going to a new WAL segment while the snapshot is
+        written.
+        """
+        self._check_writable()
+        with self._compacting:
+            self._build_ann()
+            with self._lock:
+                if self._index is None:
+                    return
+                seg = self._wal.rotate()
+                dead = set(self._dead)
+                index_bytes = faiss.serialize_index(self._index)
+                # the old snapshot stays mapped, so it can be streamed unlocked
+                snap = ChunkMeta(self._meta.base, list(self._meta.tail), list(self._meta.tail_ids))
+                info = {"next_id": snap.next_id, "deleted_total": self._deleted_total, "lineage": self.lineage}
+                exact = self._exact.snapshot() if self._exact is not None and self._exact.dim else None
+            purged = None
+            if dead:
+                purged = ann.remove_ids(faiss.deserialize_index(index_bytes), dead)
+                index_bytes = faiss.serialize_index(purged)
+            staging = snapshots.stage(self.index_dir)
+            if exact is not None:
+                self._exact.write_snapshot(exact, dead, os.path.join(staging, EXACT_FILENAME))
+            self._write_snapshot(staging, index_bytes, snap, dead, info)
+            if SERVING_INDEX:
+                self._write_serving(purged if purged is not None else faiss.deserialize_index(index_bytes), staging)
+            with self._lock:
+                if purged is not None:
+                    self._index = self._carry_over(purged, info["next_id"])
+                    self._dead -= dead
+                self._meta = self._meta.rebase(ColumnarMeta(os.path.join(staging, "meta.bin")))
+                if exact is not None:
+                    self._exact.rebase(info["next_id"], os.path.join(staging, EXACT_FILENAME))
+            if dead:
+                for fn in self._listeners:
+                    fn()
+            for fn in self._snapshot_listeners:
+                fn(staging)
+            if not self._publish(staging, info):
+                return
+            self._wal.drop_before(seg)
+            logger.info(f"Compacted vector store snapshot: {len(snap) - len(dead)} chunks, {len(dead)} purged")
+
+    def _publish(self, staging: str, info: Dict[str, Any]) -> bool:
+        """Make ``staging`` the current generation unless another process
+        published one since this store was loaded."""
+        gen = snapshots.publish(self.index_dir, staging, info, expect=self.snapshot)
+        if gen is None:
+            logger.warning(f"Another process published a snapshot of {self.index_dir}; "
+                           f"this one is dropped until the store is reopened on it")
+            return False
+        self.snapshot = gen
+        self._use_dir(snapshots.path(self.index_dir, gen))
+        if self._exact is not None:
+            self._exact.path = os.path.join(self.snapshot_dir, EXACT_FILENAME)
+        if self._staged is not None:
+            # superseded before it was sealed
+            shutil.rmtree(self._staged, ignore_errors=True)
+            self._staged = None
+        snapshots.collect(self.index_dir)
+        return True
+
+    def _write_serving(self, index, directory: str):
+        # HNSW cannot be mapped; IVF kinds are mapped from index.faiss itself
+        serving = ann.serving_index(index)
+        if serving is not None and serving is not index:
+            faiss.write_index(serving, os.path.join(directory, "serving.faiss"))
+
+    def _carry_over(self, index, next_id: int):
+        """Add rows appended to the live index since the snapshot to ``index``."""
+        ids = ann.index_ids(self._index)
+        # appends land at the end of storage, in id order
+        start = int(np.searchsorted(ids, next_id)) if ids.size and ids[-1] >= next_id else ids.size
+        if start < ids.size:
+            vecs = self._exact.get(ids[start:]) if self._exact is not None else None
+            if vecs is None:
+                vecs = ann.reconstruct_all(self._index, start)
+            index.add_with_ids(vecs, ids[start:])
+        return index
+
+    def _build_ann(self):
+        """Replace a flat index by ``index_type`` once enough vectors exist.
+
+        Training runs outside the lock on a copy of the vectors; rows added in
+        the meantime are copied over before the swap. Nothing is re-embedded.
+        """
+        with self._lock:
+            if not ann.should_build(self._index, self.index_type):
+                return
+            flat = self._index
+            n = flat.ntotal
+            vectors = ann.reconstruct_all(flat)
+            ids = ann.index_ids(flat)
+        started = time.time()
+        index = ann.build_index(self.index_type, vectors, ids)
+        with self._lock:
+            if self._index is not flat:
+                return
+            if flat.ntotal > n:
+                index.add_with_ids(ann.reconstruct_all(flat, n), ann.index_ids(flat)[n:])
+            self._index = index
+        logger.info(f"Built {self.index_type} index over {index.ntotal} vectors in {time.time() - started:.1f}s")
+
+    def _write_snapshot(self, directory: str, index_bytes: np.ndarray, metas: ChunkMeta, dead: Set[int],
+                        info: Dict[str, Any]):
+        with open(os.path.join(directory, "index.faiss"), "wb") as f:
+            f.write(index_bytes.tobytes())
+        live = [(r, int(i)) for r, i in enumerate(metas.ids) if int(i) not in dead]
+        write_columnar(os.path.join(directory, "meta.bin"), (metas[r] for r, _ in live), (i for _, i in live), info)
+
+    def search(self, query_vec: np.ndarray, top_k: int, roles: List[str],
+               nprobe: int | None = None, ef_search: int | None = None):
+        index, exact, tail = self._index, self._exact, self._tail
+        if (index is None or index.ntotal == 0) and (tail is None or tail.ntotal == 0):
             return []
         faiss.normalize_L2(query_vec)
-        D, I = self._index.search(query_vec.astype("float32"), top_k * 4)
-        out = []
-        for idx, score in zip(I[0], D[0]):
-            if idx < 0: continue
-            m = self._meta[idx]
-            allowed = set(m.get("roles", ["all"]))
-            if "all" in allowed or allowed.intersection(set(roles)):
-                out.append({**m, "score": float(score), "_idx": idx})
-            if len(out) >= top_k:
-                break
-        return out
+        query_vec = query_vec.astype("float32")
+        rescore = exact is not None and ann.RESCORE_FACTOR > 1 and index is not None and ann.index_is_lossy(index)
+        k = top_k * ann.RESCORE_FACTOR if rescore else top_k
+        # role filter runs inside FAISS, so every allowed chunk competes for top_k
+        selector = self._roles.selector(roles)
+        scores, ids = np.empty(0, dtype="float32"), np.empty(0, dtype="int64")
+        if index is not None and index.ntotal:
+            params = ann.search_params(index, selector, nprobe, ef_search)
+            D, I = index.search(query_vec, k, params=params)
+            scores, ids = D[0], I[0]
+        if tail is not None and tail.ntotal:
+            # rows replayed from the WAL since the mapped snapshot (exact scores)
+            tD, tI = tail.search(query_vec, top_k, params=faiss.SearchParameters(sel=selector))
+            keep = tI[0] >= 0
+            scores, ids = np.concatenate([scores, tD[0][keep]]), np.concatenate([ids, tI[0][keep]])
+            order = np.argsort(-scores, kind="stable")
+            scores, ids = scores[order], ids[order]
+        if rescore:
+            found = ids >= 0
+            scores, ids = scores[found], ids[found]
+            vecs = exact.get(ids)
+            if vecs is not None:
+                scores, ids = ann.rescore(query_vec[0].astype("float32"), ids, vecs, top_k)
+            else:
+                logger.debug("Candidates missing from the float32 side file; keeping approximate scores")
+        scores, ids = scores[:top_k], ids[:top_k]
+        meta = self._meta
+        hits = []
+        for idx, score in zip(ids, scores):
+            m = meta.get(idx) if idx >= 0 else None
+            if m is not None:
+                hits.append({**m, "score": float(score), "_idx": int(idx)})
+        return hits
+
+    def role_mask(self, roles: List[str]) -> np.ndarray:
+        """Boolean mask over chunk ids visible to ``roles`` (tombstones excluded)."""
+        return self._roles.mask(roles)
+
+    @property
+    def generation(self) -> int:
+        """Changes whenever the searchable content changes; keys derived caches.
+
+        Both terms only grow and are persisted, so a value is never reused.
+        """
+        return self._meta.next_id + self._deleted_total
+
+    def stats(self) -> Dict[str, int]:
+        index, tail, meta = self._index, self._tail, self._meta
+        return {"chunks": len(meta) - len(self._dead), "tombstones": len(self._dead),
+                "next_id": meta.next_id,
+                "vectors": (index.ntotal if index is not None else 0) + (tail.ntotal if tail is not None else 0),
+                "meta_heap_bytes": meta.resident_bytes(),
+                "meta_mapped_bytes": meta.base.nbytes() if meta.base is not None else 0}
+
+    @property
+    def dim(self) -> int:
+        return self._index.d if self._index is not None else 0
+
+    def get_meta(self, idx: int) -> Dict[str, Any]:
+        """Materialize the metadata record of one chunk id."""
+        m = self._meta.get(idx)
+        if m is None:
+            raise KeyError(f"No chunk with id {idx}")
+        return m
+
+    def all_ids(self) -> np.ndarray:
+        """Chunk ids in the order of ``all_texts``."""
+        return self._meta.ids
 
     def all_texts(self):
-        return [m.get("text","") for m in self._meta]
+        """Chunk texts in id order, read lazily from the snapshot."""
+        return self._meta.iter_texts()
 
     def all_meta(self):
         return self._meta
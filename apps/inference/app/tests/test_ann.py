@@ -0,0 +1,78 @@
+import numpy as np
+import faiss
+from app import ann
+from app.store import VectorStore
+
+def _vectors(n, dim=16, seed=0):
+    x = np.random.default_rng(seed).standard_normal((n, dim)).astype("float32")
+    faiss.normalize_L2(x)
+    return x
+
+def test_factory_kinds():
+    x = _vectors(2000)
+    for kind in ann.INDEX_TYPES:
+        index = ann.build_index(kind, x)
+        assert ann.index_kind(index) == kind
+        assert index.ntotal == 2000
+
+def test_flat_store_trains_ivf_and_keeps_role_filter(tmp_path, monkeypatch):
+    monkeypatch.setattr(ann, "ANN_MIN_VECTORS", 1000)
+    vs = VectorStore(str(tmp_path), index_type="ivf")
+    x = _vectors(1200)
+    vs.add(x[:600], [{"text": "t", "title": "E", "roles": ["eng"]}] * 600)
+    assert ann.index_kind(vs._index) == "flat"
+    vs.add(x[600:], [{"text": "t", "title": "L", "roles": ["legal"]}] * 600)
+    vs.compact()
+    assert ann.index_kind(vs._index) == "ivf"
+    hits = vs.search(x[700:701].copy(), 5, ["legal"], nprobe=64)
+    assert len(hits) == 5 and all(h["title"] == "L" for h in hits)
+    assert hits[0]["_idx"] == 700
+    # the trained index is what gets snapshotted and reloaded
+    assert ann.index_kind(VectorStore(str(tmp_path), index_type="ivf")._index) == "ivf"
+
+def test_benchmark_reports_recall():
+    x = _vectors(3000)
+    rows = ann.benchmark(x, x[:20], k=5, kinds=["hnsw"], efs=[64])
+    assert rows[0]["index"] == "flat" and rows[0]["recall"] == 1.0
+    assert rows[1]["recall"] > 0.8
+
+def test_sq8_store_rescores_from_float32_side_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(ann, "ANN_MIN_VECTORS", 500)
+    monkeypatch.setattr(ann, "RESCORE_FACTOR", 4)
+    vs = VectorStore(str(tmp_path), index_type="sq8")
+    x = _vectors(800, dim=32)
+    vs.add(x, [{"text": str(i), "title": "t", "roles": ["all"]} for i in range(800)])
+    vs.delete(range(0, 100))
+    vs.compact()
+    assert ann.index_kind(vs._index) == "sq8" and vs._index.ntotal == 700
+    vs.add(x[:1] * -1, [{"text": "new", "title": "t", "roles": ["all"]}])
+    exact_scores = x[100:] @ x[150]
+    for store in (vs, VectorStore(str(tmp_path), index_type="sq8")):
+        hits = store.search(x[150:151].copy(), 5, ["all"])
+        assert hits[0]["_idx"] == 150
+        # re-scored hits carry exact cosine scores
+        assert np.allclose([h["score"] for h in hits], np.sort(exact_scores)[::-1][:5], atol=1e-5)
+        assert store.search(-x[:1], 1, ["all"])[0]["text"] == "new"
+    assert vs._exact.get([99]) is None and len(vs._exact) == 701
+
+def test_benchmark_reports_quantized_size_and_rescore():
+    x = _vectors(3000, dim=64)
+    rows = ann.benchmark(x, x[:20], k=5, kinds=["sq8", "fp16"], rescore_factor=4)
+    flat, sq8, sq8_rescored, fp16 = rows[:4]
+    assert sq8["mb"] < flat["mb"] / 3 and fp16["mb"] < flat["mb"] / 1.9
+    assert sq8_rescored["param"] == "rescore x4" and sq8_rescored["recall"] >= sq8["recall"]
+    assert sq8_rescored["recall"] == 1.0
+
+def test_migrate_keeps_ids_and_writes_side_file(tmp_path, monkeypatch):
+    import sys
+    vs = VectorStore(str(tmp_path))
+    x = _vectors(300)
+    vs.add(x, [{"text": str(i), "title": "t", "roles": ["all"]} for i in range(300)])
+    vs.delete(range(0, 300, 3))
+    vs.compact()
+    monkeypatch.setattr(sys, "argv", ["ann", "migrate", "--index-dir", str(tmp_path), "--type", "sq8"])
+    ann._main()
+    migrated = VectorStore(str(tmp_path), index_type="sq8")
+    assert ann.index_kind(migrated._index) == "sq8"
+    assert migrated.search(x[4:5].copy(), 1, ["all"])[0]["_idx"] == 4
+    assert np.allclose(migrated._exact.get([4, 299]), x[[4, 299]])
@@ -0,0 +1,56 @@
+import threading
+import time
+import numpy as np
+import pytest
+from app.batching import MicroBatcher
+
+def test_lone_caller_is_not_delayed():
+    b = MicroBatcher(lambda xs: np.asarray(xs) * 2, max_batch=8, max_wait_ms=500)
+    t0 = time.perf_counter()
+    assert list(b.submit([1, 2])) == [2, 4]
+    assert time.perf_counter() - t0 < 0.25
+
+def test_concurrent_calls_share_batches_and_get_their_slice():
+    sizes = []
+    def fn(xs):
+        sizes.append(len(xs))
+        time.sleep(0.01)  # a forward pass
+        return np.asarray(xs) * 10
+    b = MicroBatcher(fn, max_batch=64, max_wait_ms=20)
+    results = {}
+    def call(i):
+        results[i] = list(b.submit([i, i + 100]))
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(results[i] == [i * 10, (i + 100) * 10] for i in range(16))
+    assert sum(sizes) == 32 and len(sizes) < 16
+    assert b.stats()["items"] == 32
+
+def test_max_batch_size_caps_batches():
+    sizes = []
+    gate = threading.Event()
+    def fn(xs):
+        gate.wait(1)
+        sizes.append(len(xs))
+        return list(xs)
+    b = MicroBatcher(fn, max_batch=4, max_wait_ms=50)
+    threads = [threading.Thread(target=b.submit, args=([i],)) for i in range(12)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert sum(sizes) == 12 and max(sizes) <= 4
+
+def test_errors_reach_every_caller():
+    def fn(xs):
+        raise RuntimeError("model down")
+    b = MicroBatcher(fn, max_batch=8, max_wait_ms=1)
+    with pytest.raises(RuntimeError):
+        b.submit(["q"])
+    b.fn = lambda xs: xs
+    assert b.submit(["q"]) == ["q"]  # worker survives a failed batch
@@ -0,0 +1,80 @@
+import numpy as np
+from rank_bm25 import BM25Okapi
+from app.hybrid.bm25 import BM25Index, top_k
+
+DOCS = [
+    "sales policy for enterprise customers",
+    "engineering handbook and on-call policy",
+    "vpn reset guide for engineering laptops",
+    "company holiday calendar",
+    "sales commission plan and sales targets",
+]
+
+def test_scores_match_rank_bm25():
+    ref = BM25Okapi([d.split() for d in DOCS])
+    idx = BM25Index(DOCS)
+    for q in ["sales policy", "engineering vpn", "holiday", "unknown words"]:
+        np.testing.assert_allclose(idx.get_scores(q), ref.get_scores(q.split()), rtol=1e-6)
+
+def test_incremental_add_equals_full_build():
+    full = BM25Index(DOCS)
+    inc = BM25Index(DOCS[:2], max_segments=2)
+    for d in DOCS[2:]:
+        inc.add([d])
+    assert len(inc) == len(full)
+    np.testing.assert_allclose(inc.get_scores("sales engineering policy"), full.get_scores("sales engineering policy"))
+
+def test_search_topk_and_mask():
+    idx = BM25Index(DOCS)
+    hits = idx.search("sales policy", 2)
+    assert [i for i, _ in hits] == [4, 0] or [i for i, _ in hits] == [0, 4]
+    assert hits[0][1] >= hits[1][1]
+    mask = np.array([False, True, True, True, True])
+    assert 0 not in [i for i, _ in idx.search("sales policy", 5, mask=mask)]
+    assert idx.search("nothing matches", 3) == []
+
+def test_top_k_orders_best_first():
+    s = np.array([0.1, 3.0, 2.0, 5.0])
+    assert list(top_k(s, 2)) == [3, 1]
+    assert list(top_k(s, 10)) == [3, 1, 2, 0]
+
+def test_save_and_load_memory_mapped(tmp_path):
+    path = str(tmp_path / "bm25.bin")
+    idx = BM25Index(DOCS[:3], max_segments=1)
+    idx.add(DOCS[3:])
+    idx.save(path, {"ids": np.arange(len(DOCS)) * 10})
+    loaded, extra = BM25Index.load(path)
+    assert extra["ids"].tolist() == [0, 10, 20, 30, 40]
+    for q in ["sales policy", "engineering vpn", "unknown"]:
+        np.testing.assert_allclose(loaded.get_scores(q), idx.get_scores(q))
+    # documents added after loading, with new and known terms
+    for i in (idx, loaded):
+        i.add(["sales kickoff agenda", "kickoff"])
+    np.testing.assert_allclose(loaded.get_scores("kickoff sales"), idx.get_scores("kickoff sales"))
+    assert loaded._segments[0].data.base is not None  # still a view of the file
+
+def test_search_during_concurrent_adds():
+    import threading
+    idx = BM25Index(DOCS, max_segments=4)
+    errors, stop = [], threading.Event()
+
+    def search():
+        while not stop.is_set():
+            try:
+                mask = np.ones(len(idx), dtype=bool)
+                for i, _ in idx.search("policy sales engineering term7", 5, mask=mask):
+                    assert i < mask.size
+            except Exception as e:  # pragma: no cover - the failure being tested
+                errors.append(e)
+                return
+
+    readers = [threading.Thread(target=search) for _ in range(3)]
+    for t in readers:
+        t.start()
+    for i in range(1500):
+        idx.add([f"policy term{i} sales new{i}", f"engineering term{i % 50}"])
+    stop.set()
+    for t in readers:
+        t.join()
+    assert not errors, errors[:3]
+    assert len(idx) == len(DOCS) + 3000
@@ -0,0 +1,54 @@
+import numpy as np
+from app.cache import LRUCache
+
+def test_lru_evicts_by_bytes():
+    c = LRUCache(max_bytes=3 * 40)
+    for i in range(3):
+        c.put(i, np.zeros(10, dtype="float32"))  # 40 bytes each
+    assert c.get(0) is not None  # 0 becomes most recent
+    c.put(3, np.zeros(10, dtype="float32"))
+    assert c.get(1) is None
+    assert c.get(0) is not None and c.get(3) is not None
+    s = c.stats()
+    assert s["evictions"] == 1 and s["bytes"] == 120
+    assert s["hits"] == 3 and s["misses"] == 1
+
+def test_ttl_expiry(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("app.cache.time.monotonic", lambda: now[0])
+    c = LRUCache(max_bytes=1000, ttl=10)
+    c.put("q", np.ones(2))
+    now[0] += 5
+    assert c.get("q") is not None
+    now[0] += 20
+    assert c.get("q") is None and len(c) == 0
+
+def test_oversized_value_not_cached():
+    c = LRUCache(max_bytes=8)
+    c.put("big", np.zeros(100))
+    assert c.get("big") is None
+
+def _unit(v):
+    v = np.asarray(v, dtype="float32")
+    return v / np.linalg.norm(v)
+
+def test_semantic_cache_similarity_scope_and_generation():
+    from app.cache import SemanticCache
+    c = SemanticCache(max_entries=10, threshold=0.9)
+    c.put("reset vpn?", _unit([1, 0, 0]), "5|sales", 1, {"answer": "A"})
+    assert c.get(_unit([1, 0.1, 0]), "5|sales", 1) == {"answer": "A"}
+    assert c.get(_unit([0, 1, 0]), "5|sales", 1) is None      # not similar enough
+    assert c.get(_unit([1, 0, 0]), "5|engineering", 1) is None  # other role set
+    assert c.get(_unit([1, 0, 0]), "5|sales", 2) is None        # index changed
+    assert c.stats()["hits"] == 1 and c.stats()["entries"] == 0
+
+def test_semantic_cache_eviction_and_disk_backing(tmp_path):
+    from app.cache import SemanticCache
+    db = str(tmp_path / "answers.db")
+    c = SemanticCache(max_entries=2, threshold=0.99, path=db)
+    for i, v in enumerate(([1, 0, 0], [0, 1, 0], [0, 0, 1])):
+        c.put(f"q{i}", _unit(v), "s", 7, {"answer": i})
+    assert c.get(_unit([1, 0, 0]), "s", 7) is None  # evicted
+    reloaded = SemanticCache(max_entries=2, threshold=0.99, path=db)
+    assert reloaded.get(_unit([0, 0, 1]), "s", 7) == {"answer": 2}
+    assert reloaded.get(_unit([0, 1, 0]), "s", 8) is None
@@ -0,0 +1,37 @@
+from app.context import count_tokens, overlap, pack, render
+from app.utils import chunk_text
+
+DOC = " ".join(f"Sentence {i} of the travel policy explains reimbursement rules." for i in range(40))
+
+def _hits(chunks, path="/docs/travel.md"):
+    return [{"text": t, "title": "travel.md", "path": path, "_idx": i, "score": 1.0 / (i + 1)}
+            for i, t in enumerate(chunks)]
+
+def test_overlap_between_adjacent_chunks_is_detected():
+    a, b = chunk_text(DOC)[:2]
+    n = overlap(a, b)
+    assert n > 0 and a.endswith(b[:n])
+    assert overlap(a, "completely unrelated text that shares nothing") == 0
+
+def test_render_prints_overlap_once_and_groups_documents():
+    chunks = chunk_text(DOC)[:3]
+    hits = _hits(chunks)
+    # ranked out of document order, with another document in between
+    other = {"text": "Expenses need receipts.", "title": "exp.md", "path": "/docs/exp.md", "_idx": 99}
+    text = render([hits[2], other, hits[0], hits[1]])
+    assert text.count("[travel.md]") == 1
+    assert text.startswith("[travel.md]") and text.endswith("[exp.md] Expenses need receipts.")
+    assert text.count("Sentence 10 of") == 1
+    assert count_tokens(text) < count_tokens("\n\n".join(chunks))
+
+def test_pack_respects_budget_and_keeps_rank_order():
+    hits = _hits(chunk_text(DOC), path=None)
+    context, used, tokens = pack(hits, max_tokens=300)
+    assert tokens == count_tokens(context) <= 300
+    assert 0 < len(used) < len(hits)
+    assert used == hits[:len(used)]
+
+def test_pack_truncates_oversized_top_hit():
+    hits = _hits(["word " * 5000])
+    context, used, tokens = pack(hits, max_tokens=100)
+    assert len(used) == 1 and 0 < tokens <= 100
@@ -0,0 +1,112 @@
+import uuid
+from app.dedup import Deduper, simhash, hamming
+
+TEXT = ("Employees may carry over up to five days of unused vacation into the next "
+        "calendar year provided their manager approves the request before December")
+
+def test_simhash_is_close_for_near_duplicates():
+    near = TEXT.replace("five days", "five (5) days")
+    other = "The quarterly sales kickoff takes place in Lisbon with all regional teams attending"
+    assert simhash(TEXT) == simhash(TEXT)
+    assert hamming(simhash(TEXT), simhash(near)) < hamming(simhash(TEXT), simhash(other))
+    assert hamming(simhash(TEXT), simhash(other)) > 3
+
+def test_find_within_distance_and_persist(tmp_path):
+    path = str(tmp_path / "dedup.sqlite")
+    d = Deduper(path)
+    fp = simhash(TEXT)
+    d.add(7, fp)
+    d.set_member(7, "/docs/a.md", "a.md", ["sales"])
+    d.count(checked=2, duplicates=1, bytes_saved=100)
+    d.commit()
+    # flip two bits: still found; far fingerprints are not
+    assert d.find(fp ^ 0b101) == 7
+    assert d.find(fp ^ 0xF0F0F0F0F0F0F0F0) is None
+    d2 = Deduper(path)
+    assert d2.find(fp) == 7
+    assert d2.members(7) == [("/docs/a.md", "a.md", ["sales"])]
+    assert d2.stats()["embeddings_saved"] == 1 and d2.stats()["bytes_saved"] == 100
+
+def test_find_drops_candidates_failing_verification(tmp_path):
+    d = Deduper(str(tmp_path / "dedup.sqlite"))
+    fp = simhash(TEXT)
+    d.add(1, fp)
+    assert d.find(fp, verify=lambda cid: False) is None
+    assert d.stats()["fingerprints"] == 0
+
+def test_find_skips_candidates_not_accepted(tmp_path):
+    d = Deduper(str(tmp_path / "dedup.sqlite"))
+    fp = simhash(TEXT)
+    d.add(1, fp)
+    d.add(2, fp ^ 1)
+    assert d.find(fp, accept=lambda cid: cid == 2) == 2
+    assert d.find(fp, accept=lambda cid: False) is None
+    assert d.stats()["fingerprints"] == 2
+
+def test_relink_moves_fingerprint_and_members(tmp_path):
+    d = Deduper(str(tmp_path / "dedup.sqlite"))
+    fp = simhash(TEXT)
+    d.add(1, fp)
+    d.set_member(1, "/a", "a", ["all"])
+    d.relink(1, 9)
+    assert d.find(fp) == 9 and d.chunks_of("/a") == [9]
+
+def test_duplicate_chunk_is_linked_not_embedded(monkeypatch):
+    from app import rag
+    body = f"{uuid.uuid4().hex} {TEXT}"
+    a, b = f"/tmp/dedup-{uuid.uuid4().hex}-a.md", f"/tmp/dedup-{uuid.uuid4().hex}-b.md"
+    embedded = []
+    real = rag.embed_chunks
+    monkeypatch.setattr(rag, "embed_chunks", lambda texts: embedded.extend(texts) or real(texts))
+
+    rag.add_chunks([{"text": body, "title": "a.md", "path": a, "roles": ["sales"]}])
+    before = rag.deduper.stats()["embeddings_saved"]
+    rag.add_chunks([{"text": body + " ", "title": "b.md", "path": b, "roles": ["sales"]}])
+    assert embedded == [body]
+    assert rag.deduper.stats()["embeddings_saved"] == before + 1
+
+    # one chunk shared by both documents
+    (cid,) = rag._store.ids_for_path(a)
+    assert {p for p, _, _ in rag.deduper.members(cid)} == {a, b}
+
+    # deleting the first document keeps the chunk for the second
+    assert rag.delete_document(a) == 1
+    (cid,) = rag._store.ids_for_path(b)
+    assert rag._store.get_meta(cid)["title"] == "b.md"
+    assert rag.delete_document(b) == 1
+    assert rag._store.ids_for_path(b) == []
+
+def test_duplicate_across_roles_keeps_separate_chunks():
+    from app import rag
+    body = f"{uuid.uuid4().hex} {TEXT}"
+    hr, eng = f"/tmp/dedup-{uuid.uuid4().hex}-layoffs.md", f"/tmp/dedup-{uuid.uuid4().hex}-handbook.md"
+    rag.add_chunks([{"text": body, "title": "layoffs.md", "path": hr, "roles": ["hr"]}])
+    rag.add_chunks([{"text": body, "title": "handbook.md", "path": eng, "roles": ["engineering"]},
+                    {"text": body + " ", "title": "handbook.md", "path": eng, "roles": ["engineering"]}])
+
+    (h,) = rag._store.ids_for_path(hr)
+    (e,) = rag._store.ids_for_path(eng)
+    assert h != e
+    assert rag._store.get_meta(h)["roles"] == ["hr"] and rag.deduper.members(h)[0][0] == hr
+    assert rag._store.get_meta(e)["roles"] == ["engineering"] and [m[0] for m in rag.deduper.members(e)] == [eng]
+    # an engineering reader never sees the restricted document's name
+    hits = rag._retrieve(rag._prepare(body, ["engineering"], 5))
+    assert hits and all(hit["path"] != hr and hit["title"] != "layoffs.md" for hit in hits)
+    rag.delete_document(hr)
+    rag.delete_document(eng)
+
+def test_reingesting_unchanged_document_embeds_nothing(monkeypatch):
+    from app import rag
+    path = f"/tmp/dedup-{uuid.uuid4().hex}.md"
+    chunks = [{"text": f"{uuid.uuid4().hex} {TEXT}", "title": "d.md", "path": path, "roles": ["all"]},
+              {"text": f"{uuid.uuid4().hex} {TEXT}", "title": "d.md", "path": path, "roles": ["all"]}]
+    rag.add_chunks(chunks)
+    first = sorted(rag._store.ids_for_path(path))
+    embedded = []
+    real = rag.embed_chunks
+    monkeypatch.setattr(rag, "embed_chunks", lambda texts: embedded.extend(texts) or real(texts))
+    rag.add_chunks(chunks[:1])
+    assert embedded == []
+    # the chunk dropped from the document is deleted, the unchanged one kept
+    assert rag._store.ids_for_path(path) == first[:1]
+    rag.delete_document(path)
@@ -0,0 +1,47 @@
+import numpy as np
+from app.embcache import EmbeddingCache
+
+def _encoder(calls):
+    def encode(texts):
+        calls.extend(texts)
+        return np.array([[len(t), 1.0, 0.5] for t in texts], dtype="float32")
+    return encode
+
+def test_encode_only_embeds_misses(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model-a")
+    calls = []
+    first = cache.encode(["alpha", "beta"], _encoder(calls))
+    assert calls == ["alpha", "beta"]
+    calls.clear()
+    again = cache.encode(["beta", "gamma", "alpha"], _encoder(calls))
+    assert calls == ["gamma"]
+    assert np.array_equal(again[0], first[1]) and np.array_equal(again[2], first[0])
+    assert cache.stats()["entries"] == 3 and cache.stats()["hits"] == 2
+
+def test_persists_and_is_keyed_by_model(tmp_path):
+    EmbeddingCache(str(tmp_path), "model-a").encode(["alpha"], _encoder([]))
+    calls = []
+    EmbeddingCache(str(tmp_path), "model-a").encode(["alpha"], _encoder(calls))
+    assert calls == []
+    EmbeddingCache(str(tmp_path), "model-b").encode(["alpha"], _encoder(calls))
+    assert calls == ["alpha"]
+
+def test_sees_records_appended_by_another_writer(tmp_path):
+    reader = EmbeddingCache(str(tmp_path), "m")
+    reader.encode(["one"], _encoder([]))
+    EmbeddingCache(str(tmp_path), "m").encode(["two"], _encoder([]))
+    vecs, hit = reader.get_many(["one", "two", "three"])
+    assert hit.tolist() == [True, True, False]
+    assert vecs[1, 0] == 3
+
+def test_torn_tail_is_dropped(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "m")
+    cache.encode(["one", "two"], _encoder([]))
+    with open(cache.path, "ab") as f:
+        f.write(b"\x01" * 7)  # a writer died mid-record
+    cache = EmbeddingCache(str(tmp_path), "m")
+    calls = []
+    out = cache.encode(["three", "one"], _encoder(calls))
+    assert calls == ["three"] and out[0, 0] == 5
+    vecs, hit = EmbeddingCache(str(tmp_path), "m").get_many(["one", "two", "three"])
+    assert hit.all() and vecs[2, 0] == 5
@@ -0,0 +1,39 @@
+import numpy as np
+from app import embeddings
+
+def test_embed_query_caches_normalized_question(monkeypatch):
+    calls = []
+    def fake_embed(texts):
+        calls.append(texts)
+        return np.ones((len(texts), 4), dtype="float32")
+    monkeypatch.setattr(embeddings, "embed_texts", fake_embed)
+    embeddings.query_cache.clear()
+
+    v1 = embeddings.embed_query("how do I  reset VPN")
+    v1[0, 0] = 42.0  # caller mutation must not leak into the cache
+    v2 = embeddings.embed_query(" how do I reset VPN ")
+    assert calls == [["how do I reset VPN"]]
+    assert v2.shape == (1, 4) and v2[0, 0] == 1.0
+
+def test_embed_query_keys_by_model(monkeypatch):
+    monkeypatch.setattr(embeddings, "embed_texts", lambda t: np.ones((1, 4), dtype="float32"))
+    embeddings.query_cache.clear()
+    before = embeddings.query_cache.misses
+    embeddings.embed_query("q")
+    monkeypatch.setattr(embeddings, "EMB_MODEL", "other-model")
+    embeddings.embed_query("q")
+    assert embeddings.query_cache.misses - before == 2
+
+def test_embed_chunks_bypasses_the_query_batcher(monkeypatch):
+    import threading
+    threads = []
+    def fake_encode(texts):
+        threads.append(threading.get_ident())
+        return np.ones((len(texts), 4), dtype="float32")
+    def no_batcher(texts):
+        raise AssertionError("chunks joined a query batch")
+    monkeypatch.setattr(embeddings, "_encode", fake_encode)
+    monkeypatch.setattr(embeddings.encode_batcher, "submit", no_batcher)
+    monkeypatch.setattr(embeddings, "embedding_cache", None)
+    assert embeddings.embed_chunks(["a chunk", "another"]).shape == (2, 4)
+    assert threads == [threading.get_ident()]
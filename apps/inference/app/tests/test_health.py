@@ -1,3 +1,4 @@
+import time
 from fastapi.testclient import TestClient
 from app.main import app
 
@@ -6,3 +7,15 @@ def test_health_ok():
     r = c.get("/health")
     assert r.status_code == 200
     assert r.json().get("ok") is True
+
+def test_ready_reports_components_once_loaded(monkeypatch):
+    from app import llm
+    monkeypatch.setattr(llm.llm_client, "_load", lambda: object())  # no OpenAI in tests
+    with TestClient(app) as c:  # runs the lifespan, which starts loading
+        deadline = time.time() + 60
+        while (r := c.get("/ready")).status_code == 503 and time.time() < deadline:
+            time.sleep(0.1)
+    assert r.status_code == 200 and r.json()["ready"] is True
+    components = r.json()["components"]
+    assert components["index"]["state"] == "ready" and components["index"]["seconds"] is not None
+    assert {"embedding_model", "rerank_model", "llm"} <= set(components)
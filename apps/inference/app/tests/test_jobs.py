@@ -0,0 +1,64 @@
+import time
+from app.jobs import IngestQueue
+
+def _wait(q, job_id, timeout=5):
+    end = time.time() + timeout
+    while time.time() < end:
+        job = q.get(job_id)
+        if job["finished"]:
+            return job
+        time.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+def _batches(name, path, roles):
+    with open(path) as f:
+        yield [{"text": f.read(), "title": name, "path": path, "roles": roles}]
+
+def _files(tmp_path, n):
+    out = []
+    for i in range(n):
+        p = tmp_path / f"doc{i}.txt"
+        p.write_text(f"document number {i} " * 20)
+        out.append({"name": p.name, "path": str(p)})
+    return out
+
+def test_files_are_committed_in_batches(tmp_path):
+    commits = []
+    q = IngestQueue(_batches, commits.append, workers=3,
+                    commit_chunks=10_000, commit_wait=2)
+    job = q.submit(_files(tmp_path, 8), ["sales"])
+    status = _wait(q, job.id)
+    assert status["status"] == "done" and status["progress"]["processed"] == 8
+    assert all(f["status"] == "done" and f["chunks"] == 1 for f in status["files"])
+    # commits happen per batch of files, not per file
+    assert sum(len(c) for c in commits) == 8 and len(commits) < 8
+    assert commits[0][0]["roles"] == ["sales"]
+
+def test_failures_are_reported_per_file(tmp_path):
+    def batches(name, path, roles):
+        if name == "doc1.txt":
+            raise ValueError("corrupt")
+        return _batches(name, path, roles)
+    q = IngestQueue(batches, lambda chunks: None, workers=2, commit_wait=0.05)
+    files = _files(tmp_path, 3) + [{"name": "x.exe", "status": "failed", "error": "Invalid file type"}]
+    status = _wait(q, q.submit(files, ["all"]).id)
+    by_name = {f["name"]: f for f in status["files"]}
+    assert by_name["doc1.txt"]["status"] == "failed" and "corrupt" in by_name["doc1.txt"]["error"]
+    assert by_name["doc0.txt"]["status"] == "done" and by_name["x.exe"]["status"] == "failed"
+    assert status["status"] == "done"
+
+def test_unknown_job():
+    assert IngestQueue(_batches, lambda c: None).get("missing") is None
+
+def test_large_file_is_streamed_to_add_document(tmp_path):
+    commits, documents = [], []
+    def batches(name, path, roles):
+        for b in range(3):
+            yield [{"text": f"{name} {b} {i}", "path": path, "roles": roles} for i in range(4)]
+    def add_document(path, batches):
+        documents.append((path, [len(b) for b in batches]))
+        return 12
+    q = IngestQueue(batches, commits.append, add_document, workers=1, commit_chunks=4, commit_wait=0.05)
+    status = _wait(q, q.submit(_files(tmp_path, 1), ["all"]).id)
+    assert status["files"][0]["status"] == "done" and status["files"][0]["chunks"] == 12
+    assert documents == [(str(tmp_path / "doc0.txt"), [4, 4, 4])] and commits == []
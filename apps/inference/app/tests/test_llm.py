@@ -152,3 +152,85 @@ class TestLLMGeneration:
         
         # Should handle unicode without issues
         mock_client.chat.completions.create.assert_called_once()
+
+class TestAsyncLLMGeneration:
+    @patch('app.llm.get_async_client')
+    def test_async_generation(self, mock_get_client):
+        import asyncio
+        from unittest.mock import AsyncMock
+        from app.llm import agenerate
+        mock_response = MagicMock()
+        mock_response.choices = [MagicMock()]
+        mock_response.choices[0].message.content = "Async answer"
+        mock_get_client.return_value.chat.completions.create = AsyncMock(return_value=mock_response)
+
+        result = asyncio.run(agenerate("What is AI?", "Context about AI"))
+
+        assert result == "Async answer"
+        call_args = mock_get_client.return_value.chat.completions.create.call_args
+        assert call_args[1]["model"] == "gpt-4o-mini"
+        assert call_args[1]["messages"][1]["role"] == "user"
+
+    @patch('app.llm.get_async_client')
+    def test_async_error_returns_fallback(self, mock_get_client):
+        import asyncio
+        from unittest.mock import AsyncMock
+        from app.llm import agenerate
+        mock_get_client.return_value.chat.completions.create = AsyncMock(side_effect=Exception("API Error"))
+
+        result = asyncio.run(agenerate("What is AI?", "Context"))
+
+        assert "I encountered an error while generating an answer" in result
+
+    @patch('app.llm.get_async_client')
+    def test_astream_yields_deltas_and_closes(self, mock_get_client):
+        import asyncio
+        from unittest.mock import AsyncMock
+        from app.llm import astream
+
+        def chunk(text):
+            c = MagicMock()
+            c.choices = [MagicMock()]
+            c.choices[0].delta.content = text
+            return c
+
+        class FakeStream:
+            def __init__(self):
+                self.closed = False
+            def __aiter__(self):
+                async def gen():
+                    for t in ("Hel", "lo", None):
+                        yield chunk(t)
+                return gen()
+            async def close(self):
+                self.closed = True
+
+        fake = FakeStream()
+        mock_get_client.return_value.chat.completions.create = AsyncMock(return_value=fake)
+
+        async def collect():
+            return [t async for t in astream("What is AI?", "Context")]
+
+        assert asyncio.run(collect()) == ["Hel", "lo"]
+        assert fake.closed
+        assert mock_get_client.return_value.chat.completions.create.call_args[1]["stream"] is True
+
+    def test_async_client_per_loop_is_closed_on_shutdown(self, monkeypatch):
+        import asyncio
+        from app import llm
+        monkeypatch.setattr(llm, "OPENAI_API_KEY", "test")
+
+        async def use():
+            c = llm.get_async_client()
+            assert llm.get_async_client() is c
+            return c
+
+        async def use_and_close():
+            c = await use()
+            await llm.close_async_client()
+            return c
+
+        first = asyncio.run(use_and_close())
+        second = asyncio.run(use_and_close())
+        assert first is not second and first.is_closed() and second.is_closed()
+        assert len(llm._async_clients) == 0
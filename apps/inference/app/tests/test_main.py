@@ -1,7 +1,9 @@
 import pytest
 import tempfile
+import io
 import os
-from unittest.mock import patch, MagicMock
+import time
+from unittest.mock import patch, MagicMock, AsyncMock
 from fastapi.testclient import TestClient
 from app.main import app, extract_text
 
@@ -16,7 +18,7 @@ class TestHealthEndpoint:
         assert "timestamp" in data
 
 class TestRAGQuery:
-    @patch('app.main.answer')
+    @patch('app.main.aanswer', new_callable=AsyncMock)
     def test_successful_query(self, mock_answer):
         mock_answer.return_value = {
             "answer": "Test answer",
@@ -35,7 +37,7 @@ class TestRAGQuery:
         assert len(data["sources"]) == 1
         mock_answer.assert_called_once_with("What is AI?", ["sales"], 5)
 
-    @patch('app.main.answer')
+    @patch('app.main.aanswer', new_callable=AsyncMock)
     def test_query_with_default_params(self, mock_answer):
         mock_answer.return_value = {
             "answer": "Test answer",
@@ -49,7 +51,7 @@ class TestRAGQuery:
         assert response.status_code == 200
         mock_answer.assert_called_once_with("What is AI?", ["all"], None)
 
-    @patch('app.main.answer')
+    @patch('app.main.aanswer', new_callable=AsyncMock)
     def test_query_failure(self, mock_answer):
         mock_answer.side_effect = Exception("RAG service error")
         
@@ -62,11 +64,16 @@ class TestRAGQuery:
         data = response.json()
         assert "RAG query failed" in data["detail"]
 
+def _consume(path, batches):
+    """Stand-in for ``add_document`` that drains the streamed chunk batches."""
+    _consume.batches = [list(b) for b in batches]
+    return sum(len(b) for b in _consume.batches)
+
 class TestDocumentIngestion:
-    @patch('app.main.add_chunks')
-    @patch('app.main.chunk_text')
-    def test_successful_upload_pdf(self, mock_chunk_text, mock_add_chunks):
-        mock_chunk_text.return_value = ["chunk1", "chunk2", "chunk3"]
+    @patch('app.main.add_document', side_effect=_consume)
+    @patch('app.main.chunk_sections')
+    def test_successful_upload_pdf(self, mock_chunk_sections, mock_add_document):
+        mock_chunk_sections.return_value = [(1, "chunk1"), (1, "chunk2"), (2, "chunk3")]
         
         with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
             tmp.write(b"PDF content")
@@ -84,16 +91,17 @@ class TestDocumentIngestion:
         assert data["chunks"] == 3
         assert "duration" in data
         
-        mock_chunk_text.assert_called_once()
-        mock_add_chunks.assert_called_once()
+        mock_chunk_sections.assert_called_once()
+        mock_add_document.assert_called_once()
+        assert [c["page"] for c in _consume.batches[0]] == [1, 1, 2]
         
         # Clean up
         os.unlink(tmp.name)
 
-    @patch('app.main.add_chunks')
-    @patch('app.main.chunk_text')
-    def test_successful_upload_docx(self, mock_chunk_text, mock_add_chunks):
-        mock_chunk_text.return_value = ["chunk1", "chunk2"]
+    @patch('app.main.add_document', side_effect=_consume)
+    @patch('app.main.chunk_sections')
+    def test_successful_upload_docx(self, mock_chunk_sections, mock_add_document):
+        mock_chunk_sections.return_value = [(1, "chunk1"), (1, "chunk2")]
         
         with tempfile.NamedTemporaryFile(suffix=".docx", delete=False) as tmp:
             tmp.write(b"DOCX content")
@@ -113,10 +121,10 @@ class TestDocumentIngestion:
         # Clean up
         os.unlink(tmp.name)
 
-    @patch('app.main.add_chunks')
-    @patch('app.main.chunk_text')
-    def test_successful_upload_markdown(self, mock_chunk_text, mock_add_chunks):
-        mock_chunk_text.return_value = ["chunk1"]
+    @patch('app.main.add_document', side_effect=_consume)
+    @patch('app.main.chunk_sections')
+    def test_successful_upload_markdown(self, mock_chunk_sections, mock_add_document):
+        mock_chunk_sections.return_value = [(None, "chunk1")]
         
         with tempfile.NamedTemporaryFile(suffix=".md", delete=False) as tmp:
             tmp.write(b"# Markdown content")
@@ -136,6 +144,31 @@ class TestDocumentIngestion:
         # Clean up
         os.unlink(tmp.name)
 
+    def test_upload_is_streamed_to_docs_dir(self, tmp_path):
+        with patch('app.main.DOCS_DIR', str(tmp_path)), \
+             patch('app.main.UPLOAD_BLOCK_BYTES', 1024), \
+             patch('app.main.add_document', side_effect=_consume):
+            content = b"alpha beta gamma\n" * 2000
+            response = client.post("/rag/ingest",
+                files={"file": ("notes.txt", content, "text/plain")},
+                data={"roles": "sales"})
+        assert response.status_code == 200
+        assert (tmp_path / "notes.txt").read_bytes() == content
+        assert not (tmp_path / "notes.txt.part").exists()
+        chunks = [c for b in _consume.batches for c in b]
+        assert response.json()["chunks"] == len(chunks) > 1
+        assert chunks[0]["roles"] == ["sales"] and chunks[0]["page"] is None
+
+    def test_upload_name_cannot_leave_docs_dir(self, tmp_path):
+        docs = tmp_path / "docs"
+        with patch('app.main.DOCS_DIR', str(docs)), patch('app.main.add_document', side_effect=_consume):
+            response = client.post("/rag/ingest",
+                files={"file": ("../../escape.txt", b"alpha beta", "text/plain")},
+                data={"roles": "all"})
+        assert response.status_code == 200
+        assert (docs / "escape.txt").exists() and not (tmp_path / "escape.txt").exists()
+        assert _consume.batches[0][0]["title"] == "escape.txt"
+
     def test_file_too_large(self):
         large_content = b"x" * (11 * 1024 * 1024)  # 11MB
         
@@ -158,9 +191,17 @@ class TestDocumentIngestion:
         data = response.json()
         assert "Invalid file type" in data["detail"]
 
-    @patch('app.main.extract_text')
-    def test_no_text_content(self, mock_extract_text):
-        mock_extract_text.return_value = ""
+    def test_read_only_replica_rejects_writes(self):
+        with patch('app.main.READ_ONLY', True):
+            upload = client.post("/rag/ingest", files={"file": ("a.txt", b"text", "text/plain")})
+            jobs = client.post("/rag/ingest/jobs", files=[("files", ("a.txt", b"text", "text/plain"))])
+            delete = client.delete("/rag/documents/a.txt")
+        assert upload.status_code == jobs.status_code == delete.status_code == 409
+        assert "read-only" in upload.json()["detail"]
+
+    @patch('app.main.iter_sections')
+    def test_no_text_content(self, mock_iter_sections):
+        mock_iter_sections.return_value = iter([(1, "")])
         
         response = client.post("/rag/ingest", 
             files={"file": ("empty.pdf", b"PDF content", "application/pdf")},
@@ -184,9 +225,9 @@ class TestDocumentIngestion:
         data = response.json()
         assert "No valid chunks extracted" in data["detail"]
 
-    @patch('app.main.add_chunks')
-    def test_ingestion_failure(self, mock_add_chunks):
-        mock_add_chunks.side_effect = Exception("Indexing failed")
+    @patch('app.main.add_document')
+    def test_ingestion_failure(self, mock_add_document):
+        mock_add_document.side_effect = Exception("Indexing failed")
         
         response = client.post("/rag/ingest", 
             files={"file": ("test.pdf", b"PDF content", "application/pdf")},
@@ -230,6 +271,27 @@ class TestTextExtraction:
         result = extract_text("test.txt", b"Plain text content")
         assert result == "Plain text content"
 
+    def test_plain_text_is_read_in_blocks(self):
+        from app.main import iter_sections
+        content = "".join(f"line {i} of a long manual\n" for i in range(200)).encode()
+        with patch('app.main.UPLOAD_BLOCK_BYTES', 64):
+            sections = list(iter_sections("big.txt", io.BytesIO(content)))
+        assert len(sections) > 10 and all(len(t) < 200 for _, t in sections)
+        assert "\n".join(t for _, t in sections) == content.decode().rstrip("\n")
+
+    def test_docx_paragraphs_carry_page_numbers(self, tmp_path):
+        from docx import Document
+        from docx.enum.text import WD_BREAK
+        from app.main import iter_sections
+        doc = Document()
+        doc.add_paragraph("first page")
+        doc.add_paragraph("end of page one").add_run().add_break(WD_BREAK.PAGE)
+        doc.add_paragraph("second page")
+        path = str(tmp_path / "pages.docx")
+        doc.save(path)
+        assert [(p, t) for p, t in iter_sections("pages.docx", path) if t] == [
+            (1, "first page"), (1, "end of page one"), (2, "second page")]
+
     def test_extract_text_failure(self):
         with patch('app.main.PdfReader') as mock_reader:
             mock_reader.side_effect = Exception("PDF parsing failed")
@@ -240,7 +302,7 @@ class TestTextExtraction:
 
 class TestGlobalErrorHandling:
     def test_global_exception_handler(self):
-        with patch('app.main.answer') as mock_answer:
+        with patch('app.main.aanswer', new_callable=AsyncMock) as mock_answer:
             mock_answer.side_effect = Exception("Unexpected error")
             
             response = client.post("/rag/query", json={
@@ -253,7 +315,7 @@ class TestGlobalErrorHandling:
 
     def test_global_exception_handler_debug_mode(self):
         with patch.dict(os.environ, {"DEBUG": "true"}):
-            with patch('app.main.answer') as mock_answer:
+            with patch('app.main.aanswer', new_callable=AsyncMock) as mock_answer:
                 mock_answer.side_effect = Exception("Unexpected error")
                 
                 response = client.post("/rag/query", json={
@@ -263,3 +325,100 @@ class TestGlobalErrorHandling:
                 assert response.status_code == 500
                 data = response.json()
                 assert "detail" in data
+
+class TestCacheStats:
+    def test_cache_stats(self):
+        response = client.get("/rag/cache/stats")
+        assert response.status_code == 200
+        data = response.json()
+        assert "hit_ratio" in data["answers"]
+        assert "hit_ratio" in data["query_embeddings"]
+
+class TestRAGQueryStream:
+    @staticmethod
+    def _events(body):
+        out = []
+        for block in body.strip().split("\n\n"):
+            lines = dict(l.split(": ", 1) for l in block.split("\n"))
+            out.append((lines["event"], lines["data"]))
+        return out
+
+    def test_stream_sends_sources_then_tokens(self):
+        async def fake_stream(question, roles, top_k):
+            yield "sources", [{"title": "Doc"}]
+            yield "token", "Hello"
+            yield "token", " world"
+            yield "done", {"answer": "Hello world"}
+
+        with patch('app.main.astream_answer', fake_stream):
+            response = client.post("/rag/query/stream", json={"question": "What is AI?"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = self._events(response.text)
+        assert [e for e, _ in events] == ["sources", "token", "token", "done"]
+        assert '"Doc"' in events[0][1]
+
+    def test_stream_flag_on_query_endpoint(self):
+        async def fake_stream(question, roles, top_k):
+            yield "done", {"answer": "x"}
+
+        with patch('app.main.astream_answer', fake_stream):
+            response = client.post("/rag/query", json={"question": "What is AI?", "stream": True})
+
+        assert response.headers["content-type"].startswith("text/event-stream")
+
+    def test_stream_error_event(self):
+        async def failing_stream(question, roles, top_k):
+            raise Exception("boom")
+            yield  # pragma: no cover
+
+        with patch('app.main.astream_answer', failing_stream):
+            response = client.post("/rag/query/stream", json={"question": "What is AI?"})
+
+        events = self._events(response.text)
+        assert events[-1][0] == "error" and "boom" in events[-1][1]
+
+class TestDeleteDocument:
+    @patch('app.main.delete_document')
+    def test_delete_relative_path(self, mock_delete):
+        mock_delete.return_value = 4
+        with tempfile.TemporaryDirectory() as docs:
+            with open(os.path.join(docs, "guide.md"), "w") as f:
+                f.write("x")
+            with patch('app.main.DOCS_DIR', docs):
+                response = client.delete("/rag/documents/guide.md")
+            assert response.status_code == 200
+            assert response.json()["chunks"] == 4
+            mock_delete.assert_called_once_with(os.path.join(docs, "guide.md"))
+            assert not os.path.exists(os.path.join(docs, "guide.md"))
+
+    @patch('app.main.delete_document')
+    def test_delete_unknown_document(self, mock_delete):
+        mock_delete.return_value = 0
+        response = client.delete("/rag/documents/nope.md")
+        assert response.status_code == 404
+
+class TestIngestJobs:
+    def test_submit_and_poll(self):
+        with tempfile.TemporaryDirectory() as docs, \
+                patch('app.main.DOCS_DIR', docs), patch('app.main.add_chunks') as mock_add:
+            response = client.post("/rag/ingest/jobs", data={"roles": "sales"}, files=[
+                ("files", ("a.txt", b"alpha text", "text/plain")),
+                ("files", ("b.md", b"# beta", "text/markdown")),
+                ("files", ("c.exe", b"bin", "application/octet-stream")),
+            ])
+            assert response.status_code == 202
+            job_id = response.json()["id"]
+            for _ in range(200):
+                job = client.get(f"/rag/ingest/jobs/{job_id}").json()
+                if job["finished"]:
+                    break
+                time.sleep(0.02)
+            statuses = {f["name"]: f["status"] for f in job["files"]}
+            assert statuses == {"a.txt": "done", "b.md": "done", "c.exe": "failed"}
+            chunks = [c for call in mock_add.call_args_list for c in call.args[0]]
+            assert {c["title"] for c in chunks} == {"a.txt", "b.md"}
+
+    def test_unknown_job_is_404(self):
+        assert client.get("/rag/ingest/jobs/nope").status_code == 404
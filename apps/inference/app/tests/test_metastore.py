@@ -0,0 +1,40 @@
+import json
+from app.metastore import ChunkMeta, ColumnarMeta, convert_jsonl, write_columnar
+from app.store import VectorStore
+import numpy as np
+
+RECORDS = [
+    {"title": "a.md", "path": "/docs/a.md", "roles": ["sales"], "text": "alpha"},
+    {"title": "a.md", "path": "/docs/a.md", "roles": ["sales"], "text": "ünïcode"},
+    {"title": None, "path": "/docs/b.md", "roles": ["all"], "text": "", "page": 2},
+]
+
+def test_roundtrip_and_lazy_access(tmp_path):
+    path = str(tmp_path / "meta.bin")
+    assert write_columnar(path, iter(RECORDS)) == 3
+    cm = ColumnarMeta(path)
+    assert len(cm) == 3
+    assert [cm[i] for i in range(3)] == RECORDS
+    assert cm.text(1) == "ünïcode"
+    assert list(cm.iter_roles()) == [["sales"], ["sales"], ["all"]]
+
+def test_chunk_meta_tail_and_rebase(tmp_path):
+    path = str(tmp_path / "meta.bin")
+    write_columnar(path, RECORDS[:2])
+    cm = ChunkMeta(ColumnarMeta(path))
+    cm.extend([RECORDS[2]])
+    assert len(cm) == 3 and cm[2] == RECORDS[2]
+    assert list(cm.iter_texts()) == ["alpha", "ünïcode", ""]
+    write_columnar(path, iter(cm))
+    rebased = cm.rebase(ColumnarMeta(path))
+    assert rebased.tail == [] and list(rebased) == RECORDS
+
+def test_store_converts_legacy_jsonl(tmp_path):
+    with open(tmp_path / "meta.jsonl", "w", encoding="utf-8") as f:
+        for r in RECORDS:
+            f.write(json.dumps(r) + "\n")
+    assert convert_jsonl(str(tmp_path / "meta.jsonl"), str(tmp_path / "other.bin")) == 3
+    vs = VectorStore(str(tmp_path))
+    assert (tmp_path / "meta.bin").exists()
+    assert vs.get_meta(0)["text"] == "alpha"
+    assert vs.role_mask(["sales"]).tolist() == [True, True, True]
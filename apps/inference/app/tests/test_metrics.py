@@ -0,0 +1,65 @@
+import re
+from fastapi.testclient import TestClient
+from app import metrics
+
+def _sample(text: str, name: str) -> float:
+    m = re.search(rf"^{re.escape(name)} (\S+)$", text, re.M)
+    assert m, f"{name} missing from:\n{text}"
+    return float(m.group(1))
+
+def test_histogram_renders_cumulative_buckets(monkeypatch):
+    monkeypatch.setattr(metrics, "_metrics", [])
+    h = metrics.Histogram("t_seconds", "Test.", ["stage"], buckets=(0.1, 1.0))
+    s = h.labels('a"b')
+    for v in (0.05, 0.5, 0.5, 5):
+        s.observe(v)
+    with h.labels("x").time():
+        pass
+    text = metrics.render()
+    assert "# TYPE t_seconds histogram" in text
+    assert _sample(text, 't_seconds_bucket{stage="a\\"b",le="0.1"}') == 1
+    assert _sample(text, 't_seconds_bucket{stage="a\\"b",le="1.0"}') == 3
+    assert _sample(text, 't_seconds_bucket{stage="a\\"b",le="+Inf"}') == 4
+    assert _sample(text, 't_seconds_count{stage="a\\"b"}') == 4
+    assert _sample(text, 't_seconds_sum{stage="a\\"b"}') == 6.05
+    assert _sample(text, 't_seconds_count{stage="x"}') == 1
+
+def test_counters_and_gauges(monkeypatch):
+    monkeypatch.setattr(metrics, "_metrics", [])
+    c = metrics.Counter("t_tokens_total", "Test.")
+    c.inc(3)
+    c.inc()
+    metrics.Gauge("t_ratio", "Test.", lambda: {"answers": 0.5, "rerank": None}, ["cache"])
+    metrics.Gauge("t_missing", "Test.", lambda: None)
+    metrics.Gauge("t_broken", "Test.", lambda: 1 / 0)
+    text = metrics.render()
+    assert _sample(text, "t_tokens_total") == 4
+    assert _sample(text, 't_ratio{cache="answers"}') == 0.5
+    assert 'cache="rerank"' not in text and not re.search(r"^t_missing ", text, re.M)
+    assert "# t_broken failed" in text
+
+def test_metrics_endpoint_reports_pipeline_stages():
+    from app.main import app
+    from app.rag import add_chunks, _prepare, _retrieve
+    add_chunks([{"text": "metrics endpoint scrape check", "title": "m.md", "path": "/tmp/metrics.md",
+                 "roles": ["all"]}])
+    _retrieve(_prepare("metrics endpoint scrape", ["all"], 1))
+    r = TestClient(app).get("/metrics")
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain")
+    for stage in ("embed", "bm25", "faiss", "fuse", "rerank", "pack"):
+        assert _sample(r.text, f'rag_stage_seconds_count{{stage="{stage}"}}') >= 1
+    for stage in ("embed", "index", "bm25", "retire"):
+        assert _sample(r.text, f'ingest_stage_seconds_count{{stage="{stage}"}}') >= 1
+    assert _sample(r.text, "rag_index_chunks") >= 1
+    assert 'rag_cache_hit_ratio{cache="answers"}' in r.text
+    assert _sample(r.text, "llm_prompt_tokens_total") >= 0
+
+def test_unrecorded_drops_samples_on_this_thread(monkeypatch):
+    monkeypatch.setattr(metrics, "_metrics", [])
+    h = metrics.Histogram("t_seconds", "Test.", buckets=(1.0,))
+    with metrics.unrecorded():
+        h.observe(0.5)
+        with h.time():
+            pass
+    h.observe(0.5)
+    assert _sample(metrics.render(), "t_seconds_count") == 1
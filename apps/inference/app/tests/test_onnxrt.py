@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnx")
+transformers = pytest.importorskip("transformers")
+from app import onnxrt
+
+WORDS = ("how many vacation days do new employees get who approves expense reports rotate the on-call pager "
+         "full-time accrue per year managers approve").split()
+
+@pytest.fixture(scope="module")
+def tiny_models(tmp_path_factory):
+    """A small random BERT embedder and cross-encoder, so nothing is downloaded."""
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+    root = tmp_path_factory.mktemp("models")
+    vocab = {t: i for i, t in enumerate(["[PAD]", "[UNK]", "[CLS]", "[SEP]"] + WORDS)}
+    tok = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tok.pre_tokenizer = pre_tokenizers.Whitespace()
+    tok.post_processor = processors.TemplateProcessing(
+        single="[CLS] $A [SEP]", pair="[CLS] $A [SEP] $B:1 [SEP]:1", special_tokens=[("[CLS]", 2), ("[SEP]", 3)])
+    fast = transformers.PreTrainedTokenizerFast(tokenizer_object=tok, pad_token="[PAD]", unk_token="[UNK]",
+                                                cls_token="[CLS]", sep_token="[SEP]", model_max_length=64)
+    cfg = dict(vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+               intermediate_size=64, max_position_embeddings=64)
+    transformers.BertModel(transformers.BertConfig(**cfg)).save_pretrained(root / "embed")
+    transformers.BertForSequenceClassification(transformers.BertConfig(num_labels=1, **cfg)).save_pretrained(root / "rerank")
+    for kind in onnxrt.KINDS:
+        fast.save_pretrained(root / kind)
+    return root
+
+@pytest.mark.parametrize("kind", onnxrt.KINDS)
+def test_exported_model_matches_torch(tiny_models, tmp_path, kind):
+    report = onnxrt.parity(str(tiny_models / kind), kind, root=str(tmp_path))
+    assert report["ok"] and report["min_cosine"] > 0.999
+
+def test_int8_encoder_stays_close_to_torch(tiny_models, tmp_path):
+    report = onnxrt.parity(str(tiny_models / "embed"), "embed", quantize=True, root=str(tmp_path))
+    assert report["ok"]
+    encoder = onnxrt.load(str(tiny_models / "embed"), "embed", quantize=True, root=str(tmp_path))
+    vecs = encoder.encode(["who approves expense reports", "how many vacation days"])
+    assert vecs.shape == (2, encoder.get_sentence_embedding_dimension()) and vecs.dtype == np.float32
+    assert np.allclose(np.linalg.norm(vecs, axis=1), 1.0, atol=1e-5)
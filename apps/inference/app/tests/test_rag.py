@@ -32,3 +32,133 @@ def test_answer_with_mock_llm(monkeypatch):
     resp = answer("What is the policy?", ["sales"], top_k=1)
     assert "OK" in resp["answer"]
     assert resp["sources"]
+
+def test_aanswer_awaits_async_llm(monkeypatch):
+    import asyncio
+    from app import rag
+    async def fake_agenerate(q, c): return "ASYNC [async.md]"
+    monkeypatch.setattr(rag, "agenerate", fake_agenerate)
+    add_chunks([{"text":"async rollout checklist for engineering","title":"async.md","path":"/tmp/async.md","roles":["engineering"]}])
+    resp = asyncio.run(rag.aanswer("What is on the async rollout checklist?", ["engineering"], top_k=1))
+    assert resp["answer"] == "ASYNC [async.md]"
+    assert resp["sources"][0]["title"] == "async.md"
+    assert resp["usage"]["chunks"] == 1 and resp["usage"]["prompt_tokens"] > resp["usage"]["context_tokens"] > 0
+
+def test_reingest_replaces_previous_chunks():
+    from app import rag
+    chunk = {"title": "r.md", "path": "/tmp/replace-me.md", "roles": ["all"]}
+    add_chunks([{**chunk, "text": "old version one"}, {**chunk, "text": "old version two"}])
+    first = rag._store.ids_for_path("/tmp/replace-me.md")
+    add_chunks([{**chunk, "text": "new version"}])
+    ids = rag._store.ids_for_path("/tmp/replace-me.md")
+    assert len(ids) == 1 and not set(ids) & set(first)
+    assert rag._store.get_meta(ids[0])["text"] == "new version"
+    assert rag.delete_document("/tmp/replace-me.md") == 1
+    assert rag._store.ids_for_path("/tmp/replace-me.md") == []
+
+def test_add_document_streams_batches_and_rolls_back_on_failure():
+    from app import rag
+    path = "/tmp/streamed-manual.md"
+    chunk = {"title": "manual.md", "path": path, "roles": ["all"]}
+    first = [{**chunk, "text": f"manual v1 section {i} describes widget calibration step {i}", "page": i}
+             for i in range(3)]
+    assert rag.add_document(path, iter([first[:2], first[2:]])) == 3
+    v1 = sorted(rag._store.ids_for_path(path))
+    assert [rag._store.get_meta(i)["page"] for i in v1] == [0, 1, 2]
+
+    def failing():
+        yield [{**chunk, "text": "manual v2 introduction to widget maintenance"}]
+        raise ValueError("corrupt page")
+    try:
+        rag.add_document(path, failing())
+    except ValueError:
+        pass
+    # the partial new version is released; the previous version stays
+    assert sorted(rag._store.ids_for_path(path)) == v1
+    rag.delete_document(path)
+
+def test_reload_swaps_snapshot_under_running_queries():
+    from app import rag
+    path = "/tmp/reload-drill.md"
+    add_chunks([{"text": "the reload drill for the on-call rotation", "title": "drill.md", "path": path,
+                 "roles": ["all"]}])
+    req = rag._prepare("What is the reload drill?", ["all"], 1)
+    old = rag._store
+    old.compact()
+    rag._reload()
+    assert rag._store is not old and rag._store.snapshot == old.snapshot
+    # the query started before the swap finishes on the old store
+    assert req["retriever"].store is old and rag._retrieve(req)[0]["path"] == path
+    assert rag.delete_document(path) == 1
+
+def test_stream_failure_after_tokens_is_not_cached(monkeypatch):
+    import asyncio
+    from unittest.mock import AsyncMock, MagicMock
+    from app import rag
+    path = "/tmp/stream-failure.md"
+    add_chunks([{"text": "the quarterly failover rehearsal checklist", "title": "failover.md", "path": path,
+                 "roles": ["all"]}])
+
+    def chunk(text):
+        c = MagicMock()
+        c.choices = [MagicMock()]
+        c.choices[0].delta.content = text
+        return c
+
+    class BrokenStream:
+        def __aiter__(self):
+            async def gen():
+                yield chunk("The rehearsal ")
+                yield chunk("checklist ")
+                raise ConnectionError("upstream reset")
+            return gen()
+        async def close(self):
+            pass
+
+    client = MagicMock()
+    client.chat.completions.create = AsyncMock(return_value=BrokenStream())
+    monkeypatch.setattr(llm, "get_async_client", lambda: client)
+    question = "What is on the quarterly failover rehearsal checklist?"
+
+    async def collect():
+        return [e async for e in rag.astream_answer(question, ["all"], 1)]
+
+    events = asyncio.run(collect())
+    tokens = [d for e, d in events if e == "token"]
+    assert tokens[:2] == ["The rehearsal ", "checklist "] and tokens[2].startswith(llm.ERROR_PREFIX)
+    assert events[-1][0] == "done"
+    assert rag._prepare(question, ["all"], 1)["cached"] is None
+    rag.delete_document(path)
+
+def test_cached_stream_done_event_has_usage(monkeypatch):
+    import asyncio
+    from app import rag
+    path = "/tmp/stream-cached.md"
+    add_chunks([{"text": "the badge reader escalation contacts", "title": "badges.md", "path": path,
+                 "roles": ["all"]}])
+
+    async def fake_astream(q, c):
+        yield "Call "
+        yield "security."
+    monkeypatch.setattr(rag, "astream", fake_astream)
+    question = "Who are the badge reader escalation contacts?"
+
+    async def done():
+        return [d async for e, d in rag.astream_answer(question, ["all"], 1) if e == "done"][0]
+
+    fresh, cached = asyncio.run(done()), asyncio.run(done())
+    assert "cached" not in fresh and cached["cached"] is True
+    assert cached["answer"] == fresh["answer"] == "Call security."
+    assert set(cached["usage"]) == set(fresh["usage"]) and cached["usage"]["prompt_tokens"] == 0
+    rag.delete_document(path)
+
+def test_warmup_leaves_cache_stats_and_stage_latencies_alone():
+    from app import rag
+    from app.metrics import rag_stage
+    rag.add_chunks([{"text": "warmup check about the vacation policy", "title": "w.md",
+                     "path": "/tmp/warmup.md", "roles": ["all"]}])
+    stats = rag.answer_cache.stats()
+    counts = {s: sum(rag_stage.labels(s).counts) for s in ("embed", "answer_cache", "bm25", "rerank")}
+    assert rag._warmup() == len(rag._WARMUP_QUERIES)
+    assert rag.answer_cache.stats()["misses"] == stats["misses"]
+    assert {s: sum(rag_stage.labels(s).counts) for s in counts} == counts
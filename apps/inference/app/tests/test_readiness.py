@@ -0,0 +1,52 @@
+import os, sys, time, threading, subprocess
+import pytest
+from app import readiness
+
+# `import app.main` must stay cheap: models, index and LLM client load after startup
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "3"))
+
+def test_component_loads_once_for_concurrent_callers():
+    calls = []
+    def load():
+        calls.append(1)
+        time.sleep(0.05)
+        return "model"
+    c = readiness.Component("model", load)
+    got = []
+    threads = [threading.Thread(target=lambda: got.append(c.get())) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert got == ["model"] * 4 and len(calls) == 1
+    assert c.status()["state"] == "ready" and c.status()["seconds"] >= 0.05
+
+def test_failed_component_reports_error(monkeypatch):
+    monkeypatch.setattr(readiness, "_components", {})
+    readiness.component("index", lambda: 1)
+    rerank = readiness.component("rerank", lambda: 1 / 0, required=False)
+    assert not readiness.ready()
+    readiness.start()
+    with pytest.raises(RuntimeError, match="ZeroDivisionError"):
+        rerank.get(timeout=5)
+    readiness._components["index"].get(timeout=5)
+    # an optional component that failed does not hold readiness back
+    assert readiness.ready()
+    assert readiness.status()["rerank"]["state"] == "failed"
+
+    llm = readiness.component("llm", lambda: (_ for _ in ()).throw(ValueError("no key")))
+    with pytest.raises(RuntimeError, match="no key"):
+        llm.get(timeout=5)
+    assert not readiness.ready()
+
+def test_import_stays_within_budget(tmp_path):
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    env.update(INDEX_DIR=str(tmp_path / "index"), DOCS_DIR=str(tmp_path / "docs"))
+    code = ("import sys, time; t = time.perf_counter(); import app.main; "
+            "print(time.perf_counter() - t, *(m for m in ('torch', 'sentence_transformers', 'openai') if m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(readiness.__file__)),
+                         env=env, capture_output=True, text=True, timeout=120)
+    assert out.returncode == 0, out.stderr
+    seconds, *heavy = out.stdout.split()
+    assert float(seconds) < IMPORT_BUDGET_SECONDS
+    assert heavy == []
@@ -0,0 +1,48 @@
+from app.rerank import Reranker, rrf_margins
+
+def _hits(scores):
+    return [{"_idx": i, "text": f"chunk {i}", "score": s} for i, s in enumerate(scores)]
+
+class _Model:
+    def __init__(self):
+        self.pairs = 0
+    def __call__(self, pairs):
+        self.pairs += len(pairs)
+        return [float(len(p[1]) + int(p[1].split()[-1])) for p in pairs]
+
+def test_reorders_by_cross_encoder_and_caches_pairs():
+    model = _Model()
+    r = Reranker(model, "ce", cache_entries=100)
+    ranked, report = r.rerank("reset vpn", _hits([0.03, 0.029, 0.028]), k=2)
+    assert [h["_idx"] for h in ranked] == [2, 1, 0]
+    assert report == {"candidates": 3, "pairs_scored": 3, "pairs_cached": 0}
+    # same question with extra whitespace: every pair comes from the cache
+    _, report = r.rerank(" reset  vpn ", _hits([0.03, 0.029, 0.028, 0.01]), k=2)
+    assert report["pairs_scored"] == 1 and report["pairs_cached"] == 3
+    assert model.pairs == 4
+    assert r.stats()["pairs_scored"] == 4
+
+def test_cache_is_keyed_by_model():
+    model = _Model()
+    Reranker(model, "a", cache_entries=100).rerank("q", _hits([0.03, 0.029]), k=1)
+    r = Reranker(model, "b", cache_entries=100)
+    _, report = r.rerank("q", _hits([0.03, 0.029]), k=1)
+    assert report["pairs_scored"] == 2
+
+def test_cascade_skips_clear_winner():
+    model = _Model()
+    r = Reranker(model, "ce", cascade=True, margin=0.3)
+    hits = _hits([2 / 61, 1 / 61, 1 / 62])
+    ranked, report = r.rerank("q", hits, k=2)
+    assert ranked == hits and report["pairs_scored"] == 0 and model.pairs == 0
+    assert r.stats()["skipped"] == 1
+
+def test_cascade_cuts_tail_after_gap_past_k():
+    model = _Model()
+    r = Reranker(model, "ce", cascade=True, margin=0.3)
+    _, report = r.rerank("q", _hits([0.033, 0.032, 0.031, 0.016, 0.0159]), k=2)
+    assert report["pairs_scored"] == 3
+
+def test_margins_relative_to_top():
+    assert rrf_margins([0.04, 0.02, 0.01]) == [0.5, 0.25]
+    assert rrf_margins([]) == []
@@ -0,0 +1,36 @@
+import os
+from app import snapshots
+
+def _publish(index_dir, body, **kw):
+    staging = snapshots.stage(index_dir)
+    with open(os.path.join(staging, "index.faiss"), "wb") as f:
+        f.write(body)
+    return snapshots.publish(index_dir, staging, {"lineage": "l"}, **kw)
+
+def test_publish_verify_and_conflict(tmp_path):
+    d = str(tmp_path)
+    assert snapshots.current(d) is None
+    assert _publish(d, b"one") == 1 and snapshots.current(d) == 1
+    snapshots.verify(d, 1)
+    assert snapshots.manifest(d, 1)["lineage"] == "l"
+    # a publisher that loaded no generation lost the race
+    assert _publish(d, b"two", expect=None) is None
+    assert snapshots.current(d) == 1 and not [n for n in os.listdir(tmp_path / "snapshots") if n.startswith(".staging")]
+    with open(os.path.join(snapshots.path(d, 1), "index.faiss"), "wb") as f:
+        f.write(b"bad")
+    # the cheap check on open compares sizes only
+    snapshots.verify(d, 1, checksums=False)
+    try:
+        snapshots.verify(d, 1)
+        assert False, "corrupt generation verified"
+    except ValueError:
+        pass
+
+def test_collect_keeps_newest_and_grace(tmp_path):
+    d = str(tmp_path)
+    for body in (b"a", b"b", b"c"):
+        _publish(d, body)
+    assert snapshots.collect(d, grace=3600, keep=1) == []
+    assert snapshots.collect(d, grace=0, keep=2) == [1]
+    assert snapshots.collect(d, grace=0, keep=1) == [2]
+    assert snapshots.generations(d) == [3] and snapshots.current(d) == 3
@@ -27,3 +27,161 @@ def test_add_and_search_with_roles():
         assert hits_reload
     finally:
         shutil.rmtree(tmp)
+
+def test_restricted_role_gets_full_top_k():
+    tmp = tempfile.mkdtemp()
+    try:
+        vs = VectorStore(tmp)
+        rng = np.random.default_rng(0)
+        # 200 engineering chunks closer to the query than any of the 5 legal ones
+        q = np.array([[1, 0, 0, 0]], dtype="float32")
+        eng = np.hstack([np.ones((200, 1)), rng.random((200, 3)) * 0.1]).astype("float32")
+        legal = np.hstack([np.zeros((5, 1)), rng.random((5, 3))]).astype("float32")
+        vs.add(eng, [{"text": "e", "title": "E", "roles": ["engineering"]}] * 200)
+        vs.add(legal, [{"text": "l", "title": "L", "roles": ["legal"]}] * 5)
+
+        hits = vs.search(q.copy(), 3, roles=["legal"])
+        assert len(hits) == 3
+        assert all(h["title"] == "L" for h in hits)
+        assert vs.role_mask(["legal"]).sum() == 5
+    finally:
+        shutil.rmtree(tmp)
+
+def _docs(n, path, dim=4, seed=0):
+    x = np.random.default_rng(seed).standard_normal((n, dim)).astype("float32")
+    return x, [{"text": f"{path} {i}", "title": path, "path": path, "roles": ["all"]} for i in range(n)]
+
+def test_delete_tombstones_then_compaction_purges(tmp_path):
+    vs = VectorStore(str(tmp_path))
+    xa, ma = _docs(10, "a.md")
+    xb, mb = _docs(10, "b.md", seed=1)
+    ids_a = vs.add(xa, ma)
+    ids_b = vs.add(xb, mb)
+    assert ids_b[0] == 10
+    gen = vs.generation
+    assert vs.delete_path("a.md") == 10 and vs.generation > gen
+    assert vs.delete(ids_a) == 0  # already gone
+    # hidden immediately, even before any compaction
+    hits = vs.search(xa[:1].copy(), 20, ["all"])
+    assert hits and all(h["path"] == "b.md" for h in hits)
+    assert not vs.role_mask(["all"])[ids_a].any()
+
+    # the deletes survive a restart through the WAL
+    vs2 = VectorStore(str(tmp_path))
+    assert vs2.ids_for_path("a.md") == [] and vs2.generation == vs.generation
+
+    vs.compact()
+    assert vs._index.ntotal == 10 and len(vs.all_meta()) == 10
+    assert vs.stats()["tombstones"] == 0
+    # ids stay stable across the purge and are never reused
+    assert vs.get_meta(ids_b[3])["text"] == "b.md 3"
+    assert vs.add(*_docs(1, "c.md", seed=2)) == [20]
+    reloaded = VectorStore(str(tmp_path))
+    assert reloaded.all_ids().tolist() == ids_b + [20]
+    assert reloaded.search(xb[3:4].copy(), 1, ["all"])[0]["_idx"] == ids_b[3]
+
+def test_purge_keeps_hnsw_and_ivf_labels(tmp_path, monkeypatch):
+    from app import ann
+    monkeypatch.setattr(ann, "ANN_MIN_VECTORS", 200)
+    for kind in ("hnsw", "ivf"):
+        vs = VectorStore(str(tmp_path / kind), index_type=kind)
+        x, metas = _docs(400, "a.md", dim=8)
+        vs.add(x, metas)
+        vs.compact()
+        vs.delete(range(0, 400, 2))
+        vs.compact()
+        assert ann.index_kind(vs._index) == kind and vs._index.ntotal == 200
+        hit = vs.search(x[7:8].copy(), 1, ["all"], nprobe=64)[0]
+        assert hit["_idx"] == 7 and hit["text"] == "a.md 7"
+
+def test_read_only_store_follows_writer(tmp_path, monkeypatch):
+    from app import store as store_mod
+    from app.retriever import HybridRetriever
+    monkeypatch.setattr(store_mod, "SERVING_INDEX", True)
+    writer = VectorStore(str(tmp_path))
+    w_retriever = HybridRetriever(writer)
+    xa, ma = _docs(20, "a.md", dim=8)
+    writer.add(xa, ma)
+    writer.compact()
+    gen_dir = writer.snapshot_dir
+    assert os.path.exists(os.path.join(gen_dir, "serving.faiss")) and os.path.exists(os.path.join(gen_dir, "bm25.bin"))
+
+    reader = VectorStore(str(tmp_path), read_only=True)
+    retriever = HybridRetriever(reader)
+    assert len(retriever._bm25) == 20 and retriever._bm25._frozen == 1  # mapped, not rebuilt
+    from app import ann
+    import faiss
+    assert isinstance(ann.unwrap(reader._index), faiss.IndexIVF)  # the mmap-able serving copy
+    assert reader.search(xa[3:4].copy(), 1, ["all"])[0]["_idx"] == 3
+    try:
+        reader.add(xa[:1], ma[:1])
+        assert False, "reader accepted a write"
+    except PermissionError:
+        pass
+
+    # appends and deletes reach the reader through the WAL
+    xb, mb = _docs(5, "b.md", dim=8, seed=1)
+    w_retriever.extend([m["text"] for m in mb], writer.add(xb, mb))
+    writer.delete_path("a.md")
+    assert reader.refresh() == "append"
+    retriever.extend([])
+    hit = reader.search(xb[2:3].copy(), 1, ["all"])[0]
+    assert hit["_idx"] == 22 and hit["text"] == "b.md 2"
+    assert all(h["path"] == "b.md" for h in reader.search(xa[3:4].copy(), 5, ["all"]))
+    assert retriever._bm25_search("b.md", 10, ["all"]) and not retriever._bm25_search("a.md", 10, ["all"])
+    assert reader.refresh() is None
+
+    # a new snapshot generation is opened by a new store
+    writer.compact()
+    assert not writer.stale() and reader.stale()
+    reader = VectorStore(str(tmp_path), read_only=True)
+    retriever = HybridRetriever(reader)
+    assert reader._tail is None and reader.snapshot == writer.snapshot
+    assert reader.stats()["chunks"] == 5 and reader.search(xb[2:3].copy(), 1, ["all"])[0]["_idx"] == 22
+    assert len(retriever._bm25) == 5 and retriever._bm25._frozen == 1
+
+def test_second_writer_is_refused(tmp_path):
+    import subprocess, sys
+    VectorStore(str(tmp_path))
+    code = f"from app.store import VectorStore; VectorStore({str(tmp_path)!r})"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+    assert out.returncode != 0 and "INDEX_MODE=reader" in out.stderr
+
+def test_writer_takes_over_generation_published_by_cli(tmp_path):
+    import json, faiss
+    from app import snapshots
+    from app.retriever import HybridRetriever
+    old = VectorStore(str(tmp_path))
+    xa, ma = _docs(5, "a.md", dim=8)
+    old.add(xa, ma)
+    old.compact()
+    old.add(xa[:2], ma[:2])  # only in the WAL
+
+    # what workers/ingestion-cli publishes: a plain index and meta.jsonl
+    staging = snapshots.stage(str(tmp_path))
+    xc, mc = _docs(3, "c.md", dim=8, seed=2)
+    flat = faiss.IndexFlatIP(8)
+    flat.add(xc)
+    faiss.write_index(flat, os.path.join(staging, "index.faiss"))
+    with open(os.path.join(staging, "meta.jsonl"), "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(m) + "\n" for m in mc)
+    gen = snapshots.publish(str(tmp_path), staging, {"lineage": "cli-build"})
+    assert old.stale()
+
+    reader = VectorStore(str(tmp_path), read_only=True)  # ahead of the writer
+    assert reader.stats()["chunks"] == 3 and reader.refresh() is None
+    old.close()
+    try:
+        old.add(xa[:1], ma[:1])
+        assert False, "closed store accepted a write"
+    except RuntimeError:
+        pass
+    new = VectorStore(str(tmp_path))
+    HybridRetriever(new)
+    new.seal()
+    # the WAL of the superseded corpus is gone; meta.bin and BM25 are published
+    assert new.snapshot == gen + 1 and new.lineage == "cli-build"
+    assert {"meta.bin", "bm25.bin", "meta.jsonl"} <= set(os.listdir(new.snapshot_dir))
+    assert new.stats()["chunks"] == 3 and new.search(xc[1:2].copy(), 1, ["all"])[0]["text"] == "c.md 1"
+    assert VectorStore(str(tmp_path), read_only=True).stats()["chunks"] == 3
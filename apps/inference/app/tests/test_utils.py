@@ -1,4 +1,4 @@
-from app.utils import chunk_text
+from app.utils import chunk_text, chunk_sections
 
 def test_chunking_overlap_and_size():
     txt = " ".join(["word"]*500)  # ~2000+ chars
@@ -8,3 +8,14 @@ def test_chunking_overlap_and_size():
     assert chunks[0][-50:] in chunks[1]
     # no empties
     assert all(c.strip() for c in chunks)
+
+def test_chunk_sections_tracks_start_page():
+    pages = [(p, " ".join([f"p{p}w"] * 100)) for p in (1, 2, 3)]
+    chunks = list(chunk_sections(pages, chunk_size=200, overlap=50))
+    assert [p for p, _ in chunks] == sorted(p for p, _ in chunks)
+    assert {p for p, _ in chunks} == {1, 2, 3}
+    # each chunk reports the page its first whole word comes from
+    assert all(next(w for w in c.split() if w.startswith("p")) == f"p{p}w" for p, c in chunks)
+    # a single section chunks exactly like chunk_text
+    txt = " ".join(["word"] * 500)
+    assert [c for _, c in chunk_sections([(None, txt)], 200, 50)] == chunk_text(txt, 200, 50)
@@ -1,16 +1,35 @@
 import re
+from typing import Iterable, Iterator, Optional, Tuple
 
-def chunk_text(text: str, chunk_size: int = 800, overlap: int = 120):
-  words = re.split(r"(\s+)", text)
-  chunks, cur, cur_len = [], [], 0
-  for tok in words:
-      cur.append(tok); cur_len += len(tok)
-      if cur_len >= chunk_size:
-          s = "".join(cur).strip()
-          if s: chunks.append(s)
-          back = "".join(cur)[-overlap:]
-          cur, cur_len = [back], len(back)
+def chunk_sections(sections: Iterable[Tuple[Optional[int], str]], chunk_size: int = 800,
+                   overlap: int = 120) -> Iterator[Tuple[Optional[int], str]]:
+  """Chunk a stream of ``(page, text)`` sections; yields ``(page, chunk)`` with
+  the page each chunk starts on. Only one section is held in memory."""
+  cur, pages, cur_len = [], [], 0
+  for i, (page, text) in enumerate(sections):
+      if i:
+          cur.append("\n"); pages.append(page); cur_len += 1
+      for tok in re.split(r"(\s+)", text):
+          cur.append(tok); pages.append(page); cur_len += len(tok)
+          if cur_len >= chunk_size:
+              s = "".join(cur).strip()
+              if s: yield _first_page(cur, pages), s
+              back = "".join(cur)[-overlap:]
+              # the carried overlap starts on the page of the token it begins in
+              k, n = len(cur), 0
+              while k > 0 and n < len(back):
+                  k -= 1; n += len(cur[k])
+              cur, pages, cur_len = [back], [pages[k]], len(back)
   if cur:
       s = "".join(cur).strip()
-      if s: chunks.append(s)
-  return [c for c in chunks if c]
+      if s: yield _first_page(cur, pages), s
+
+def _first_page(tokens, pages):
+  return next((p for t, p in zip(tokens, pages) if t.strip()), pages[0])
+
+def chunk_text(text: str, chunk_size: int = 800, overlap: int = 120):
+  return [c for _, c in chunk_sections([(None, text)], chunk_size, overlap)]
+
+def normalize_query(text: str) -> str:
+    """Collapse whitespace so trivially different questions share cache keys."""
+    return " ".join(text.split())
@@ -0,0 +1,153 @@
+import os, json, struct, zlib, logging
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# payload_len, crc32(payload), start_id, n_rows, dim (0 marks a delete record)
+_HEADER = struct.Struct("<IIQII")
+
+def fsync_dir(path: str):
+    """Persist directory entries (new/renamed files) on POSIX filesystems."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:  # pragma: no cover - e.g. Windows
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class WriteAheadLog:
+    """Append-only, segmented log of ``VectorStore.add`` batches.
+
+    Each add record holds the chunk id of its first row, the float32 vectors
+    and the metadata dicts; a delete record holds the tombstoned chunk ids.
+    Records are fsynced before ``append`` returns, so an add is durable
+    without rewriting the snapshot. ``rotate`` starts a new segment; once a
+    snapshot covers everything before that segment, ``drop_before`` deletes
+    the older ones. A torn record at the tail (crash mid-append) is
+    truncated away on replay.
+
+    A ``read_only`` log follows another process's appends: it never writes or
+    truncates (a short tail may be a record still being written), and
+    ``replay`` resumes from where the previous call stopped.
+    """
+
+    def __init__(self, wal_dir: str, read_only: bool = False):
+        self.wal_dir = wal_dir
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(wal_dir, exist_ok=True)
+        segs = self.segments()
+        self._seg = segs[-1] if segs else 1
+        self._f = None
+        self.position: Tuple[int, int] = (0, 0)  # (segment, offset) replayed up to
+
+    def segments(self) -> List[int]:
+        if not os.path.isdir(self.wal_dir):
+            return []
+        return sorted(int(n[:-4]) for n in os.listdir(self.wal_dir) if n.endswith(".log") and n[:-4].isdigit())
+
+    def _path(self, seg: int) -> str:
+        return os.path.join(self.wal_dir, f"{seg:08d}.log")
+
+    def _file(self):
+        if self.read_only:
+            raise PermissionError(f"{self.wal_dir} is opened read-only")
+        if self._f is None:
+            new = not os.path.exists(self._path(self._seg))
+            self._f = open(self._path(self._seg), "ab")
+            if new:
+                fsync_dir(self.wal_dir)
+        return self._f
+
+    def append(self, start_id: int, vectors: np.ndarray, metas: List[Dict[str, Any]]):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        meta_bytes = json.dumps(metas, ensure_ascii=False).encode("utf-8")
+        payload = struct.pack("<I", len(meta_bytes)) + meta_bytes + vectors.tobytes()
+        header = _HEADER.pack(len(payload), zlib.crc32(payload), start_id, vectors.shape[0], vectors.shape[1])
+        f = self._file()
+        f.write(header + payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+    def append_delete(self, ids: List[int]):
+        payload_ids = json.dumps([int(i) for i in ids]).encode("utf-8")
+        payload = struct.pack("<I", len(payload_ids)) + payload_ids
+        f = self._file()
+        f.write(_HEADER.pack(len(payload), zlib.crc32(payload), 0, len(ids), 0) + payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(self._path(s)) for s in self.segments())
+
+    def rotate(self) -> int:
+        """Close the current segment and direct new appends to a fresh one."""
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        self._seg += 1
+        return self._seg
+
+    def drop_before(self, seg: int):
+        for s in self.segments():
+            if s < seg:
+                os.remove(self._path(s))
+        fsync_dir(self.wal_dir)
+
+    def reset(self):
+        """Delete every segment (the log of a superseded snapshot) and start over."""
+        self.close()
+        for s in self.segments():
+            os.remove(self._path(s))
+        fsync_dir(self.wal_dir)
+        self._seg, self.position = 1, (0, 0)
+
+    def replay(self, resume: bool = False) -> Iterator[Tuple[int, Optional[np.ndarray], List[Any]]]:
+        """Yield ``(start_id, vectors, metas)`` for every intact record, oldest first.
+
+        Delete records come back as ``(0, None, ids)``. With ``resume`` only
+        records after ``position`` (where the last replay stopped) are read.
+        """
+        since_seg, since_off = self.position if resume else (0, 0)
+        for seg in self.segments():
+            if seg < since_seg:
+                continue
+            path = self._path(seg)
+            good = since_off if seg == since_seg else 0
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:  # dropped by the writer's compaction
+                continue
+            with f:
+                f.seek(good)
+                while True:
+                    header = f.read(_HEADER.size)
+                    if len(header) < _HEADER.size:
+                        break
+                    length, crc, start_id, n, dim = _HEADER.unpack(header)
+                    payload = f.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        break
+                    (meta_len,) = struct.unpack_from("<I", payload)
+                    metas = json.loads(payload[4:4 + meta_len].decode("utf-8"))
+                    good = f.tell()
+                    self.position = (seg, good)
+                    if dim == 0:
+                        yield 0, None, metas
+                        continue
+                    vectors = np.frombuffer(payload, dtype="float32", offset=4 + meta_len).reshape(n, dim)
+                    yield start_id, vectors, metas
+            self.position = (seg, good)
+            if not self.read_only and good < os.path.getsize(path):
+                logger.warning(f"Truncating torn WAL tail in {path} at byte {good}")
+                with open(path, "r+b") as f:
+                    f.truncate(good)
+                    os.fsync(f.fileno())
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
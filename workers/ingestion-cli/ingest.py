@@ -1,12 +1,18 @@
-import os, glob, io, argparse, json
+import os, sys, glob, io, argparse, json, shutil, time, uuid, queue, threading, multiprocessing, itertools
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import faiss
 from pypdf import PdfReader
 from docx import Document as Docx
 from markdown import markdown
 from bs4 import BeautifulSoup
 
+# index kinds and file formats are the inference service's
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "apps", "inference"))
+from app import ann, exact, snapshots
+from app.embcache import EmbeddingCache
+from app.store import SERVING_INDEX
+
 def chunk_text(text, size=800, overlap=120):
     out, i = [], 0
     while i < len(text):
@@ -29,38 +35,346 @@ def extract(path: str) -> str:
         return BeautifulSoup(html, "html.parser").get_text("\n")
     return data.decode("utf-8", errors="ignore")
 
+MANIFEST = "manifest.json"
+
+def load_manifest(index_dir: str):
+    try:
+        with open(os.path.join(index_dir, MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_manifest(index_dir: str, manifest: dict):
+    path = os.path.join(index_dir, MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+def scan(files: list, old: dict) -> tuple:
+    """Compare ``files`` with the manifest's file table.
+
+    Files whose size and mtime match are trusted without hashing; others are
+    hashed so a touched-but-identical file is not re-embedded. Returns
+    (new file table, paths to ingest, paths to keep, deleted paths).
+    """
+    table, changed, unchanged = {}, [], set()
+    for path in files:
+        st = os.stat(path)
+        prev = old.get(path)
+        if prev and prev["size"] == st.st_size and prev["mtime"] == st.st_mtime_ns:
+            table[path] = prev
+            unchanged.add(path)
+            continue
+        digest = snapshots.file_sha256(path)
+        table[path] = {"sha256": digest, "size": st.st_size, "mtime": st.st_mtime_ns}
+        if prev and prev["sha256"] == digest:
+            unchanged.add(path)
+        else:
+            changed.append(path)
+    deleted = [p for p in old if p not in table]
+    return table, changed, unchanged, deleted
+
+def kept_batches(index, meta_path: str, keep: set, block: int = 4096):
+    """Yield (vectors, metas) of the existing chunks whose file is in ``keep``,
+    in row order, reading the old index and meta.jsonl block by block. Lossy
+    indexes are read from their float32 side file when it covers every row."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    side = os.path.join(os.path.dirname(meta_path), exact.FILENAME)
+    stored = np.load(side, mmap_mode="r") if os.path.exists(side) else None
+    if stored is not None and len(stored) != index.ntotal:
+        stored = None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        row = 0
+        while True:
+            metas = [json.loads(line) for line in itertools.islice(f, block)]
+            if not metas: break
+            vecs = (np.array(stored["vec"][row:row + len(metas)]) if stored is not None
+                    else index.reconstruct_n(row, len(metas)))
+            sel = [i for i, m in enumerate(metas) if m.get("path") in keep]
+            if sel:
+                yield vecs[sel], [metas[i] for i in sel]
+            row += len(metas)
+
+def extract_chunks(path: str, roles: list) -> list:
+    """Worker: extract and chunk one file into metadata records."""
+    try:
+        text = extract(path)
+    except Exception as e:
+        print(f"skip {path}: {e}", file=sys.stderr)
+        return []
+    title = os.path.basename(path)
+    return [{"title": title, "path": path, "roles": roles, "text": t} for t in chunk_text(text)]
+
+class IndexWriter:
+    """Writes vectors and metadata for a new snapshot generation of
+    ``index_dir`` as batches arrive.
+
+    Metadata streams to ``meta.jsonl.tmp``. Flat and HNSW indexes take vectors
+    directly; IVF and SQ8 kinds need the full corpus to train, so their vectors
+    spill to a float32 file that is trained on (a sample) and added back in
+    batches. Lossy kinds also spill to keep the vectors as ``vectors.npy``
+    for exact re-scoring (unless ``RESCORE_FACTOR=0``). Files go to a staging
+    directory that ``commit`` publishes, unless another process made a
+    generation other than ``base`` current in the meantime.
+    """
+
+    def __init__(self, index_dir: str, kind: str, dim: int, batch_size: int = 256, trained=None,
+                 base: int = None):
+        self.index_dir, self.kind, self.dim, self.batch_size = index_dir, kind, dim, batch_size
+        self.base = base
+        self.out = snapshots.stage(index_dir)
+        self.meta_tmp = os.path.join(self.out, "meta.jsonl.tmp")
+        self.spill_path = os.path.join(self.out, "vectors.f32.tmp")
+        self._meta = open(self.meta_tmp, "w", encoding="utf-8")
+        # an already trained (empty) index needs no spill, unless it is lossy
+        spill = (ann.is_lossy(kind) and ann.RESCORE_FACTOR) or (ann.needs_training(kind) and trained is None)
+        self._spill = open(self.spill_path, "wb") if spill else None
+        self.index = trained
+        if trained is None and not self._spill:
+            self.index = ann.new_index(kind, dim)
+        self.count = 0
+
+    def add(self, embs: np.ndarray, metas: list):
+        for m in metas:
+            self._meta.write(json.dumps(m, ensure_ascii=False) + "\n")
+        if self._spill:
+            self._spill.write(np.ascontiguousarray(embs, dtype="float32").tobytes())
+        else:
+            self.index.add(embs)
+        self.count += len(metas)
+
+    def _train_from_spill(self):
+        self._spill.close()
+        if self.index is None:
+            self.index = ann.new_index(self.kind, self.dim, self.count)
+        if not self.count:
+            os.remove(self.spill_path)
+            return
+        vecs = np.memmap(self.spill_path, dtype="float32", mode="r", shape=(self.count, self.dim))
+        if not self.index.is_trained:
+            # FAISS samples at most 256 points per centroid anyway
+            ivf = faiss.try_extract_index_ivf(self.index)
+            sample = min(self.count, 256 * ivf.nlist if ivf is not None else 65536)
+            rows = np.sort(np.random.default_rng(0).choice(self.count, sample, replace=False))
+            self.index.train(np.ascontiguousarray(vecs[rows]))
+        for i in range(0, self.count, self.batch_size * 16):
+            self.index.add(np.ascontiguousarray(vecs[i:i + self.batch_size * 16]))
+        if ann.is_lossy(self.kind) and ann.RESCORE_FACTOR:
+            # labelled 0..n-1, like the rows of the index
+            step = 65536
+            blocks = ((np.arange(i, min(i + step, self.count)), vecs[i:i + step]) for i in range(0, self.count, step))
+            exact.write_vectors(os.path.join(self.out, exact.FILENAME), self.dim, self.count, blocks)
+        del vecs
+        os.remove(self.spill_path)
+
+    def commit(self, manifest: dict = None) -> int:
+        self._meta.close()
+        if self._spill:
+            self._train_from_spill()
+        faiss.write_index(self.index, os.path.join(self.out, "index.faiss"))
+        if SERVING_INDEX:
+            # rows are labelled 0..n-1, as the service reads an index without ids
+            index = ann.with_ids(self.index)
+            serving = ann.serving_index(index)
+            if serving is not None and serving is not index:
+                faiss.write_index(serving, os.path.join(self.out, "serving.faiss"))
+        os.replace(self.meta_tmp, os.path.join(self.out, "meta.jsonl"))
+        # a new lineage: chunk ids start over, so the service drops its WAL and
+        # other state keyed by the old ones when it loads this
+        gen = snapshots.publish(self.index_dir, self.out, {"lineage": uuid.uuid4().hex}, expect=self.base)
+        if gen is None:
+            raise SystemExit("another snapshot was published meanwhile; run ingest again")
+        print(f"published snapshot generation {gen}", file=sys.stderr)
+        snapshots.collect(self.index_dir)
+        if manifest is not None:
+            write_manifest(self.index_dir, manifest)
+        return self.count
+
+    def abort(self):
+        self._meta.close()
+        if self._spill:
+            self._spill.close()
+        shutil.rmtree(self.out, ignore_errors=True)
+
+class Progress:
+    def __init__(self, files: int, every: float = 5.0):
+        self.files, self.every = files, every
+        self.files_done = self.chunks = 0
+        self.t0 = self._last = time.monotonic()
+
+    def update(self, files: int = 0, chunks: int = 0, force: bool = False):
+        self.files_done += files
+        self.chunks += chunks
+        now = time.monotonic()
+        if force or now - self._last >= self.every:
+            self._last = now
+            rate = self.chunks / max(now - self.t0, 1e-9)
+            print(f"{self.files_done}/{self.files} files, {self.chunks} chunks, "
+                  f"{rate:.1f} chunks/s, {now - self.t0:.0f}s", file=sys.stderr, flush=True)
+
+_DONE, _FILE_DONE = object(), object()
+
+def produce(files: list, roles: list, workers: int, out: "queue.Queue"):
+    """Extract files on a process pool, at most ``2 * workers`` in flight, and
+    feed chunk records into the bounded ``out`` queue (which applies backpressure)."""
+    try:
+        # spawn: never fork a process that is running torch threads
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            pending = set()
+            it = iter(files)
+            while True:
+                while len(pending) < workers * 2:
+                    path = next(it, None)
+                    if path is None: break
+                    pending.add(pool.submit(extract_chunks, path, roles))
+                if not pending: break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    for m in fut.result():
+                        out.put(m)
+                    out.put(_FILE_DONE)
+    except BaseException as e:
+        out.put(e)
+    finally:
+        out.put(_DONE)
+
+def ingest(files: list, index_dir: str, roles: list, model, kind: str = "flat",
+           workers: int = 1, batch_size: int = 256, queue_size: int = 4096,
+           keep=(), trained=None, manifest: dict = None, allow_empty: bool = False,
+           cache: EmbeddingCache = None, base: int = None) -> int:
+    """Pipelined ingest: extraction on ``workers`` processes, embedding in
+    ``batch_size`` batches, incremental writes. Memory stays bounded by the
+    queue, in-flight files and one batch, independent of corpus size.
+
+    ``keep`` yields (vectors, metas) of existing chunks to carry over before
+    the new files; ``trained`` is an empty, trained index to add them to.
+    Texts found in ``cache`` are not re-encoded. The result is published
+    only if ``base`` is still the current snapshot generation.
+    Returns the number of chunks embedded in this run.
+    """
+    writer = IndexWriter(index_dir, kind, model.get_sentence_embedding_dimension(), batch_size, trained, base)
+    try:
+        for embs, metas in keep:
+            writer.add(embs, metas)
+        kept = writer.count
+        progress = Progress(len(files))
+        q: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        if files:
+            threading.Thread(target=produce, args=(files, roles, workers, q), daemon=True).start()
+        else:
+            q.put(_DONE)
+        batch = []
+
+        def encode(texts):
+            return model.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                                normalize_embeddings=True).astype("float32")
+
+        def flush():
+            texts = [m["text"] for m in batch]
+            embs = cache.encode(texts, encode) if cache is not None else encode(texts)
+            writer.add(embs, batch)
+            progress.update(chunks=len(batch))
+            batch.clear()
+
+        while True:
+            item = q.get()
+            if item is _DONE: break
+            if isinstance(item, BaseException): raise item
+            if item is _FILE_DONE:
+                progress.update(files=1)
+                continue
+            batch.append(item)
+            if len(batch) >= batch_size: flush()
+        if batch: flush()
+        if not writer.count and not allow_empty:
+            writer.abort()
+            return 0
+        if files:
+            progress.update(force=True)
+        writer.commit(manifest)
+        return writer.count - kept
+    except BaseException:
+        writer.abort()
+        raise
+
+def plan(files: list, args) -> dict:
+    """Decide between a delta run and a full rebuild.
+
+    A delta run needs a manifest written with the same model, index type and
+    roles, and a current snapshot with meta.jsonl whose row count matches
+    the index (snapshots the inference service compacted uploads into have
+    neither).
+    """
+    manifest = {"model": args.model, "index_type": args.index_type, "roles": args.roles, "files": {}}
+    old = None if args.full else load_manifest(args.index)
+    gen = snapshots.current(args.index)
+    # an index from before generations lives in the directory itself
+    src = snapshots.path(args.index, gen) if gen is not None else args.index
+    idx_path, meta_path = os.path.join(src, "index.faiss"), os.path.join(src, "meta.jsonl")
+    settings = ("model", "index_type", "roles")
+    if old is None or any(old.get(k) != manifest[k] for k in settings) \
+            or not os.path.exists(idx_path) or not os.path.exists(meta_path):
+        manifest["files"], changed, _, _ = scan(files, {})
+        return {"delta": False, "manifest": manifest, "changed": changed, "base": gen}
+    index = faiss.read_index(idx_path)
+    with open(meta_path, "rb") as f:
+        rows = sum(1 for _ in f)
+    if index.ntotal != rows:
+        print(f"index has {index.ntotal} vectors but meta.jsonl {rows} rows; rebuilding", file=sys.stderr)
+        manifest["files"], changed, _, _ = scan(files, {})
+        return {"delta": False, "manifest": manifest, "changed": changed, "base": gen}
+    manifest["files"], changed, unchanged, deleted = scan(files, old["files"])
+    trained = None
+    if ann.needs_training(args.index_type):
+        trained = faiss.clone_index(index)
+        trained.reset()  # keeps the trained quantizers
+    return {"delta": True, "manifest": manifest, "changed": changed, "unchanged": unchanged,
+            "deleted": deleted, "index": index, "meta_path": meta_path, "trained": trained, "base": gen}
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--docs", default=os.getenv("DOCS_DIR", "./docs"))
     ap.add_argument("--index", default=os.getenv("INDEX_DIR", "./index"))
     ap.add_argument("--roles", default=os.getenv("ROLES", "all"))
     ap.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
+    ap.add_argument("--index-type", default=os.getenv("INDEX_TYPE", "flat"), choices=ann.INDEX_TYPES)
+    ap.add_argument("--workers", type=int, default=int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1))),
+                    help="extraction processes")
+    ap.add_argument("--batch-size", type=int, default=int(os.getenv("INGEST_BATCH_SIZE", "256")),
+                    help="chunks per embedding batch")
+    ap.add_argument("--queue-size", type=int, default=4096, help="max chunks waiting for embedding")
+    ap.add_argument("--full", action="store_true", help="ignore the manifest and rebuild everything")
+    ap.add_argument("--embed-cache", default=os.getenv("EMBED_CACHE_DIR"),
+                    help="embedding cache directory (default <index>/embcache, shared with the inference service)")
+    ap.add_argument("--no-embed-cache", action="store_true", help="always re-encode every chunk")
     args = ap.parse_args()
 
     os.makedirs(args.index, exist_ok=True)
-    meta_path = os.path.join(args.index, "meta.jsonl")
-    idx_path = os.path.join(args.index, "index.faiss")
-    metas, vectors = [], []
-
+    files = sorted(p for p in glob.glob(os.path.join(args.docs, "**/*.*"), recursive=True) if not os.path.isdir(p))
+    p = plan(files, args)
+    if p["delta"]:
+        print(f"delta: {len(p['changed'])} new/changed, {len(p['deleted'])} deleted, "
+              f"{len(p['unchanged'])} unchanged", file=sys.stderr)
+        if not p["changed"] and not p["deleted"]:
+            write_manifest(args.index, p["manifest"])  # refresh mtimes of touched files
+            print("ok: up to date"); return
+        keep = kept_batches(p["index"], p["meta_path"], p["unchanged"])
+    else:
+        keep = ()
+    from sentence_transformers import SentenceTransformer  # not needed in extraction workers
     model = SentenceTransformer(args.model)
-    for path in glob.glob(os.path.join(args.docs, "**/*.*"), recursive=True):
-        if os.path.isdir(path): continue
-        text = extract(path)
-        ch = chunk_text(text)
-        roles = args.roles.split(",")
-        for t in ch:
-            metas.append({"title": os.path.basename(path), "path": path, "roles": roles, "text": t})
-            vectors.append(t)
-
-    if not vectors:
+    cache = None if args.no_embed_cache else EmbeddingCache(
+        args.embed_cache or os.path.join(args.index, "embcache"), args.model)
+    n = ingest(p["changed"], args.index, args.roles.split(","), model, args.index_type,
+               args.workers, args.batch_size, args.queue_size,
+               keep=keep, trained=p.get("trained"), manifest=p["manifest"], allow_empty=p["delta"],
+               cache=cache, base=p["base"])
+    if not n and not p["delta"]:
         print("no docs"); return
-
-    embs = model.encode(vectors, convert_to_numpy=True, normalize_embeddings=True).astype("float32")
-    index = faiss.IndexFlatIP(embs.shape[1]); index.add(embs)
-    faiss.write_index(index, idx_path)
-    with open(meta_path, "w", encoding="utf-8") as f:
-        for m in metas: f.write(json.dumps(m, ensure_ascii=False) + "\n")
-    print(f"ok: {len(metas)} chunks")
+    print(f"ok: {n} chunks embedded" + (f" ({cache.hits} from the embedding cache)" if cache else ""))
 
 if __name__ == "__main__":
     main()